@@ -0,0 +1,385 @@
+'''
+Checks and benchmarks of the slowest parts of the project.
+Usage: python bench.py <name> [arguments...], where name is one of
+the keys of BENCHMARKS.
+'''
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+import billboard
+
+
+def record_pages(dirname: str = '.') -> None:
+    '''Saves the current billboard pages at dirname (page1.html, ...),
+    to check and time the parsers always with the same pages.'''
+    session = billboard._session(1, billboard.RETRIES)
+    for i, url in enumerate(billboard.URLS):
+        content = billboard._fetch(session, url, billboard.TIMEOUT)
+        file = open(f'{dirname}/page{i + 1}.html', 'wb')
+        file.write(content)
+        file.close()
+
+
+def check_parsers(*filenames: str) -> None:
+    '''Checks that all the billboard parsers give the same cinemas, films
+    and projections for the recorded pages at filenames, and prints the
+    time each parser takes.'''
+    for filename in filenames:
+        file = open(filename, 'rb')
+        content = file.read()
+        file.close()
+
+        results = {}
+        for name, parse in billboard.PARSERS.items():
+            t = time.perf_counter()
+            results[name] = list(parse(content))
+            print(f'{filename} {name}: {time.perf_counter() - t:.3f} s, ' +
+                  f'{len(results[name])} cinemas')
+
+        first = next(iter(results.values()))
+        assert all(r == first for r in results.values()), \
+            f'{filename}: the parsers give different billboards'
+
+
+def bench_ingestion(*sizes: str) -> None:
+    '''Times adding to a billboard synthetic cinemas with the given numbers
+    of distinct films (each film is shown in 3 cinemas), to check that the
+    ingestion time per film doesn't grow with the number of films.'''
+    for n in map(int, sizes or ('100', '1000', '10000')):
+        batches: list[billboard.ProjectionBatch] = []
+        for c in range(30):
+            cinema = billboard.Cinema(f'Cinema {c}', 'Barcelona', (0, 0))
+            films = []
+            for i in range(c, 3 * n, 30):
+                film = billboard.Film(f'Film {i // 3}', ['Drama'],
+                                      f'Director {i // 3}', ['Actor'])
+                films.append((film, [billboard._projection_at(
+                    film, cinema, 20 * 60, 22 * 60, 'V.O.')]))
+            batches.append(billboard.ProjectionBatch(cinema, 0, films))
+
+        bboard = billboard.Billboard([], [], [], set())
+        t = time.perf_counter()
+        for batch in batches:
+            bboard.add(batch)
+        t = time.perf_counter() - t
+        assert len(bboard.films) == n
+        print(f'{n} films: {t:.4f} s, {t / n * 1e6:.2f} us per film')
+
+
+@dataclass
+class _OldProjection:
+    '''Layout of the projections before they stored minutes in slots.'''
+    film: billboard.Film
+    cinema: billboard.Cinema
+    start: tuple[int, int]
+    end: tuple[int, int]
+    duration: int
+    language: str
+
+
+def bench_memory(n: str = '1000000') -> None:
+    '''Prints the memory used by n projections with the old layout
+    and with the current one.'''
+    film = billboard.Film('Film', ['Drama'], 'Director', ['Actor'])
+    cinema = billboard.Cinema('Cinema', 'Barcelona', (0, 0))
+
+    def old(i: int) -> _OldProjection:
+        s, d = 600 + i % 800, 80 + i % 100
+        return _OldProjection(film, cinema, divmod(s, 60),
+                              divmod((s + d) % billboard.DAY, 60), d, 'V.O.')
+
+    def new(i: int) -> billboard.Projection:
+        s, d = 600 + i % 800, 80 + i % 100
+        return billboard._projection_at(film, cinema, s,
+                                        (s + d) % billboard.DAY, 'V.O.')
+
+    for name, build in (('old', old), ('new', new)):
+        tracemalloc.start()
+        projections = [build(i) for i in range(int(n))]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del projections
+        print(f'{name}: {size / 1e6:.1f} MB for {n} projections')
+
+
+def bench_routes(n: str = '20', osmnx_file: str = 'osmnx_Bcn.pickle') -> None:
+    '''Times n routes between pairs of cinemas with city.find_path
+    (Dijkstra over the city graph, with networkx and with routing.Router)
+    and with the transit router.'''
+    import random
+    import city
+    import routing
+    import transit
+    from constants import cinemas_coords
+
+    streets = city.load_osmnx_graph(osmnx_file)
+    g = city.build_city_graph(streets, city.get_buses_graph())
+    router = routing.Router(routing.to_csr(g))
+    net = transit.build_network()
+    pairs = [random.sample(list(cinemas_coords.values()), 2)
+             for _ in range(int(n))]
+
+    for name, find in (
+            ('find_path', lambda src, dst: city.find_path(
+                streets, g, src, dst)),
+            ('find_path, router', lambda src, dst: city.find_path(
+                None, None, src, dst, router)),
+            ('transit', lambda src, dst: transit.fastest(net, src, dst))):
+        t = time.perf_counter()
+        minutes = [find(src, dst).time for src, dst in pairs]
+        t = time.perf_counter() - t
+        print(f'{name}: {t / int(n) * 1000:.1f} ms per route, ' +
+              f'{sum(minutes) / int(n):.1f} min on average')
+
+
+def bench_links(osmnx_file: str = 'osmnx_Bcn.pickle',
+                processes: str = '4') -> None:
+    '''Times the street distances of the bus edges of the city graph with
+    one nx.shortest_path_length per edge, as build_city_graph did, and with
+    city.street_lengths (in one process and in a pool). It needs the
+    streets and the AMB data of Barcelona.'''
+    import networkx as nx
+    import osmnx as ox
+    import city
+
+    streets = city.load_osmnx_graph(osmnx_file)
+    buses = city.get_buses_graph()
+    stops = list(buses.nodes)
+    nearest = dict(zip(stops, ox.nearest_nodes(
+        streets, [buses.nodes[u]['pos'][0] for u in stops],
+        [buses.nodes[u]['pos'][1] for u in stops])))
+    pairs = [(nearest[u], nearest[v]) for u, v in buses.edges]
+
+    t = time.perf_counter()
+    old = {(i, j): nx.shortest_path_length(streets, i, j, weight='length')
+           for i, j in pairs}
+    print(f'{len(pairs)} edges, one search per edge: ' +
+          f'{time.perf_counter() - t:.1f} s')
+
+    for n in (0, int(processes)):
+        t = time.perf_counter()
+        new = city.street_lengths(streets, pairs, n)
+        print(f'street_lengths, {n or 1} processes: ' +
+              f'{time.perf_counter() - t:.1f} s')
+        assert all(abs(new[p] - old[p]) < 1e-6 for p in pairs)
+
+
+def bench_router(n: str = '200', dirname: str = 'city_Bcn') -> None:
+    '''Times n shortest paths between random nodes of the saved city graph
+    with networkx and with routing.Router, and the memory each one
+    allocates. Also prints what the Router costs to copy the arrays of the
+    graph to python lists in each process, and what walking the arrays
+    themselves would cost: the times of a few trees (Router.tree) searched
+    in the lists and in the arrays.'''
+    import random
+    from heapq import heappop, heappush
+    import networkx as nx
+    import numpy as np
+    import routing
+
+    csr = routing.load_csr(dirname)
+    g = csr.to_city_graph()
+    tracemalloc.start()
+    t = time.perf_counter()
+    router = routing.Router(csr)
+    t = time.perf_counter() - t
+    lists = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    arrays = sum(getattr(csr, name).nbytes
+                 for name in ('offsets', 'targets', 'times', 'coords'))
+    print(f'Router: {t:.2f} s to build, {lists / 1e6:.1f} MB of lists in '
+          f'each process ({arrays / 1e6:.1f} MB of shared arrays)')
+
+    def tree_on_arrays(dst: int) -> np.ndarray:
+        offsets, targets, times = csr.offsets, csr.targets, csr.times
+        dist = np.full(len(csr), np.inf)
+        dist[dst] = 0.0
+        heap = [(0.0, dst)]
+        while heap:
+            d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            for k in range(offsets[u], offsets[u + 1]):
+                v, w = targets[k], times[k] + d
+                if w < dist[v]:
+                    dist[v] = w
+                    heappush(heap, (w, v))
+        return dist
+
+    roots = [random.randrange(len(csr)) for _ in range(3)]
+    for name, tree in (('lists', lambda u: router.tree(u)[0]),
+                       ('arrays', tree_on_arrays)):
+        t = time.perf_counter()
+        for u in roots:
+            tree(u)
+        print(f'tree on the {name}: '
+              f'{(time.perf_counter() - t) / len(roots):.2f} s')
+
+    pairs = [(random.randrange(len(csr)), random.randrange(len(csr)))
+             for _ in range(int(n))]
+
+    def networkx(src: int, dst: int) -> float:
+        path = nx.shortest_path(g, csr.ids[src], csr.ids[dst],
+                                weight='time', method='dijkstra')
+        return nx.path_weight(g, path, 'time')
+
+    for name, find in (('networkx', networkx),
+                       ('router', lambda u, v: router.shortest_path(u, v)[1])):
+        tracemalloc.start()
+        t = time.perf_counter()
+        times = [find(u, v) for u, v in pairs]
+        t = time.perf_counter() - t
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{name}: {t / int(n) * 1000:.2f} ms per query, ' +
+              f'{peak / 1e6:.1f} MB peak, {sum(times):.0f} s in total')
+
+
+def bench_snap(n: str = '1000', dirname: str = 'city_Bcn',
+               osmnx_file: str = 'osmnx_Bcn.pickle') -> None:
+    '''Times finding the nearest street node to n random points of
+    Barcelona with ox.nearest_nodes and with the spatial index of the
+    saved city graph, and counts the points where they differ.'''
+    import random
+    import numpy as np
+    import osmnx as ox
+    import city
+    import routing
+
+    grid = routing.load_csr(dirname).grid
+    streets = city.load_osmnx_graph(osmnx_file)
+    points = np.array([(random.uniform(41.35, 41.45),
+                        random.uniform(2.10, 2.22)) for _ in range(int(n))])
+
+    t = time.perf_counter()
+    for lat, lon in points:
+        ox.nearest_nodes(streets, lon, lat)
+    print(f'ox.nearest_nodes: {(time.perf_counter() - t) / int(n) * 1e6:.0f}'
+          ' us per point')
+
+    t = time.perf_counter()
+    nodes, _ = grid.snap_many(points)
+    print(f'snap: {(time.perf_counter() - t) / int(n) * 1e6:.0f} us per point')
+
+    expected = ox.nearest_nodes(streets, points[:, 1], points[:, 0])
+    different = sum(u != v for u, v in zip(nodes, expected))
+    print(f'{different} of {n} points snapped to another node')
+
+
+ORIGINS = {  # fixed origins of the routes to the cinemas
+    'Sants Estació': (41.3791, 2.1402),
+    'Plaça Catalunya': (41.3870, 2.1701),
+    'Sagrada Família': (41.4036, 2.1744),
+    'Park Güell': (41.4145, 2.1527),
+    'Camp Nou': (41.3809, 2.1228),
+    'Barceloneta': (41.3790, 2.1894),
+    'Glòries': (41.4036, 2.1874),
+    'Campus Nord UPC': (41.3890, 2.1134),
+}
+
+
+def bench_methods(dirname: str = 'city_Bcn') -> None:
+    '''Times the routes from each of the ORIGINS to each cinema with each
+    method of routing.Router, and counts the nodes settled, next to the
+    search that city.find_path does without a router (nx.shortest_path
+    over the city graph, and the sum of the times of its edges).'''
+    import networkx as nx
+    import routing
+    from constants import cinemas_coords
+
+    csr = routing.load_csr(dirname)
+    try:
+        hierarchy = routing.load_hierarchy(dirname)
+    except (OSError, ValueError):  # not built yet (see bench_ch)
+        hierarchy = None
+    router = routing.Router(csr, hierarchy)
+    pairs = [(csr.index[csr.grid.snap(src)[0]],
+              csr.index[csr.grid.snap(dst)[0]])
+             for src in ORIGINS.values() for dst in cinemas_coords.values()]
+
+    g = csr.to_city_graph()
+    t = time.perf_counter()
+    times: dict[str, list[float]] = {'networkx': []}
+    for u, v in pairs:
+        path = nx.shortest_path(g, csr.ids[u], csr.ids[v], weight='time',
+                                method='dijkstra')
+        times['networkx'].append(nx.path_weight(g, path, 'time'))
+    t = time.perf_counter() - t
+    print(f'networkx (find_path): {t / len(pairs) * 1000:.2f} ms per route')
+
+    for method in routing.METHODS:
+        if method == 'ch' and hierarchy is None:
+            continue
+        times[method] = []
+        settled = 0
+        t = time.perf_counter()
+        for u, v in pairs:
+            times[method].append(router.shortest_path(u, v, method)[1])
+            settled += router.settled
+        t = time.perf_counter() - t
+        print(f'{method}: {t / len(pairs) * 1000:.2f} ms per route, ' +
+              f'{settled / len(pairs):.0f} nodes settled')
+
+    first = times['networkx']
+    assert all(abs(a - b) < 1e-6 * max(a, 1)
+               for other in times.values() for a, b in zip(first, other))
+
+
+def bench_ch(n: str = '200', dirname: str = 'city_Bcn') -> None:
+    '''Builds the contraction hierarchy of the saved city graph and saves
+    it there, and prints the time it took, its memory next to the one of
+    the graph and the time of n shortest paths with and without it. The
+    hierarchy is only used by the benchmarks (bench_methods), not by the
+    demo.'''
+    import random
+    import routing
+
+    csr = routing.load_csr(dirname)
+    t = time.perf_counter()
+    hierarchy = routing.build_hierarchy(csr)
+    print(f'build_hierarchy: {time.perf_counter() - t:.1f} s')
+    routing.save_hierarchy(hierarchy, dirname)
+
+    graph = sum(getattr(csr, name).nbytes for name in routing.ARRAYS)
+    shortcuts = int((hierarchy.middles >= 0).sum())
+    extra = sum(getattr(hierarchy, name).nbytes
+                for name in routing.CH_ARRAYS)
+    print(f'{shortcuts} shortcuts, {extra / 1e6:.1f} MB ' +
+          f'(the graph takes {graph / 1e6:.1f} MB)')
+
+    router = routing.Router(csr, routing.load_hierarchy(dirname))
+    pairs = [(random.randrange(len(csr)), random.randrange(len(csr)))
+             for _ in range(int(n))]
+    times: dict[str, list[float]] = {}
+    for method in ('dijkstra', 'ch'):
+        settled = 0
+        t = time.perf_counter()
+        times[method] = []
+        for u, v in pairs:
+            times[method].append(router.shortest_path(u, v, method)[1])
+            settled += router.settled
+        t = time.perf_counter() - t
+        print(f'{method}: {t / int(n) * 1000:.2f} ms per query, ' +
+              f'{settled / int(n):.0f} nodes settled')
+    assert all(abs(a - b) < 1e-6 * max(a, 1)
+               for a, b in zip(times['dijkstra'], times['ch']))
+
+
+BENCHMARKS = {
+    'record': record_pages,
+    'parsers': check_parsers,
+    'ingestion': bench_ingestion,
+    'memory': bench_memory,
+    'routes': bench_routes,
+    'links': bench_links,
+    'router': bench_router,
+    'snap': bench_snap,
+    'methods': bench_methods,
+    'ch': bench_ch,
+}
+
+
+if __name__ == "__main__":
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
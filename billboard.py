@@ -1,15 +1,47 @@
 import requests
 import json
-from dataclasses import dataclass
-from bs4 import BeautifulSoup as BSoup
-from typing import TypeAlias
+import os
+import pickle
+import sys
+import tempfile
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from threading import Thread
+import numpy as np
+from bs4 import BeautifulSoup as BSoup, FeatureNotFound
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from typing import TypeAlias, Iterator, Callable
+from urllib3.util.retry import Retry
 from constants import cinemas_coords
 
 
 Coord:  TypeAlias = tuple[float, float]   # (latitude, longitude)
 
+LANGUAGES = ('V.O.', 'Spanish')  # possible languages of a projection
+DAY = 24 * 60  # minutes in a day
+MIN_SCORE = 0.3  # minimum similarity of the search results
+_MINUTES = tuple(range(2 * DAY))  # shared int objects for the times
 
-@dataclass
+URLS = [
+    "https://www.sensacine.com/cines/cines-en-72480/",
+    "https://www.sensacine.com/cines/cines-en-72480/?page=2",
+    "https://www.sensacine.com/cines/cines-en-72480/?page=3"]
+TIMEOUT = 10  # seconds for each request
+RETRIES = 3  # times a failed request is repeated
+
+SNAPSHOT_VERSION = 3  # format of the files written by save_snapshot()
+SNAPSHOT_TTL = 6 * 60 * 60  # seconds before a snapshot is refreshed
+# seconds after which a snapshot is too old to be used while it is refreshed
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+
+@dataclass(slots=True)
 class Film:
     title: str
     genres: list[str]
@@ -17,21 +49,90 @@ class Film:
     actors: list[str]
 
 
-@dataclass
+@dataclass(slots=True)
 class Cinema:
     name: str
     address: str
     coord: Coord
 
 
-@dataclass
+@dataclass(slots=True, init=False)
 class Projection:
     film: Film
     cinema: Cinema
-    start: tuple[int, int]  # start time
-    end: tuple[int, int]  # end time
-    duration: int  # minutes
+    start_min: int  # start time, in minutes since midnight
+    # end time, in minutes since the midnight before the start (more than
+    # 24 * 60 if the projection ends after midnight)
+    end_min: int
     language: str  # V.O or Spanish
+    day: int = 0  # day of the billboard (0 is today, 1 tomorrow...)
+
+    def __init__(self, film: Film, cinema: Cinema, start_min: int,
+                 end_min: int, language: str, day: int = 0) -> None:
+        '''Constructor. The old form, Projection(film, cinema, (h, m),
+        (h, m), duration, language), is still accepted: then the times are
+        taken from the start and the duration.'''
+        if isinstance(start_min, tuple):
+            if not isinstance(language, int) or not isinstance(day, str):
+                raise TypeError('expected Projection(film, cinema, start, '
+                                'end, duration, language) with (h, m) times')
+            start = start_min[0] * 60 + start_min[1]
+            start_min, end_min = _MINUTES[start], _MINUTES[start + language]
+            language, day = day, 0
+        self.film = film
+        self.cinema = cinema
+        self.start_min = start_min
+        self.end_min = end_min
+        self.language = language
+        self.day = day
+
+    @property
+    def start(self) -> tuple[int, int]:
+        '''Start time as (hours, minutes).'''
+        return divmod(self.start_min % DAY, 60)
+
+    @property
+    def end(self) -> tuple[int, int]:
+        '''End time as (hours, minutes).'''
+        return divmod(self.end_min % DAY, 60)
+
+    @property
+    def duration(self) -> int:
+        '''Duration in minutes.'''
+        return self.end_min - self.start_min
+
+
+def _projection_at(film: Film, cinema: Cinema, start: int, end: int,
+                   language: str, day: int = 0) -> Projection:
+    '''Builds a projection from its start and end times in minutes since
+    midnight. If the end is before the start the projection ends the next
+    day. The minutes are taken from _MINUTES, so that all the projections
+    share the same int objects.'''
+    if end < start:
+        end += DAY
+    return Projection(film, cinema, _MINUTES[start], _MINUTES[end],
+                      language, day)
+
+
+@dataclass(slots=True)
+class ProjectionBatch:
+    '''The projections of a cinema in a day of the billboard,
+    grouped by film.'''
+    cinema: Cinema
+    day: int
+    films: list[tuple[Film, list[Projection]]]
+
+    @property
+    def projections(self) -> list[Projection]:
+        return [p for _, projections in self.films for p in projections]
+
+
+@dataclass
+class Registry:
+    '''Interning tables of a billboard: all the projections of a film
+    (or of a cinema) share the same Film (or Cinema) object.'''
+    films: dict[tuple[str, str], Film]  # {(title, director): film}
+    cinemas: dict[str, Cinema]  # {name: cinema}
 
 
 @dataclass
@@ -41,6 +142,14 @@ class Billboard:
     projections: list[Projection]
     poss_filters: list[str]  # llista de possibles filtres que es poden aplicar
     genres: set[str]  # conjunt dels diferents gèneres de les películes
+    registry: Registry = field(compare=False, repr=False)
+    # índexs per dimensió: {dimensió: {valor: {ids de projeccions}}}
+    _index: dict[str, dict] | None = \
+        field(compare=False, repr=False)
+    # índex dels horaris de les projeccions
+    _times: 'IntervalIndex' = field(compare=False, repr=False)
+    # índex de cerca aproximada de pel·lícules, directors i cinemes
+    _search: 'SearchIndex' = field(compare=False, repr=False)
 
     def __init__(self, f: list[Film] = [], c: list[Cinema] = [],
                  p: list[Projection] = [], g: set[str] = set()):
@@ -50,65 +159,237 @@ class Billboard:
         self.cinemas = c
         self.projections = p
         self.poss_filters = ['genre', 'director', 'film', 'cinema',
-                             'time', 'duration', 'language', 'city']
+                             'time', 'duration', 'language', 'city', 'day']
         self.genres = g
+        self.registry = Registry({_film_key(x): x for x in f},
+                                 {x.name: x for x in c})
+        self._index = None
+        self._times = IntervalIndex([])
+        self._search = SearchIndex([])
 
-    def filter(self, filters: dict[str, str]) -> list[Projection]:
+    def add(self, batch: ProjectionBatch) -> None:
+        '''Adds a cinema, its films and their projections to the billboard.
+        Films and cinemas already in the billboard are not added again, and
+        the projections are changed to refer to the ones of the billboard.
+        '''
+        cinema = batch.cinema
+        if cinema.name in self.registry.cinemas:
+            cinema = self.registry.cinemas[cinema.name]
+        else:
+            self.registry.cinemas[cinema.name] = cinema
+            self.cinemas.append(cinema)
+
+        for film, projections in batch.films:
+            key = _film_key(film)
+            if key in self.registry.films:
+                film = self.registry.films[key]
+            else:
+                # the genres, directors and actors repeat across films:
+                # they are interned, so each one is a single string
+                film.genres = [sys.intern(g) for g in film.genres]
+                film.director = sys.intern(film.director)
+                film.actors = [sys.intern(a) for a in film.actors]
+                self.registry.films[key] = film
+                self.films.append(film)
+                for genre in film.genres:
+                    self.genres.add(genre)
+
+            for p in projections:
+                p.film = film
+                p.cinema = cinema
+            self.projections.extend(projections)
+
+    def build_indexes(self) -> None:
+        '''Builds the indexes used by filter(). The projections are sorted
+        by start time and their ids are their positions in self.projections,
+        so this has to be called again whenever the projections change.'''
+
+        self.projections.sort(key=lambda t: (t.day, t.start_min))
+        index: dict[str, dict] = {
+            'cinema': {}, 'film': {}, 'director': {},
+            'language': {}, 'genre': {}, 'city': {}, 'day': {}}
+
+        for i, p in enumerate(self.projections):
+            index['cinema'].setdefault(p.cinema.name, set()).add(i)
+            index['film'].setdefault(p.film.title, set()).add(i)
+            index['director'].setdefault(p.film.director, set()).add(i)
+            index['language'].setdefault(p.language, set()).add(i)
+            index['day'].setdefault(p.day, set()).add(i)
+            # the city filter matches substrings of the address, so we
+            # index the full addresses and resolve the city when querying
+            index['city'].setdefault(p.cinema.address, set()).add(i)
+            for g in p.film.genres:
+                index['genre'].setdefault(g, set()).add(i)
+
+        self._index = index
+        self._times = IntervalIndex([(p.start_min, p.end_min)
+                                     for p in self.projections])
+        self._search = SearchIndex(
+            [('film', f.title) for f in self.films] +
+            [('director', d) for d in {f.director for f in self.films}] +
+            [('cinema', c.name) for c in self.cinemas])
+
+    def search(self, query: str, kind: str | None = None,
+               limit: int = 5) -> list['SearchResult']:
+        '''Returns the films, directors and cinemas (or only the ones of
+        the given kind: 'film', 'director' or 'cinema') whose names are
+        most similar to the query, from the most to the least similar.
+        Case, accents and punctuation are ignored.'''
+        if self._index is None:
+            self.build_indexes()
+        return self._search.search(query, kind, limit)
+
+    def compile_filter(self, filters: dict[str, str]) -> 'FilterPlan':
+        '''Parses and validates the given filter ({filter_type: filter},
+        see filter()) and returns it as a FilterPlan, so that it can be
+        applied many times (also to other billboards) without parsing it
+        again. Raises ValueError if the filter is not valid.'''
+
+        try:
+            assert all([k in self.poss_filters for k in filters.keys()])
+            plan = FilterPlan()
+
+            if 'time' in filters:
+                s, e = filters['time'].split('-')
+                start, end = _minutes(s), _minutes(e)
+                if end < start:  # the interval ends after midnight
+                    end += DAY
+                plan.time = (start, end)
+            if 'duration' in filters:
+                plan.duration = int(filters['duration'])
+            if 'genre' in filters:
+                plan.genres = frozenset(filters['genre'].split('-'))
+            if 'language' in filters:
+                assert filters['language'] in LANGUAGES
+                plan.language = filters['language']
+            if 'day' in filters:
+                plan.day = int(filters['day'])
+                assert plan.day >= 0
+            plan.cinema = filters.get('cinema')
+            plan.film = filters.get('film')
+            plan.director = filters.get('director')
+            plan.city = filters.get('city')
+
+            return plan
+
+        except Exception:
+            raise ValueError
+
+    def filter(self, filters: 'dict[str, str] | FilterPlan'
+               ) -> list[Projection]:
         '''Returns the billboard applying the given filter. The possible types
          of filters are in the self.poss_filters list. The format is:
-         {filter_type: filter}.
+         {filter_type: filter}, or a FilterPlan from compile_filter().
          - The time filter returns projections that
          they start and end within the time indicated, and the format is:
-         {time: hh:mm-hh:mm} (start-end).
+         {time: hh:mm-hh:mm} (start-end). If the end is before the start,
+         the interval ends the next day and it also includes the
+         projections after midnight that end before the end.
          - The duration filter returns all duration projections
          equal to or less than given, in minutes.
          The genre filter returns all projections that are of
          given genres, and the format is: {genre: genre1-genre2-...}. they can
-         give multiple genders. All other filters work as expected.
+         give multiple genders.
+         - The day filter returns the projections of the given day of the
+         billboard (0 is today, 1 tomorrow...). Without it, only the
+         projections of today are returned, so that the times of different
+         days are not mixed. All other filters work as expected.
         '''
 
+        if not isinstance(filters, FilterPlan):
+            filters = self.compile_filter(filters)
+        plan: FilterPlan = filters
+
         try:
-            assert all([k in self.poss_filters for k in filters.keys()])
+            if self._index is None:
+                self.build_indexes()
+
+            # candidate sets from the indexes, most selective first: the
+            # smallest one is copied and the others are intersected into
+            # it, so each step costs the size of what is left
+            candidates = sorted(self._candidates(plan), key=len)
+            ids: set[int] = set(candidates[0])
+            for c in candidates[1:]:
+                if not ids:
+                    return []
+                ids &= c
 
-            return [x for x in self.projections if
-                    all([self._apply_filter(x, f) for f in filters.items()])]
+            # the duration filter is not indexed, so we check the
+            # candidates
+            return [self.projections[i] for i in sorted(ids)
+                    if self.matches(self.projections[i], plan)]
 
         except Exception:
             raise ValueError
 
-    def _filter_time(self, x: Projection, filter: str) -> bool:
+    def _candidates(self, plan: 'FilterPlan') -> list[set[int]]:
+        '''Returns, for each filter of the plan, the ids of the projections
+        that can pass it, using the indexes built by build_indexes().'''
+        assert self._index is not None
+        candidates: list[set[int]] = [self._index['day'].get(plan.day, set())]
+
+        if plan.time is not None:
+            candidates.append(set(self._times.within(*plan.time)))
+        if plan.genres is not None:
+            candidates.append(set.intersection(
+                *[self._index['genre'].get(g, set()) for g in plan.genres]))
+        if plan.city is not None:
+            ids: set[int] = set()
+            for address, s in self._index['city'].items():
+                if plan.city in address:
+                    ids |= s
+            candidates.append(ids)
+        for key in ('cinema', 'film', 'director', 'language'):
+            value = getattr(plan, key)
+            if value is not None:
+                candidates.append(self._index[key].get(value, set()))
+
+        return candidates
+
+    def matches(self, x: Projection, plan: 'FilterPlan') -> bool:
+        '''Returns True if the projection x passes all the filters
+        of the plan.'''
+        return (x.day == plan.day and
+                (plan.time is None or self._filter_time(x, plan.time)) and
+                (plan.duration is None or
+                 self._filter_duration(x, plan.duration)) and
+                (plan.cinema is None or
+                 self._filter_cinema(x, plan.cinema)) and
+                (plan.genres is None or
+                 self._filter_genre(x, plan.genres)) and
+                (plan.film is None or self._filter_film(x, plan.film)) and
+                (plan.language is None or
+                 self._filter_language(x, plan.language)) and
+                (plan.director is None or
+                 self._filter_director(x, plan.director)) and
+                (plan.city is None or self._filter_city(x, plan.city)))
+
+    def _filter_time(self, x: Projection, filter: tuple[int, int]) -> bool:
         '''Apply the schedule filter to the projection x.
         Returns True if the schedule of the
-        given projection is included within the filter.
+        given projection is included within the filter
+        (start and end, in minutes since midnight).
         '''
-        s, e = filter.split('-')
-        start = tuple(map(int, s.split(':')))
-        end: tuple[int, int] = tuple(map(int, e.split(':')))
+        start, end = filter
+        # if the interval ends after midnight, the projections
+        # starting after midnight are also included in it
+        return (start <= x.start_min and x.end_min <= end) or \
+            (end > DAY and x.end_min <= end - DAY)
 
-        # we need to check separated cases, because a film can
-        # start and end on diferent days:
-        if end < start:
-            return (start <= x.start) and \
-                        (start <= x.end <= (end[0]+24, end[1]))
-        elif x.end < x.start:
-            return (start <= x.start) and \
-                        (start <= (x.end[0]+24, x.end[1]) <= end)
-        return (start <= x.start) and (start <= x.end <= end)
-
-    def _filter_duration(self, x: Projection, filter: str) -> bool:
+    def _filter_duration(self, x: Projection, filter: int) -> bool:
         '''Duration filter. Returns true if the projection x
         has a duration equal to or less than the given one'''
-        return x.duration <= int(filter)
+        return x.duration <= filter
 
     def _filter_cinema(self, x: Projection, filter: str) -> bool:
         '''Cinema Filter. Returns True if the name of the cinema of the
         projection it's equal to the given one.'''
         return x.cinema.name == filter
 
-    def _filter_genre(self, x: Projection, filter: str) -> bool:
-        '''Genre Filter. Returns True if the genre of the film of the
-        projection x is included within the given genre.'''
-        return all([g in x.film.genres for g in filter.split('-')])
+    def _filter_genre(self, x: Projection, filter: frozenset[str]) -> bool:
+        '''Genre Filter. Returns True if the film of the projection x
+        is of all the given genres.'''
+        return filter.issubset(x.film.genres)
 
     def _filter_film(self, x: Projection, filter: str) -> bool:
         '''Film Filter. Returns True if the name of the film of the
@@ -123,109 +404,657 @@ class Billboard:
     def _filter_director(self, x: Projection, filter: str) -> bool:
         '''Director Filter. Returns True if the director of the film of the
         projection x it's the given one.'''
-        return x.language == filter
+        return x.film.director == filter
 
     def _filter_city(self, x: Projection, filter: str) -> bool:
         '''City Filter. Returns True if the cinema of the projection x
         is in the given city.'''
         return filter in x.cinema.address
 
-    def _apply_filter(self, x: Projection, flt: tuple[str, str]) -> bool:
-        '''Applies de filter given to the projection x by redirecting
-        it to the specific filter functions.'''
 
-        return getattr(self, '_filter_' + flt[0])(x, flt[1])
+class IntervalIndex:
+    '''Static index of the intervals [start, end] (in minutes) of the
+    projections, answering which intervals are within or overlap a given
+    time window in O(log n + k) time, where k is the number of answers.
 
+    The intervals are sorted by start, so the ones starting within a window
+    are a range of positions, and sparse tables give the position with the
+    minimum (or maximum) end of any range in O(1). The answers of a range are
+    reported by recursively splitting it at its minimum (or maximum) end,
+    stopping when it doesn't pass the condition.'''
 
-def read() -> Billboard:
-    '''Function that downloads the necessary data
-    and returns the current day's billboard.
-    '''
-    bboard: Billboard = Billboard()
+    def __init__(self, intervals: list[tuple[int, int]]) -> None:
+        '''Constructor. The id of each interval is its position in the
+        given list.'''
+        self._ids = sorted(range(len(intervals)), key=lambda i: intervals[i])
+        self._starts = [intervals[i][0] for i in self._ids]
+        self._ends = [intervals[i][1] for i in self._ids]
+        self._max_duration = max((e - s for s, e in intervals), default=0)
+        self._min_end = self._sparse_table(lowest=True)
+        self._max_end = self._sparse_table(lowest=False)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _sparse_table(self, lowest: bool) -> list[list[int]]:
+        '''Returns the table t where t[k][i] is the position of the lowest
+        (or highest) end in the positions [i, i + 2**k).'''
+        ends = self._ends
+        table = [list(range(len(ends)))]
+        k = 1
+        while 2 ** k <= len(ends):
+            prev, half = table[-1], 2 ** (k - 1)
+            table.append([
+                a if (ends[a] <= ends[b]) == lowest else b
+                for a, b in zip(prev, prev[half:])])
+            k += 1
+        return table
+
+    def _report(self, lo: int, hi: int, lowest: bool,
+                passes: Callable[[int], bool]) -> list[int]:
+        '''Returns the ids of the positions in [lo, hi) whose end passes the
+        condition, given that the lowest (or highest) end of a range passes
+        it if any end of the range does.'''
+        table = self._min_end if lowest else self._max_end
+        ends = self._ends
+        ids: list[int] = []
+        ranges = [(lo, hi)]
+        while ranges:
+            lo, hi = ranges.pop()
+            if lo >= hi:
+                continue
+            k = (hi - lo).bit_length() - 1
+            a, b = table[k][lo], table[k][hi - 2 ** k]
+            i = a if (ends[a] <= ends[b]) == lowest else b
+            if passes(ends[i]):
+                ids.append(self._ids[i])
+                ranges.append((lo, i))
+                ranges.append((i + 1, hi))
+        return ids
+
+    def within(self, start: int, end: int) -> list[int]:
+        '''Returns the ids of the intervals that start and end within
+        [start, end] (in minutes since midnight). If end is before start,
+        or after midnight, the window ends the next day, and it also
+        contains the intervals that start after midnight.'''
+        if end < start:
+            end += DAY
+
+        lo = bisect_left(self._starts, start)
+        hi = bisect_right(self._starts, end)
+        ids = self._report(lo, hi, True, lambda e: e <= end)
+        if end > DAY:
+            hi = bisect_right(self._starts, end - DAY)
+            ids += self._report(0, hi, True, lambda e: e <= end - DAY)
+        return sorted(ids)
+
+    def overlapping(self, start: int, end: int) -> list[int]:
+        '''Returns the ids of the intervals that overlap the window
+        [start, end] (in minutes since midnight). As in within(), the window
+        can end after midnight. The intervals that end after midnight also
+        overlap the windows after midnight where they are still going on.'''
+        if end < start:
+            end += DAY
+
+        hi = bisect_right(self._starts, end)
+        ids = set(self._report(0, hi, False, lambda e: e >= start))
+        if end > DAY:  # intervals of the next day, within the window
+            hi = bisect_right(self._starts, end - DAY)
+            ids.update(self._report(0, hi, False,
+                                    lambda e: e >= start - DAY))
+        # intervals of the day before, still going on at the window: they
+        # end after start + DAY, so they start after start + DAY minus the
+        # longest duration
+        lo = bisect_left(self._starts, start + DAY - self._max_duration)
+        ids.update(self._report(lo, len(self), False,
+                                lambda e: e >= start + DAY))
+        return sorted(ids)
+
+
+@dataclass(slots=True)
+class SearchResult:
+    kind: str  # 'film', 'director' or 'cinema'
+    name: str
+    score: float  # 1 if it is equal to the query (ignoring case, accents...)
+
+
+class SearchIndex:
+    '''Index of names for approximate search. The names are folded
+    (lowercase, without accents nor punctuation) and split in trigrams, and
+    the candidates of a query are the names that share some trigram with it,
+    ranked by the Dice coefficient of their trigrams.'''
+
+    def __init__(self, entries: list[tuple[str, str]]) -> None:
+        '''Constructor. entries is a list of (kind, name).'''
+        self._entries = entries
+        self._folded = [_fold(name) for _, name in entries]
+        self._sizes: list[int] = []
+        self._postings: dict[str, list[int]] = {}
+
+        for i, folded in enumerate(self._folded):
+            grams = _trigrams(folded)
+            self._sizes.append(len(grams))
+            for g in grams:
+                self._postings.setdefault(g, []).append(i)
+
+    def search(self, query: str, kind: str | None = None,
+               limit: int = 5) -> list[SearchResult]:
+        '''Returns the (at most limit) entries most similar to the query,
+        of the given kind if any. Entries that only share a few trigrams
+        with the query are not returned.'''
+        folded = _fold(query)
+        grams = _trigrams(folded)
+        shared: dict[int, int] = {}
+        for g in grams:
+            for i in self._postings.get(g, []):
+                shared[i] = shared.get(i, 0) + 1
+
+        results: list[SearchResult] = []
+        for i, n in shared.items():
+            k, name = self._entries[i]
+            if kind is not None and k != kind:
+                continue
+            if self._folded[i] == folded:
+                score = 1.0
+            else:
+                score = 2 * n / (len(grams) + self._sizes[i])
+                if folded in self._folded[i]:  # part of the name
+                    score = (1 + score) / 2
+                score = min(score, 0.99)
+            if score >= MIN_SCORE:
+                results.append(SearchResult(k, name, score))
+
+        results.sort(key=lambda r: (-r.score, r.name))
+        return results[:limit]
+
+
+def _fold(text: str) -> str:
+    '''Returns the text in lowercase, without accents nor punctuation
+    and with single spaces between words.'''
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c if c.isalnum() else ' ' for c in text
+                   if not unicodedata.combining(c))
+    return ' '.join(text.split())
+
+
+def _trigrams(text: str) -> set[str]:
+    '''Returns the trigrams of the (folded) text, padded with spaces
+    so that short words also have trigrams.'''
+    text = f'  {text} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+@dataclass
+class FilterPlan:
+    '''A filter already parsed and validated by Billboard.compile_filter().
+    It doesn't depend on the projections of the billboard, so the same plan
+    can be applied many times and to refreshed billboards.
+    None means that the filter is not applied.'''
+    # (min_start, max_end) in minutes since midnight; max_end is more
+    # than 24 * 60 if the interval ends after midnight
+    time: tuple[int, int] | None = None
+    duration: int | None = None  # max duration in minutes
+    genres: frozenset[str] | None = None
+    language: str | None = None  # one of LANGUAGES
+    cinema: str | None = None
+    film: str | None = None
+    director: str | None = None
+    city: str | None = None
+    day: int = 0  # day of the billboard (0 is today, 1 tomorrow...)
 
-    urls = [
-        "https://www.sensacine.com/cines/cines-en-72480/",
-        "https://www.sensacine.com/cines/cines-en-72480/?page=2",
-        "https://www.sensacine.com/cines/cines-en-72480/?page=3"]
 
-    for url in urls:
+def _minutes(t: str) -> int:
+    '''Returns the minutes since midnight of the time t (hh:mm).'''
+    h, m = map(int, t.split(':'))
+    assert 0 <= h < 24 and 0 <= m < 60
+    return h * 60 + m
+
+
+@dataclass
+class ProjectionTable:
+    '''The projections of a billboard stored by columns in NumPy arrays, to
+    filter big billboards with vectorized operations. Row i is the i-th
+    projection of the billboard, and the Projection objects are only built
+    by rows() for the rows that are needed.'''
+    films: list[Film]
+    cinemas: list[Cinema]
+    genre_bits: dict[str, int]  # {genre: bit of the genre in the masks}
+    start: np.ndarray  # minutes since midnight
+    end: np.ndarray  # minutes since midnight (> start)
+    duration: np.ndarray  # minutes
+    language: np.ndarray  # position in LANGUAGES
+    cinema: np.ndarray  # position in self.cinemas
+    film: np.ndarray  # position in self.films
+    genres: np.ndarray  # bitmask of the genres of the film
+    day: np.ndarray  # day of the billboard
+
+    def __init__(self, bboard: Billboard) -> None:
+        '''Constructor. Builds the columns from the billboard.'''
+
+        self.films = list(bboard.films)
+        self.cinemas = list(bboard.cinemas)
+        films = {_film_key(f): i for i, f in enumerate(self.films)}
+        cinemas = {c.name: i for i, c in enumerate(self.cinemas)}
+
+        genres = sorted({g for f in self.films for g in f.genres})
+        assert len(genres) <= 64, 'the genre masks have 64 bits'
+        self.genre_bits = {g: 1 << i for i, g in enumerate(genres)}
+        film_genres = [sum(self.genre_bits[g] for g in set(f.genres))
+                       for f in self.films]
+
+        projections = bboard.projections
+        self.start = np.array([p.start_min for p in projections],
+                              dtype=np.int16)
+        self.end = np.array([p.end_min for p in projections],
+                            dtype=np.int16)
+        self.duration = self.end - self.start
+        self.day = np.array([p.day for p in projections], dtype=np.int8)
+        self.language = np.array([LANGUAGES.index(p.language)
+                                  for p in projections], dtype=np.int8)
+        self.cinema = np.array([cinemas[p.cinema.name]
+                                for p in projections], dtype=np.int32)
+        self.film = np.array([films[_film_key(p.film)]
+                              for p in projections], dtype=np.int32)
+        self.genres = np.array(film_genres, dtype=np.uint64)[self.film] \
+            if len(projections) > 0 else np.zeros(0, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def mask(self, plan: FilterPlan) -> np.ndarray:
+        '''Returns a boolean array with the rows that pass all the filters
+        of the plan (same semantics as Billboard.filter()).'''
+        mask = self.day == plan.day
+
+        if plan.time is not None:
+            s, e = plan.time
+            mask &= ((s <= self.start) & (self.end <= e)) | \
+                ((e > DAY) & (self.end <= e - DAY))
+        if plan.duration is not None:
+            mask &= self.duration <= plan.duration
+        if plan.language is not None:
+            mask &= self.language == LANGUAGES.index(plan.language)
+        if plan.genres is not None:
+            if all(g in self.genre_bits for g in plan.genres):
+                bits = np.uint64(sum(self.genre_bits[g] for g in plan.genres))
+                mask &= (self.genres & bits) == bits
+            else:
+                mask[:] = False
+        if plan.cinema is not None:
+            mask &= np.isin(self.cinema, [i for i, c in enumerate(self.cinemas)
+                                          if c.name == plan.cinema])
+        if plan.city is not None:
+            mask &= np.isin(self.cinema, [i for i, c in enumerate(self.cinemas)
+                                          if plan.city in c.address])
+        if plan.film is not None:
+            mask &= np.isin(self.film, [
+                i for i, f in enumerate(self.films) if f.title == plan.film])
+        if plan.director is not None:
+            mask &= np.isin(self.film, [
+                i for i, f in enumerate(self.films)
+                if f.director == plan.director])
+
+        return mask
+
+    def rows(self, rows: np.ndarray) -> list[Projection]:
+        '''Builds the projections of the given rows (a boolean mask or an
+        array of row numbers).'''
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+
+        return [_projection_at(self.films[self.film[i]],
+                               self.cinemas[self.cinema[i]],
+                               int(self.start[i]), int(self.end[i]),
+                               LANGUAGES[self.language[i]], int(self.day[i]))
+                for i in rows]
+
+    def filter(self, plan: FilterPlan) -> list[Projection]:
+        '''Returns the projections that pass all the filters of the plan.'''
+        return self.rows(self.mask(plan))
+
+
+def read(urls: list[str] = URLS, concurrent: bool = True,
+         timeout: float = TIMEOUT, retries: int = RETRIES,
+         snapshot: str | None = None, ttl: float = SNAPSHOT_TTL,
+         parser: str = 'bs4', days: int = 1,
+         max_age: float = SNAPSHOT_MAX_AGE) -> Billboard:
+    '''Function that downloads the necessary data
+    and returns the billboard of the next days (by default, only today).
+    With concurrent, all the pages are downloaded at the same time and each
+    page is parsed while the next ones are still downloading.
+    If a snapshot filename is given, the billboard is read from it when it
+    exists; if it is older than ttl seconds it is also refreshed in the
+    background for the next time. If it is older than max_age seconds (or
+    it doesn't exist) the billboard is downloaded now and saved there; the
+    old snapshot is only returned if the download fails.
+    The pages are parsed with the given parser (see PARSERS): 'bs4' builds
+    the whole BeautifulSoup tree, 'lxml' reads the page as a stream.
+    If a page cannot be downloaded (after the retries) or parsed, its url
+    and error are printed and the billboard of the other pages is returned
+    (and not saved as a snapshot), as the first version of read() did.
+    '''
+    stale: Billboard | None = None
+    if snapshot is not None:
         try:
-            r = requests.get(url)
+            stale, created = load_snapshot(snapshot)
         except Exception:
-            print(f'Error substracting billboard from {url}')
-            return bboard  # retorna cartellera buida
+            pass  # no snapshot (or an old version): download it
+        else:
+            age = time.time() - created
+            if age <= ttl:
+                return stale
+            if age <= max_age:
+                Thread(target=_refresh_snapshot,
+                       args=(snapshot, urls, concurrent, timeout, retries,
+                             parser, days),
+                       daemon=True).start()
+                return stale
+
+    bboard, complete = _scrape(urls, concurrent, timeout, retries, parser,
+                               days)
+    if not complete and stale is not None:
+        print(f'Using the old billboard snapshot at {snapshot}')
+        return stale
+    if snapshot is not None and complete:
         try:
-            soup = BSoup(r.content, "lxml")
+            save_snapshot(bboard, snapshot)
         except Exception:
-            print('Error at module BeatifulSoup; check that module ' +
-                  "'lxml' is installed.")
-            return bboard
+            print(f'Could not save billboard snapshot at {snapshot}')
+    return bboard
 
-        # comencem el web scraping
-        headers = soup.find_all('div', class_="margin_10b j_entity_container")
-        panels = soup.find_all('div', class_='tabs_box_panels')
 
-        cinema: Cinema
-        film: Film
-        projection: Projection
+def read_stream(days: int = 1, urls: list[str] = URLS,
+                concurrent: bool = True, timeout: float = TIMEOUT,
+                retries: int = RETRIES, parser: str = 'bs4',
+                failed: list[str] | None = None
+                ) -> Iterator[ProjectionBatch]:
+    '''Downloads the billboard of the next days (0 is today) and yields the
+    projections of each cinema and day as soon as they are parsed, without
+    waiting for the other pages. Raises ConnectionError if a page cannot be
+    downloaded and ValueError if it cannot be parsed, unless a failed list
+    is given: then the error of each page that cannot be read is appended
+    to it (with its url) and the next pages are read.'''
+    pages = _fetch_pages(urls, concurrent, timeout, retries)
+    try:
+        for url in urls:
+            try:
+                try:
+                    content = next(pages)
+                except Exception as e:
+                    raise ConnectionError(
+                        f'Error substracting billboard from {url}: {e}')
+                try:
+                    yield from PARSERS[parser](content, days)
+                except (ImportError, FeatureNotFound) as e:
+                    raise ValueError(
+                        f'Error parsing billboard from {url}: {e}; ' +
+                        "check that module 'lxml' is installed.") from e
+                except Exception as e:
+                    raise ValueError(
+                        f'Error parsing billboard from {url}: {e}') from e
+            except (ConnectionError, ValueError) as e:
+                if failed is None:
+                    raise
+                failed.append(str(e))
+    finally:
+        pages.close()
 
-        for i in range(len(headers)):
-            # construir cinema:
-            name = headers[i].a.text[1:-1]
-            address = headers[i].find_all(
-                'span', class_="lighten")[1].text[1:-1]
 
-            cinema = Cinema(name, address, cinemas_coords[name])
-            bboard.cinemas.append(cinema)
+def _scrape(urls: list[str], concurrent: bool, timeout: float,
+            retries: int, parser: str,
+            days: int) -> tuple[Billboard, bool]:
+    '''Downloads and parses the billboard. Returns it and whether all
+    the pages could be read; the errors of the pages that could not be
+    read are printed.'''
+    bboard: Billboard = Billboard([], [], [], set())
+    failed: list[str] = []
 
-            # today's panel is:
-            actual_panel = panels[i].find('div', class_='item-0')
+    for batch in read_stream(days, urls, concurrent, timeout, retries,
+                             parser, failed):
+        bboard.add(batch)
+    for error in failed:
+        print(error)  # retorna la cartellera de les altres pàgines
+    complete = not failed
 
-            if actual_panel is None:
-                continue
-            # build films; iterate through the current cinema's films
-            for info in actual_panel.find_all('div', class_='item_resa'):
-
-                data = json.loads(info.find('div', class_='j_w')['data-movie'])
-                film = Film(data['title'],
-                            data['genre'],
-                            data['directors'][0],
-                            data['actors'])
-
-                for genre in data['genre']:
-                    bboard.genres.add(genre)
-                if film not in bboard.films:
-                    bboard.films.append(film)
-
-                # build projections
-                if info.span.text == 'Digital':
-                    language = 'V.O.'
-                else:
-                    language = 'Spanish'
-
-                for session in info.find_all('em'):
-                    start: tuple[int, int]
-                    end: tuple[int, int]
-                    duration: int
-
-                    times = json.loads(session['data-times'])
-
-                    start = times[0].split(':')
-                    start = int(start[0]), int(start[1])
-                    end = times[2].split(':')
-                    end = int(end[0]), int(end[1])
-                    if end < start:
-                        duration = (end[0] + 24 - start[0]) * \
-                            60 + end[1] - start[1]
-                    else:
-                        duration = (end[0] - start[0]) * 60 + end[1] - start[1]
-
-                    projection = Projection(film, cinema,
-                                            start, end, duration, language)
-                    bboard.projections.append(projection)
-
-    bboard.projections.sort(key=lambda t: t.start)
     bboard.cinemas.sort(key=lambda c: c.name)
     bboard.films.sort(key=lambda f: f.title)
+    bboard.build_indexes()
 
-    return bboard
+    return bboard, complete
+
+
+def _refresh_snapshot(filename: str, urls: list[str], concurrent: bool,
+                      timeout: float, retries: int, parser: str,
+                      days: int) -> None:
+    '''Downloads the billboard again and replaces the snapshot. It runs in
+    a background thread, so its errors are printed instead of raised; on
+    any error (or if a page cannot be read) the old snapshot is kept.'''
+    try:
+        bboard, complete = _scrape(urls, concurrent, timeout, retries,
+                                   parser, days)
+        if complete:
+            save_snapshot(bboard, filename)
+    except Exception as e:
+        print(f'Could not refresh billboard snapshot at {filename}: {e}')
+
+
+def save_snapshot(bboard: Billboard, filename: str) -> None:
+    '''Saves the billboard as a snapshot at filename. Films and cinemas
+    are stored once, and projections refer to them by position.'''
+    films = {_film_key(f): i for i, f in enumerate(bboard.films)}
+    cinemas = {c.name: i for i, c in enumerate(bboard.cinemas)}
+
+    data = (SNAPSHOT_VERSION, time.time(),
+            [(f.title, f.genres, f.director, f.actors) for f in bboard.films],
+            [(c.name, c.address, c.coord) for c in bboard.cinemas],
+            [(films[_film_key(p.film)],
+              cinemas[p.cinema.name],
+              p.start_min, p.end_min, p.language, p.day)
+             for p in bboard.projections],
+            sorted(bboard.genres))
+
+    # write and rename, so that a reader never sees half a snapshot (the
+    # temporary file has a unique name, as two processes may save it)
+    file = tempfile.NamedTemporaryFile(
+        'wb', dir=os.path.dirname(os.path.abspath(filename)),
+        suffix='.tmp', delete=False)
+    try:
+        pickle.dump(data, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.close()
+        os.replace(file.name, filename)
+    except BaseException:
+        file.close()
+        os.remove(file.name)
+        raise
+
+
+def load_snapshot(filename: str) -> tuple[Billboard, float]:
+    '''Returns the billboard saved at filename and the time (in seconds
+    since the epoch) when it was saved.'''
+    file = open(filename, 'rb')
+    data = pickle.load(file)
+    file.close()
+
+    if data[0] != SNAPSHOT_VERSION:
+        raise ValueError(f'Unknown billboard snapshot version {data[0]}')
+    _, created, films_, cinemas_, projections_, genres = data
+
+    films = [Film(*f) for f in films_]
+    cinemas = [Cinema(*c) for c in cinemas_]
+    projections = [_projection_at(films[f], cinemas[c], start, end, lang, d)
+                   for f, c, start, end, lang, d in projections_]
+
+    bboard = Billboard(films, cinemas, projections, set(genres))
+    bboard.build_indexes()
+    return bboard, created
+
+
+def _film_key(f: Film) -> tuple[str, str]:
+    '''Returns the identity of the film in the registry.'''
+    return (f.title, f.director)
+
+
+def _session(pool_size: int, retries: int) -> requests.Session:
+    '''Returns a session with a connection pool of the given size that
+    retries the failed requests up to retries times.'''
+    session = requests.Session()
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _fetch(session: requests.Session, url: str, timeout: float) -> bytes:
+    '''Downloads the page at url and returns its content.'''
+    r = session.get(url, timeout=timeout)
+    r.raise_for_status()
+    return r.content
+
+
+def _fetch_pages(urls: list[str], concurrent: bool, timeout: float,
+                 retries: int) -> Iterator[bytes]:
+    '''Yields the content of the pages at urls, in the same order.
+    All the requests share the same pooled session, and if concurrent is
+    True they are all sent at the same time by a thread pool.'''
+    with _session(len(urls), retries) as session:
+        if not concurrent:
+            for url in urls:
+                yield _fetch(session, url, timeout)
+            return
+
+        with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+            futures = [pool.submit(_fetch, session, url, timeout)
+                       for url in urls]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+
+def _parse_bs4(content: bytes, days: int = 1) -> Iterator[ProjectionBatch]:
+    '''Parses a page of the billboard building a BeautifulSoup tree, and
+    yields, for every cinema of the page and day, a batch with the films of
+    the panel of that day and their projections.'''
+    soup = BSoup(content, "lxml")
+
+    # comencem el web scraping
+    headers = soup.find_all('div', class_="margin_10b j_entity_container")
+    panels = soup.find_all('div', class_='tabs_box_panels')
+
+    cinema: Cinema
+    film: Film
+
+    for i in range(len(headers)):
+        # construir cinema:
+        name = headers[i].a.text[1:-1]
+        address = headers[i].find_all(
+            'span', class_="lighten")[1].text[1:-1]
+
+        cinema = Cinema(name, address, cinemas_coords[name])
+
+        for day in range(days):
+            films: list[tuple[Film, list[Projection]]] = []
+            # the panel of the day is (item-0 is today):
+            actual_panel = panels[i].find('div', class_=f'item-{day}')
+
+            if actual_panel is not None:
+                # build films; iterate through the current cinema's films
+                for info in actual_panel.find_all('div', class_='item_resa'):
+                    film = _film(info.find('div', class_='j_w')['data-movie'])
+                    language = _language(info.span.text)
+                    films.append((film, [
+                        _projection(film, cinema, session['data-times'],
+                                    language, day)
+                        for session in info.find_all('em')]))
+
+            yield ProjectionBatch(cinema, day, films)
+
+
+def _has_class(c: str) -> str:
+    '''XPath condition of the elements that have the class c.'''
+    return f'contains(concat(" ", normalize-space(@class), " "), " {c} ")'
+
+
+def _text(el: etree._Element) -> str:
+    '''Returns all the text inside the element el.'''
+    return ''.join(el.itertext())
+
+
+def _parse_lxml(content: bytes, days: int = 1) -> Iterator[ProjectionBatch]:
+    '''Parses a page of the billboard as a stream with lxml, yielding the
+    same batches as _parse_bs4(): each cinema is yielded as soon as its
+    panel has been read, and the parsed part of the document is freed.'''
+    cinemas: deque[Cinema] = deque()  # cinemas waiting for their panel
+
+    # the billboard pages are in utf-8 (libxml2 assumes latin-1 otherwise)
+    for _, el in etree.iterparse(BytesIO(content), events=('end',),
+                                 tag='div', html=True, encoding='utf-8'):
+        classes = el.get('class', '')
+
+        if classes == "margin_10b j_entity_container":
+            name = _text(el.xpath('(.//a)[1]')[0])[1:-1]
+            address = _text(el.xpath(
+                f'.//span[{_has_class("lighten")}]')[1])[1:-1]
+            cinemas.append(Cinema(name, address, cinemas_coords[name]))
+
+        elif 'tabs_box_panels' in classes.split():
+            cinema = cinemas.popleft()
+
+            for day in range(days):
+                films: list[tuple[Film, list[Projection]]] = []
+                for panel in el.xpath(
+                        f'(.//div[{_has_class(f"item-{day}")}])[1]'):
+                    for info in panel.xpath(
+                            f'.//div[{_has_class("item_resa")}]'):
+                        film = _film(info.xpath(
+                            f'(.//div[{_has_class("j_w")}])[1]')[0]
+                            .get('data-movie'))
+                        language = _language(
+                            _text(info.xpath('(.//span)[1]')[0]))
+                        films.append((film, [
+                            _projection(film, cinema, em.get('data-times'),
+                                        language, day)
+                            for em in info.xpath('.//em')]))
+
+                yield ProjectionBatch(cinema, day, films)
+        else:
+            continue
+
+        # free the elements already read
+        el.clear()
+        while el.getprevious() is not None:
+            del el.getparent()[0]
+
+
+PARSERS = {'bs4': _parse_bs4, 'lxml': _parse_lxml}
+
+
+def _film(data_movie: str) -> Film:
+    '''Builds a film from the data-movie attribute of the billboard.'''
+    data = json.loads(data_movie)
+    return Film(data['title'],
+                data['genre'],
+                data['directors'][0],
+                data['actors'])
+
+
+def _language(format: str) -> str:
+    '''Returns the language of the projections given their format (one of
+    the strings of LANGUAGES, shared by all the projections).'''
+    if format == 'Digital':
+        return LANGUAGES[0]
+    return LANGUAGES[1]
+
+
+def _projection(film: Film, cinema: Cinema, data_times: str,
+                language: str, day: int) -> Projection:
+    '''Builds a projection from the data-times attribute
+    of a session.'''
+    times = json.loads(data_times)
+
+    return _projection_at(film, cinema, _minutes(times[0]),
+                          _minutes(times[2]), language, day)
@@ -1,38 +1,145 @@
-from typing import TypeAlias, Any
+from typing import TypeAlias, Any, BinaryIO, Iterator
+import hashlib
+import json
+import os
+import pickle
+import time
 import networkx as nx
 import requests
 import matplotlib.pyplot as plt
 from staticmap import Line, CircleMarker, StaticMap
+from tiles import static_map
+
+try:
+    import ijson  # streaming json parser
+except ImportError:
+    ijson = None
 
 
 BusesGraph: TypeAlias = nx.Graph
 
+URL = 'https://www.ambmobilitat.cat/OpenData/ObtenirDadesAMB.json'
+CACHE = 'ObtenirDadesAMB.json'  # local copy of the data
+CACHE_MAX_AGE = 7 * 24 * 60 * 60  # seconds before downloading it again
+# fields of the stops used by the program
+PARADA_FIELDS = ('CodAMB', 'Nom', 'UTM_X', 'UTM_Y', 'Linies', 'Municipi')
+BUSES_GRAPH_VERSION = 2  # format of the graphs saved by save_buses_graph
+
+
+def get_json_file(filename: str = CACHE,
+                  max_age: float = CACHE_MAX_AGE) -> str:
+    '''Returns the path of a local copy of the AMB data. The copy is
+    downloaded again if it is older than max_age seconds or if its size or
+    sha256 hash are not the ones saved (at filename.meta) when it was
+    downloaded. If it can't be downloaded, the old copy is used as long as
+    it is complete.'''
+    if not _valid_copy(filename, max_age):
+        try:
+            _download(URL, filename)
+        except Exception:
+            print(f"Error substracting data from {URL}")
+            if not _valid_copy(filename, float('inf')):
+                exit(1)
+            print(f"Using the old copy at {filename}")
+    return filename
 
-def get_json_data():
-    '''Descarrega les dades de les linies i
-    recorreguts de busos de l'AMB'''
-    url = 'https://www.ambmobilitat.cat/OpenData/ObtenirDadesAMB.json'
-    try:
-        response = requests.get(url)
-        json_data = response.json()
 
+def _valid_copy(filename: str, max_age: float) -> bool:
+    '''Returns whether filename is a complete, recent copy of the data.'''
+    try:
+        file = open(filename + '.meta')
+        meta = json.load(file)
+        file.close()
+        return (time.time() - meta['time'] <= max_age and
+                os.path.getsize(filename) == meta['size'] and
+                _sha256(filename) == meta['sha256'])
     except Exception:
-        print(f"Error substracting data from {url}")
-        exit(1)
+        return False
+
+
+def _sha256(filename: str) -> str:
+    '''Returns the sha256 hash of the file.'''
+    h = hashlib.sha256()
+    file = open(filename, 'rb')
+    for chunk in iter(lambda: file.read(1 << 20), b''):
+        h.update(chunk)
+    file.close()
+    return h.hexdigest()
+
 
-    return json_data
+def _download(url: str, filename: str) -> None:
+    '''Downloads url at filename by chunks, without keeping it in memory,
+    and saves its size and hash at filename.meta.'''
+    h = hashlib.sha256()
+    size = 0
+    response = requests.get(url, stream=True, timeout=60)
+    response.raise_for_status()
+
+    file = open(filename + '.tmp', 'wb')
+    for chunk in response.iter_content(chunk_size=1 << 16):
+        file.write(chunk)
+        h.update(chunk)
+        size += len(chunk)
+    file.close()
+    os.replace(filename + '.tmp', filename)
+
+    file = open(filename + '.meta', 'w')
+    json.dump({'time': time.time(), 'size': size, 'sha256': h.hexdigest()},
+              file)
+    file.close()
 
 
 def get_linies() -> list[Any]:
     """
     Returns a list of buses' lines and its information extracted
-    from the json data.
+    from the json data. Only the fields in PARADA_FIELDS of the stops of
+    Barcelona are kept; the other stops only keep their 'Municipi'.
     """
-    data = get_json_data()
-    data = data[list(data.keys())[0]]
-    linies = data[list(data.keys())[1]]
+    file = open(get_json_file(), 'rb')
+    if ijson is not None:
+        linies = [_slim_linia(linia) for linia in _stream_linies(file)]
+    else:
+        data = json.load(file)
+        data = data[list(data.keys())[0]]
+        data = data[list(data.keys())[1]]
+        linies = [_slim_linia(linia) for linia in data[list(data.keys())[0]]]
+    file.close()
+
+    return linies
+
+
+def _stream_linies(file: BinaryIO) -> Iterator[dict[str, Any]]:
+    '''Yields the lines of the json data one by one, reading the file as a
+    stream. The lines are the items of the list at the first key of the
+    second key of the first key of the data.'''
+    assert ijson is not None
+    path: list[str] = []
+    position = [0, 1, 0]  # position of the key to follow at each level
+    n = 0  # keys seen at the current level
+
+    for prefix, event, value in ijson.parse(file):
+        if event == 'map_key' and prefix == '.'.join(path):
+            if n == position[len(path)]:
+                path.append(value)
+                n = 0
+                if len(path) == len(position):
+                    break
+            else:
+                n += 1
+
+    file.seek(0)
+    yield from ijson.items(file, '.'.join(path) + '.item', use_float=True)
 
-    return linies[list(linies.keys())[0]]
+
+def _slim_linia(linia: dict[str, Any]) -> dict[str, Any]:
+    '''Returns the line without the data of the stops that we don't use.'''
+    parades = [
+        {k: p[k] for k in PARADA_FIELDS} if p['Municipi'] == 'Barcelona'
+        else {'Municipi': p['Municipi']}
+        for p in linia['Parades']['Parada']]
+    slim = {k: v for k, v in linia.items() if k != 'Parades'}
+    slim['Parades'] = {'Parada': parades}
+    return slim
 
 
 def get_buses_graph() -> BusesGraph:
@@ -41,45 +148,107 @@ def get_buses_graph() -> BusesGraph:
     it as BusesGraph type.
     """
     Buses: BusesGraph = BusesGraph()
-    linies = get_linies()
-    node_anterior = ""
+    nodes: dict[Any, dict[str, Any]] = {}
+    edges: list[tuple[Any, Any, dict[str, Any]]] = []
+    splits: dict[str, tuple[list[str], frozenset[str]]] = {}
 
-    for linia in linies:
+    for linia in get_linies():
+        node_anterior = None
         # we access the stops of a single line
-        for parades in linia["Parades"]["Parada"]:
+        for parada in linia["Parades"]["Parada"]:
             # we verify the stops are from Barcelona city
-            if parades["Municipi"] == "Barcelona":
-                node_attributes = {
-                    "tipus": "Parada",
-                    "nom": parades["Nom"],
-                    "pos": (
-                        parades["UTM_Y"],
-                        parades["UTM_X"]),
-                    "linies": parades["Linies"].split(
-                        sep=' - ')}
-                Buses.add_node(parades["CodAMB"], **node_attributes)
-
-                if node_anterior != "":
-                    edge_attributes = {"tipus": "Bus", "linies": []}
-
-                    for linia in Buses.nodes[node_anterior]['linies']:
-                        if linia in Buses.nodes[parades["CodAMB"]]['linies']:
-                            edge_attributes["linies"].append(linia)
-
-                    if node_anterior != parades["CodAMB"]:
-                        Buses.add_edge(
-                            node_anterior,
-                            parades["CodAMB"],
-                            **edge_attributes, color='blue')
-                node_anterior = parades["CodAMB"]
-            else:
-                node_anterior = ""
+            if parada["Municipi"] != "Barcelona":
+                node_anterior = None
+                continue
+
+            # molts cops es repeteix el mateix string de linies
+            if parada["Linies"] not in splits:
+                linies = parada["Linies"].split(sep=' - ')
+                splits[parada["Linies"]] = (linies, frozenset(linies))
+            linies, linies_set = splits[parada["Linies"]]
+
+            node = parada["CodAMB"]
+            nodes[node] = {
+                "tipus": "Parada",
+                "nom": parada["Nom"],
+                "pos": (parada["UTM_Y"], parada["UTM_X"]),
+                "linies": linies}
 
-        node_anterior = ""
+            if node_anterior is not None and node_anterior != node:
+                comunes = [li for li in nodes[node_anterior]["linies"]
+                           if li in linies_set]
+                edges.append((node_anterior, node, {
+                    "tipus": "Bus", "linies": comunes, "color": 'blue'}))
+            node_anterior = node
+
+    Buses.add_nodes_from(nodes.items())
+    Buses.add_edges_from(edges)
 
     return Buses
 
 
+def save_buses_graph(g: BusesGraph, filename: str) -> None:
+    '''Saves the g graph as filename, after a header with the version of
+    its format and the time it was built (so that buses_graph_age can read
+    it without loading the graph).'''
+    file = open(filename + '.tmp', 'wb')
+    pickle.dump({'version': BUSES_GRAPH_VERSION, 'time': time.time()}, file)
+    pickle.dump(g, file)
+    file.close()
+    os.replace(filename + '.tmp', filename)
+
+
+def load_buses_graph(filename: str,
+                     max_age: float = CACHE_MAX_AGE) -> BusesGraph:
+    '''Returns the graph previously saved at filename. Raises ValueError
+    if it was saved with another version of the format or more than
+    max_age seconds ago, or if the file is not a complete saved graph.'''
+    file = open(filename, 'rb')
+    try:
+        header = _read_header(file, filename)
+        if time.time() - header['time'] > max_age:
+            raise ValueError(f"{filename} is too old")
+        try:
+            g = pickle.load(file)
+        except Exception as error:
+            raise ValueError(f"{filename} is not a complete buses graph") \
+                from error
+    finally:
+        file.close()
+    if not isinstance(g, BusesGraph):
+        raise ValueError(f"{filename} is not a buses graph")
+    return g
+
+
+def buses_graph_age(filename: str) -> float:
+    '''Returns how many seconds ago the graph saved at filename was built,
+    reading only the header of the file. Raises ValueError as
+    load_buses_graph if the header is not valid.'''
+    file = open(filename, 'rb')
+    try:
+        header = _read_header(file, filename)
+    finally:
+        file.close()
+    return time.time() - header['time']
+
+
+def _read_header(file: BinaryIO, filename: str) -> dict[str, Any]:
+    '''Reads the header written by save_buses_graph and checks its
+    version.'''
+    try:
+        header = pickle.load(file)
+    except Exception as error:
+        raise ValueError(f"{filename} is not a saved buses graph") \
+            from error
+    if not isinstance(header, dict) or \
+            header.get('version') != BUSES_GRAPH_VERSION:
+        version = header.get('version') if isinstance(header, dict) \
+            else None
+        raise ValueError(f"{filename} has version {version}, "
+                         f"expected {BUSES_GRAPH_VERSION}")
+    return header
+
+
 def show(g: BusesGraph) -> None:
     """Shows the buses graph using matplotlib.pyplot."""
     posicions = nx.get_node_attributes(g, 'pos')
@@ -100,7 +269,7 @@ def plot_buses(g: BusesGraph, nom_fitxer: str) -> None:
     :param g: a graph of the metro of the city
     :param nom_fitxer: a path and name to save the image
     """
-    buses_map = StaticMap(3500, 3500)
+    buses_map = static_map(3500, 3500)
 
     for pos in nx.get_node_attributes(g, 'pos').values():
         buses_map.add_marker(CircleMarker((pos[0], pos[1]), "black", 6))
@@ -1,16 +1,38 @@
-from typing import TypeAlias
+from typing import Iterable, TypeAlias
 from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappop, heappush
 import osmnx as ox
+import numpy as np
 import pickle
+import hashlib
+import sys
+import threading
+import weakref
 import networkx as nx
 from buses import *
 from haversine import haversine
 from staticmap import CircleMarker, StaticMap, IconMarker
+from tiles import static_map
+from routing import CinemaTables, Router, SpatialIndex, is_read_only, \
+    read_only
+import transit
 
 
 Coord: TypeAlias = tuple[float, float]   # (latitude, longitude)
 CityGraph: TypeAlias = nx.Graph
 OsmnxGraph: TypeAlias = nx.MultiDiGraph
+Adjacency: TypeAlias = dict[int, list[tuple[int, float]]]
+
+# The searches of the street distance between the nodes linked to two
+# consecutive bus stops stop at LINK_DETOUR times the straight distance
+# (plus LINK_MARGIN meters); the few pairs not found by then are searched
+# without bound.
+LINK_DETOUR = 3
+LINK_MARGIN = 500  # meters
+ROUTE_CACHE_ENTRIES = 4096  # paths kept by a RouteCache
+ROUTE_CACHE_BYTES = 64 * 2 ** 20  # bytes of the paths kept by a RouteCache
 
 
 @dataclass
@@ -21,13 +43,20 @@ class Path:
     path_graph: nx.Graph
     plot_graph: nx.Graph
     path_indications: str
-    city_graph: CityGraph
-    osmnx_graph: OsmnxGraph
+    # (None until get_other_data() if the path was found by a router)
+    city_graph: CityGraph | None
+    osmnx_graph: OsmnxGraph | None
     time: int  # in minutes
+    grid: SpatialIndex | None  # of the nodes of osmnx_graph
+    colors: dict[int, str]  # of the nodes of the path, over the city graph
+    # journey of the transit router followed by the path, if any
+    journey: transit.Journey | None
+    network: transit.TransitNetwork | None  # of the journey
 
     def __init__(self, source: int, dest: int,
                  path: list[int], time: int,
-                 city: CityGraph, omsnx: OsmnxGraph) -> None:
+                 city: CityGraph | None, omsnx: OsmnxGraph | None,
+                 grid: SpatialIndex | None = None) -> None:
         """Constructor"""
 
         self.source = source
@@ -36,12 +65,27 @@ class Path:
         self.time = time
         self.city_graph = city
         self.osmnx_graph = omsnx
-
-    def get_other_data(self) -> None:
+        self.grid = grid
+        self.colors = {}
+        self.journey = None
+        self.network = None
+
+    def get_other_data(self, city: CityGraph | None = None,
+                       osmnx: OsmnxGraph | None = None) -> None:
+        """Builds the graphs and the indications of the path, over the
+        given graphs (the ones of the path if they are not given)."""
+        if city is not None:
+            self.city_graph = city
+        if osmnx is not None:
+            self.osmnx_graph = osmnx
+        assert self.city_graph is not None and self.osmnx_graph is not None
         self.path_graph = build_path_graph(self.source, self.dest,
                                            self.path, self.city_graph)
         try:
-            indic: str = path_indications(self)
+            if self.journey is not None:
+                indic: str = journey_indications(self)
+            else:
+                indic = path_indications(self)
         except Exception:
             indic = ''  # if we cannot calculate the indicactions
 
@@ -50,7 +94,114 @@ class Path:
                                            self.dest,
                                            self.path,
                                            self.city_graph,
-                                           self.osmnx_graph)
+                                           self.osmnx_graph,
+                                           self.grid,
+                                           self.colors)
+
+
+class RouteCache:
+    """
+    Least recently used cache of the paths found (their nodes and time in
+    seconds), by the nearest nodes to their ends and the version of the
+    graph (see graph_version). When there are more than max_entries paths,
+    or their nodes take more than max_bytes, the ones used longest ago are
+    removed. As the version of a graph changes with its edges and their
+    times, all the paths are removed when one of another version is asked
+    for. The paths of find_cinema_path are not kept: following them in the
+    cinema tables is as cheap as a lookup here.
+    """
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_ENTRIES,
+                 max_bytes: int = ROUTE_CACHE_BYTES) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.paths: OrderedDict[tuple[int, int],
+                                tuple[list[int], float]] = OrderedDict()
+        self.version: str | None = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # (it can be shared by threads)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def get(self, src: int, dst: int,
+            version: str) -> tuple[list[int], float] | None:
+        """Returns the nodes and the time of the path from src to dst in
+        the graph of the version, if it is in the cache."""
+        with self.lock:
+            self._check(version)
+            found = self.paths.get((src, dst))
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.paths.move_to_end((src, dst))
+            return found
+
+    def put(self, src: int, dst: int, version: str,
+            path: list[int], time: float) -> None:
+        """Keeps the path from src to dst in the graph of the version."""
+        with self.lock:
+            self._check(version)
+            if (src, dst) in self.paths:
+                self.bytes -= _path_bytes(self.paths[src, dst][0])
+            self.paths[src, dst] = (path, time)
+            self.paths.move_to_end((src, dst))
+            self.bytes += _path_bytes(path)
+            while len(self.paths) > self.max_entries or \
+                    (self.bytes > self.max_bytes and len(self.paths) > 1):
+                _, (old, _) = self.paths.popitem(last=False)
+                self.bytes -= _path_bytes(old)
+
+    def clear(self) -> None:
+        """Removes all the paths (the counters are kept)."""
+        with self.lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self.paths.clear()
+        self.bytes = 0
+
+    def _check(self, version: str) -> None:
+        if version != self.version:
+            self._clear()
+            self.version = version
+
+
+def _path_bytes(path: list[int]) -> int:
+    """Memory taken by the nodes of a path (the list and its numbers)."""
+    return sys.getsizeof(path) + sum(sys.getsizeof(u) for u in path)
+
+
+# versions of the read-only graphs already hashed by graph_version
+_versions: weakref.WeakKeyDictionary[CityGraph, str] = \
+    weakref.WeakKeyDictionary()
+
+
+def graph_version(g: CityGraph | None,
+                  router: Router | None = None) -> str:
+    """
+    Hash of the nodes, edges and times of the graph the paths are searched
+    in: the CSR arrays of the router if given (as they are what it
+    searches), or g. It is computed once for a CSR (see CSRGraph.version)
+    and for a read-only g (see routing.read_only), as the ones built by
+    build_city_graph, so it is cheap to ask for it on each search. Any
+    other g is hashed again in each call, as its times or its edges can
+    have changed since the last one.
+    """
+    if router is not None:
+        return router.csr.version
+    assert g is not None
+    version = _versions.get(g)
+    if version is None:
+        sha = hashlib.sha1(repr(list(g.nodes)).encode())
+        sha.update(repr(list(g.edges(data='time'))).encode())
+        version = sha.hexdigest()
+        if is_read_only(g):
+            _versions[g] = version
+    return version
 
 
 def get_osmnx_graph() -> OsmnxGraph:
@@ -71,42 +222,254 @@ def get_osmnx_graph() -> OsmnxGraph:
     return graph
 
 
-def find_path(ox_g: OsmnxGraph, g: CityGraph,
-              src: Coord, dst: Coord) -> Path:
-    """Returns the shortest path (Path) between the nodes src and dst."""
-    src_node, dist_src = ox.nearest_nodes(
-        ox_g, src[1], src[0], return_dist=True)
-    dst_node, dist_dst = ox.nearest_nodes(
-        ox_g, dst[1], dst[0], return_dist=True)
+def find_path(ox_g: OsmnxGraph | None, g: CityGraph | None,
+              src: Coord, dst: Coord, router: Router | None = None,
+              method: str = 'dijkstra',
+              cache: RouteCache | None = None) -> Path:
+    """
+    Returns the shortest path (Path) between the nodes src and dst.
+    If a router (over the CSR of g) is given, it is used instead of
+    networkx to find the path (with one of the routing.METHODS), and its
+    spatial index instead of osmnx to find the nearest nodes: then ox_g and
+    g are not needed (they can be None until Path.get_other_data()).
+    If a cache is given, the path is taken from it if it is there.
+    """
+    grid = router.csr.grid if router is not None else None
+    if grid is not None:
+        src_node, dist_src = grid.snap(src)
+        dst_node, dist_dst = grid.snap(dst)
+    else:
+        src_node, dist_src = ox.nearest_nodes(
+            ox_g, src[1], src[0], return_dist=True)
+        dst_node, dist_dst = ox.nearest_nodes(
+            ox_g, dst[1], dst[0], return_dist=True)
 
     assert dist_src < 10000 and dist_dst < 10000
-    shortest_path = nx.shortest_path(
-        g, src_node, dst_node, weight='time', method='dijkstra')
-
-    time = 0
-    node_ant = shortest_path[0]
-    for node in shortest_path[1:]:
-        time += g[node_ant][node]['time']
-        node_ant = node
+    version = graph_version(g, router) if cache is not None else ''
+    found = cache.get(src_node, dst_node, version) \
+        if cache is not None else None
+    if found is not None:
+        shortest_path, time = found
+    elif router is not None:
+        index = router.csr.index
+        nodes, time = router.shortest_path(index[src_node], index[dst_node],
+                                           method)
+        shortest_path = [router.csr.ids[i] for i in nodes]
+    else:
+        shortest_path = nx.shortest_path(
+            g, src_node, dst_node, weight='time', method='dijkstra')
+
+        time = 0
+        node_ant = shortest_path[0]
+        for node in shortest_path[1:]:
+            time += g[node_ant][node]['time']
+            node_ant = node
+    if cache is not None and found is None:
+        cache.put(src_node, dst_node, version, shortest_path, time)
 
     path: Path = Path(src_node, dst_node, shortest_path[1:-1],
-                      int(time) // 60, g, ox_g)
+                      int(time) // 60, g, ox_g, grid)
 
     return path
 
 
+def find_paths_to_many(ox_g: OsmnxGraph | None, g: CityGraph | None,
+                       src: Coord,
+                       dsts: list[Coord],
+                       router: Router | None = None,
+                       cache: RouteCache | None = None) -> list[Path]:
+    """
+    Returns the shortest path (Path) from src to each of dsts, as
+    find_path, but finding the nearest node of each coordinate only once
+    and all the paths with a single search from src, which stops when the
+    nodes of all of dsts are reached. If a cache is given, only the paths
+    that are not there are searched. As in find_path, ox_g and g can be
+    None if a router is given. The search is a Dijkstra even if the router
+    has a contraction hierarchy (see Router.shortest_paths).
+    """
+    grid = router.csr.grid if router is not None else None
+    coords = list(dict.fromkeys(dsts))  # (without repeated coordinates)
+    if grid is not None:
+        src_node, dist_src = grid.snap(src)
+        nodes, dists = grid.snap_many(coords)
+    else:
+        src_node, dist_src = ox.nearest_nodes(
+            ox_g, src[1], src[0], return_dist=True)
+        nodes, dists = ox.nearest_nodes(
+            ox_g, [lon for _, lon in coords], [lat for lat, _ in coords],
+            return_dist=True)
+
+    assert dist_src < 10000 and all(d < 10000 for d in dists)
+    targets = list(dict.fromkeys(nodes))
+    paths: dict[int, tuple[list[int], float]] = {}
+    if cache is not None:
+        version = graph_version(g, router)
+        for u in targets:
+            cached = cache.get(src_node, u, version)
+            if cached is not None:
+                paths[u] = cached
+        targets = [u for u in targets if u not in paths]
+
+    if targets and router is not None:
+        index = router.csr.index
+        found = router.shortest_paths(index[src_node],
+                                      [index[u] for u in targets])
+        paths.update({u: ([router.csr.ids[i] for i in path], time)
+                      for u, (path, time) in zip(targets, found)})
+    elif targets:
+        paths.update(_paths_to_many(g, src_node, targets))
+    if cache is not None:
+        for u in targets:
+            cache.put(src_node, u, version, *paths[u])
+
+    dst_nodes = dict(zip(coords, nodes))
+    result: list[Path] = []
+    for dst in dsts:
+        shortest_path, time = paths[dst_nodes[dst]]
+        result.append(Path(src_node, dst_nodes[dst], shortest_path[1:-1],
+                           int(time) // 60, g, ox_g, grid))
+    return result
+
+
+def find_journey_path(ox_g: OsmnxGraph | None, g: CityGraph, src: Coord,
+                      dst: Coord, net: transit.TransitNetwork,
+                      journey: transit.Journey,
+                      router: Router | None = None) -> Path:
+    """
+    Returns the path (Path) over g that follows a journey from src to dst
+    found by the transit router: its walks follow the streets and its bus
+    legs the stops of their line. The time and the indications of the path
+    are the ones of the journey. As in find_path, ox_g can be None if a
+    router is given.
+    """
+    grid = router.csr.grid if router is not None else None
+    if grid is not None:
+        src_node, dist_src = grid.snap(src)
+        dst_node, dist_dst = grid.snap(dst)
+    else:
+        src_node, dist_src = ox.nearest_nodes(
+            ox_g, src[1], src[0], return_dist=True)
+        dst_node, dist_dst = ox.nearest_nodes(
+            ox_g, dst[1], dst[0], return_dist=True)
+    assert dist_src < 10000 and dist_dst < 10000
+
+    nodes = [src_node]
+    for leg in journey.legs:
+        if leg.kind == 'bus':
+            nodes += leg.stops[1:]
+            continue
+        if g.nodes[nodes[-1]]['tipus'] == 'Parada':  # getting off the bus
+            nodes.append(_street_node(g, nodes[-1]))
+        end = dst_node if leg.dst is None else _street_node(g, leg.dst)
+        nodes += _walk(g, nodes[-1], end)[1:]
+        if leg.dst is not None:
+            nodes.append(leg.dst)
+
+    path = Path(src_node, dst_node, nodes[1:-1], journey.time, g, ox_g, grid)
+    path.journey = journey
+    path.network = net
+    return path
+
+
+def _street_node(g: CityGraph, stop: int) -> int:
+    """Returns the street node linked to the bus stop."""
+    return next(v for v, attr in g[stop].items() if attr['tipus'] == 'enllaç')
+
+
+def _walk(g: CityGraph, src: int, dst: int) -> list[int]:
+    """Returns the shortest path from src to dst only by the streets."""
+    return nx.shortest_path(
+        g, src, dst,
+        weight=lambda u, v, attr: attr['time']
+        if attr['tipus'] == 'carrer' else None)
+
+
+def cinema_times(router: Router, tables: CinemaTables, src: Coord,
+                 names: Iterable[str] | None = None) -> dict[str, int]:
+    """Returns the minutes from src to each of the cinemas names (all the
+    cinemas of the tables if not given), looked up after finding the
+    nearest node to src. The cinemas that are not in the tables or can't
+    be reached from src are left out."""
+    src_node, dist_src = router.csr.grid.snap(src)
+    assert dist_src < 10000
+    i = router.csr.index[src_node]
+    minutes: dict[str, int] = {}
+    for name in tables.names if names is None else names:
+        if name in tables.rows:
+            time = tables.time(name, i)
+            if time != float('inf'):
+                minutes[name] = int(time) // 60
+    return minutes
+
+
+def find_cinema_path(ox_g: OsmnxGraph | None, g: CityGraph | None,
+                     src: Coord,
+                     name: str, router: Router,
+                     tables: CinemaTables) -> Path:
+    """Returns the shortest path (Path) from src to the cinema name,
+    following its tree of paths in the tables (ox_g and g can be None)."""
+    src_node, dist_src = router.csr.grid.snap(src)
+    assert dist_src < 10000
+    i = router.csr.index[src_node]
+    shortest_path = [router.csr.ids[j] for j in tables.path(name, i)]
+    return Path(src_node, shortest_path[-1], shortest_path[1:-1],
+                int(tables.time(name, i)) // 60, g, ox_g, router.csr.grid)
+
+
+def _paths_to_many(g: CityGraph, source: int, targets: list[int]
+                   ) -> dict[int, tuple[list[int], float]]:
+    """Dijkstra from the source over the times of g that stops when it has
+    reached all the targets. Returns the path and the time to each one."""
+    pending = set(targets)
+    dist = {source: 0.0}
+    parent = {source: source}
+    heap = [(0.0, 0, source)]  # (the counter breaks ties between ids)
+    pushed = 1
+    while heap and pending:
+        d, _, u = heappop(heap)
+        if d > dist[u]:
+            continue
+        pending.discard(u)
+        for v, attrs in g[u].items():
+            if d + attrs['time'] < dist.get(v, float('inf')):
+                dist[v] = d + attrs['time']
+                parent[v] = u
+                heappush(heap, (dist[v], pushed, v))
+                pushed += 1
+    if pending:
+        raise nx.NetworkXNoPath(f'Node {pending.pop()} not reachable '
+                                f'from {source}')
+
+    paths = {}
+    for target in targets:
+        path = [target]
+        while path[-1] != source:
+            path.append(parent[path[-1]])
+        path.reverse()
+        paths[target] = (path, dist[target])
+    return paths
+
+
 def build_plot_graph(
                     src: int,
                     dest: int,
                     path: list[int],
                     g: CityGraph,
-                    ox_g: OsmnxGraph) -> nx.Graph:
+                    ox_g: OsmnxGraph,
+                    grid: SpatialIndex | None = None,
+                    colors: dict[int, str] | None = None) -> nx.Graph:
     """
     Builds a complementary graph of the path,
     just for ploting it in a nicely way.
     This function makes the bus lines (edges) not go throw buildings
     and adds colors to specific nodes (source, dest and changing line).
+    The nearest street nodes of the stops are found with grid if given (or
+    with the street_index of ox_g, built once for the graph), and the colors
+    given replace the ones of the nodes in g.
+    g is not modified (the attributes of its nodes and edges are copied).
     """
+    if grid is None:
+        grid = street_index(ox_g)
 
     plot_graph: nx.Graph = nx.Graph()
 
@@ -123,6 +486,8 @@ def build_plot_graph(
             plot_graph.add_node(node, **g.nodes[node], size=0)
         else:
             plot_graph.add_node(node, **g.nodes[node], size=15)
+        if colors is not None and node in colors:
+            plot_graph.nodes[node]['color'] = colors[node]
 
     node_ant = src
 
@@ -132,17 +497,10 @@ def build_plot_graph(
             # If both the previous and current node are bus stops ('Parada'),
             # adjust the edges and create a new route between them
             # without going throw buildings.
-            nr_node_ant = ox.nearest_nodes(
-                ox_g,
-                g.nodes[node_ant]['pos'][0],
-                g.nodes[node_ant]['pos'][1],
-                return_dist=0)
-
-            nr_node = ox.nearest_nodes(
-                ox_g,
-                g.nodes[node]['pos'][0],
-                g.nodes[node]['pos'][1],
-                return_dist=0)
+            nr_node_ant, _ = grid.snap((g.nodes[node_ant]['pos'][1],
+                                        g.nodes[node_ant]['pos'][0]))
+            nr_node, _ = grid.snap((g.nodes[node]['pos'][1],
+                                    g.nodes[node]['pos'][0]))
 
             # Find the shortest path between the nearest nodes from two
             # consecutive bus stosp using streets graph (ox_g).
@@ -150,11 +508,11 @@ def build_plot_graph(
                 ox_g, nr_node_ant, nr_node, weight='length')
 
             # Divides the time into the different subedges
-            # for still having the same time in that bus ride.
+            # for still having the same time in that bus ride
+            # (in a copy of the attributes: g is shared by all the paths).
             num_sh_edges = len(shortest_path) + 1
-            g[node_ant][node]['time'] /= num_sh_edges
-
-            attr = g.get_edge_data(node_ant, node)
+            attr = dict(g[node_ant][node])
+            attr['time'] /= num_sh_edges
             plot_graph.add_edge(node_ant, nr_node_ant, **attr)
             short_ant = shortest_path[0]
             plot_graph.add_node(
@@ -216,8 +574,8 @@ def build_path_graph(
 def path_indications(p: Path) -> str:
     """
     Given a path (Path), returns the indications to the destination.
-    It also modiies the nodes' color where a bus line should be taken
-    or change to another line as orange.
+    It also colors as orange (in p.colors, not in the city graph) the nodes
+    where a bus line should be taken or change to another line.
     """
 
     indic: str = ''
@@ -274,7 +632,7 @@ def path_indications(p: Path) -> str:
             indic += f"Camina fins la parada {g.nodes[n_ant]['nom']} " + \
                      f"i agafa l'autobus {lin} fins la parada " + \
                      f"{g.nodes[n]['nom']}."
-            p.city_graph.nodes[n_ant]['color'] = 'orange'
+            p.colors[n_ant] = 'orange'
             continue
 
         linies = noves_linies
@@ -298,12 +656,12 @@ def path_indications(p: Path) -> str:
         indic += f"Walk to the bus stop {g.nodes[par]['nom']}, " + \
                  f"and take bus {lin}.\n"
 
-        p.city_graph.nodes[par]['color'] = 'orange'
+        p.colors[par] = 'orange'
 
         for lin, par in linia_parada[1:]:
             indic += f"Travel by bus to the stop {g.nodes[par]['nom']}," + \
                      f" and transfer to line {lin}.\n"
-            p.city_graph.nodes[par]['color'] = 'orange'
+            p.colors[par] = 'orange'
 
         lin, par = linia_parada[-1]
         indic += f"Travel by bus to the stop " + \
@@ -312,6 +670,18 @@ def path_indications(p: Path) -> str:
     return indic
 
 
+def journey_indications(p: Path) -> str:
+    """
+    Returns the indications of the journey followed by the path p, and
+    colors as orange (in p.colors) the stops where a bus is taken.
+    """
+    assert p.journey is not None and p.network is not None
+    for leg in p.journey.legs:
+        if leg.kind == 'bus':
+            p.colors[leg.src] = 'orange'
+    return transit.indications(p.network, p.journey)
+
+
 def save_osmnx_graph(g: OsmnxGraph, filename: str) -> None:
     """Saves the g graph as filname."""
     file = open(filename, 'wb')
@@ -329,8 +699,15 @@ def load_osmnx_graph(filename: str) -> OsmnxGraph:
     return g
 
 
-def build_city_graph(g1: OsmnxGraph, g2: BusesGraph) -> CityGraph:
-    """Returns a graph combining g1 and g2."""
+def build_city_graph(g1: OsmnxGraph, g2: BusesGraph,
+                     processes: int = 0) -> CityGraph:
+    """
+    Returns a graph combining g1 and g2. The street distances of the bus
+    edges are computed with a pool of processes if processes > 1.
+    The graph is read-only (see routing.read_only): neither its nodes and
+    edges nor their attributes can be changed, so the paths searched in it
+    keep what they change (colors, split edges) apart from it.
+    """
     city: CityGraph = nx.Graph()
 
     for u, nbrsdict in g1.adjacency():
@@ -351,33 +728,34 @@ def build_city_graph(g1: OsmnxGraph, g2: BusesGraph) -> CityGraph:
 
     nearest_nodes: dict[int, int] = {}
     parades_nodes: list[str] = []
-    list_x: list[float] = []
-    list_y: list[float] = []
+    coords: list[Coord] = []
 
     for u in g2.nodes:
         assert g2.nodes[u]['tipus'] == 'Parada'
         attr = g2.nodes[u]
         city.add_node(u, **attr, color='black')
-        list_x.append(g2.nodes[u]['pos'][0])
-        list_y.append(g2.nodes[u]['pos'][1])
+        coords.append((g2.nodes[u]['pos'][1], g2.nodes[u]['pos'][0]))
         parades_nodes.append(u)
 
     # calculates the nearest node from a bus stop for each bus stop in g2
-    parada_cruilla: list[int] = ox.nearest_nodes(g1, list_x, list_y,
-                                                 return_dist=False)
+    parada_cruilla, _ = street_index(g1).snap_many(np.array(coords))
 
     for i, u in enumerate(parades_nodes):
         nearest_nodes[u] = parada_cruilla[i]
 
     assert len(parada_cruilla) == len(nearest_nodes)
 
+    lengths = street_lengths(
+        g1, [(nearest_nodes[u], nearest_nodes[v]) for u, v in g2.edges],
+        processes)
+
     # Add edges between the buses stops and their corresponding
     # nearest nodes from the streets graph
     for u, v, k in g2.edges(data=True):
         attr = k
         i = nearest_nodes[u]
         j = nearest_nodes[v]
-        time = nx.shortest_path_length(g1, i, j, weight='length') / 5.5
+        time = lengths[i, j] / 5.5
         city.add_edge(u, v, **attr, time=time)
 
         coord_i = g1.nodes[i]['y'], g1.nodes[i]['x']
@@ -385,13 +763,118 @@ def build_city_graph(g1: OsmnxGraph, g2: BusesGraph) -> CityGraph:
         coord_u = g2.nodes[u]['pos'][1], g2.nodes[u]['pos'][0]
         coord_v = g2.nodes[v]['pos'][1], g2.nodes[v]['pos'][0]
 
-        city.add_edge(i, u, stipus='enllaç', color='green',
+        city.add_edge(i, u, tipus='enllaç', color='green',
                       time=(haversine(coord_i, coord_u) / 1.5) + 150)
 
         city.add_edge(j, v, tipus='enllaç', color='green',
                       time=(haversine(coord_j, coord_v) / 1.5) + 150)
 
-    return city
+    return read_only(city)
+
+
+# spatial indexes already built by street_index: {graph: (nodes, index)}
+_street_indexes: weakref.WeakKeyDictionary[
+    OsmnxGraph, tuple[int, SpatialIndex]] = weakref.WeakKeyDictionary()
+_street_indexes_lock = threading.Lock()
+
+
+def street_index(g: OsmnxGraph) -> SpatialIndex:
+    """Returns a spatial index of the nodes of g, to find the nearest one
+    to a coordinate (instead of ox.nearest_nodes). It is built only once
+    for each graph (again if nodes are added to it), and kept while the
+    graph is used."""
+    with _street_indexes_lock:
+        found = _street_indexes.get(g)
+    if found is not None and found[0] == len(g):
+        return found[1]
+
+    ids = list(g.nodes)
+    index = SpatialIndex.build(
+        ids, np.arange(len(ids)),
+        np.array([(g.nodes[u]['x'], g.nodes[u]['y']) for u in ids]))
+    with _street_indexes_lock:
+        _street_indexes[g] = (len(ids), index)
+    return index
+
+
+def street_lengths(g: OsmnxGraph, pairs: list[tuple[int, int]],
+                   processes: int = 0) -> dict[tuple[int, int], float]:
+    """
+    Returns the length of the shortest path (as nx.shortest_path_length
+    with weight='length') between each pair of nodes of g. Instead of one
+    search per pair, there is one search per source node, which stops when
+    it has reached all its targets or gone too far from the source.
+    """
+    targets: dict[int, set[int]] = {}
+    for i, j in pairs:
+        targets.setdefault(i, set()).add(j)
+
+    searches = []
+    for i, js in targets.items():
+        straight = max(haversine((g.nodes[i]['y'], g.nodes[i]['x']),
+                                 (g.nodes[j]['y'], g.nodes[j]['x']))
+                       for j in js) * 1000
+        searches.append((i, js, straight * LINK_DETOUR + LINK_MARGIN))
+
+    adjacency = _street_adjacency(g)
+    if processes > 1:
+        with ProcessPoolExecutor(processes, initializer=_set_adjacency,
+                                 initargs=(adjacency,)) as pool:
+            found = list(pool.map(_bounded_search, searches, chunksize=64))
+    else:
+        _set_adjacency(adjacency)
+        found = list(map(_bounded_search, searches))
+
+    lengths: dict[tuple[int, int], float] = {}
+    for (i, js, _), dists in zip(searches, found):
+        for j in js:
+            if j in dists:
+                lengths[i, j] = dists[j]
+            else:  # farther than the bound
+                lengths[i, j] = nx.shortest_path_length(g, i, j,
+                                                        weight='length')
+    return lengths
+
+
+def _street_adjacency(g: OsmnxGraph) -> Adjacency:
+    """Successors of each node of g with the length of the shortest of the
+    parallel edges, as nx.shortest_path_length uses in multigraphs."""
+    return {u: [(v, min(e.get('length', 1) for e in edges.values()))
+                for v, edges in nbrs.items()]
+            for u, nbrs in g.adjacency()}
+
+
+_adjacency: Adjacency = {}  # the graph of the searches of each process
+
+
+def _set_adjacency(adjacency: Adjacency) -> None:
+    global _adjacency
+    _adjacency = adjacency
+
+
+def _bounded_search(search: tuple[int, set[int], float]) -> dict[int, float]:
+    """Dijkstra from the source that stops when it has reached all the
+    targets or when the distance is over the radius. Returns the distances
+    of the targets reached."""
+    source, targets, radius = search
+    pending = set(targets)
+    found: dict[int, float] = {}
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap and pending:
+        d, u = heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > radius:
+            break
+        if u in pending:
+            pending.discard(u)
+            found[u] = d
+        for v, w in _adjacency.get(u, ()):
+            if d + w < dist.get(v, float('inf')):
+                dist[v] = d + w
+                heappush(heap, (d + w, v))
+    return found
 
 
 def show(g: CityGraph) -> None:
@@ -413,7 +896,7 @@ def plot_city(g: CityGraph, filename: str) -> None:
     map in the background as 'filename'.
     """
 
-    city_map = StaticMap(3500, 3500)
+    city_map = static_map(3500, 3500)
     for node in g.nodes:
         if g.nodes[node]['tipus'] == 'Cruilla':
             city_map.add_marker(CircleMarker((
@@ -444,7 +927,7 @@ def plot_path(p: Path, filename: str) -> None:
     map and saves it as an image at 'filename'.
     """
     g = p.plot_graph
-    city_map = StaticMap(3500, 3500)
+    city_map = static_map(3500, 3500)
 
     # Gets the map_pointer image which should
     # be named as 'map_pointer.png'and have size 100 x 100 pixels.
@@ -1,20 +1,27 @@
 import os
+import sys
 
 import billboard as bboard
 import rich.console
 import city
+import routing
+import transit
 
 from rich.table import Table
 from rich.panel import Panel
 from rich import box
 from loaders import TextLoader
-from constants import film_genres
+from constants import cinemas_coords, film_genres
 from PIL.Image import Image as ImageType
 from PIL import Image as Image
 from dataclasses import dataclass
+from threading import Thread
 
 
 console = rich.console.Console()
+BUSES_FILE = 'buses_Bcn.pickle'
+STREETS_FILE = 'osmnx_Bcn.pickle'
+CITY_DIR = 'city_Bcn'  # CSR of the city graph and the cinema tables
 loader = TextLoader(colour='yellow', text='Loading', speed=.2,
                     animation='loop', complete_text='')
 
@@ -32,13 +39,27 @@ class Demo:
         - Brief information about the authors of the project.
     '''
 
-    Bus: city.BusesGraph
-    Streets: city.OsmnxGraph
-    City: city.CityGraph
+    # the graphs are only loaded (or built) the first time they are needed
+    # by the properties Bus, Streets and City: the searches only need the
+    # Router
+    _bus: city.BusesGraph | None
+    _streets: city.OsmnxGraph | None
+    _city: city.CityGraph | None
+    Router: routing.Router
+    # times to the cinemas (None while they are built)
+    Cinemas: routing.CinemaTables | None
+    Routes: city.RouteCache  # paths already found
+    # round-based router over the bus lines (only with --transit)
+    Transit: transit.TransitNetwork | None
     Bboard: bboard.Billboard
 
-    def __init__(self) -> None:
-        """Constructor of the class. Initializes the menu system."""
+    def __init__(self, use_transit: bool = False) -> None:
+        """Constructor of the class. Initializes the menu system.
+        With use_transit, the paths to the cinemas are the journeys of the
+        transit router instead of the searches over the city graph."""
+        self.Transit = None
+        if use_transit:
+            self.Transit = transit.build_network()
         return self.init_demo()
 
     def clear(self) -> None:
@@ -141,7 +162,8 @@ class Demo:
             'duration --- duration = duration_minutes\n' +
             '                        (max_duration)\n' +
             'language --- language = V.O. / Spanish\n' +
-            'city ------- city = city_Name',
+            'city ------- city = city_Name\n' +
+            'day -------- day = 0 (today) / 1 (tomorrow) / ...',
             title="[magenta]Filter types---Specific format",
             expand=False))
 
@@ -160,6 +182,14 @@ class Demo:
                 k = k.strip()
                 v = v.strip()
                 filters[k] = v
+            # names written without accents, capital letters...
+            for k in ('film', 'director', 'cinema'):
+                if k in filters:
+                    found = self.Bboard.search(filters[k], k, limit=1)
+                    if found != [] and found[0].score == 1:
+                        filters[k] = found[0].name
+            # parse and validate the filter before applying it
+            plan = self.Bboard.compile_filter(filters)
         except Exception:
             text = '[red]Wrong format!😓\n'
             return self.next_plot(direct=10, text=text)
@@ -175,7 +205,7 @@ class Demo:
         table.add_column("Language🔊", justify="center", style="green")
 
         try:
-            filtered_billboard = self.Bboard.filter(filters)
+            filtered_billboard = self.Bboard.filter(plan)
         except Exception:
             txt = "[red]Sorry, couldn't apply this filter😥💀. \n"
             return self.next_plot(direct=10, text=txt)
@@ -244,17 +274,30 @@ class Demo:
         if movie == '0':  # Return
             self.clear()
             return self.next_plot(direct=14)
-        if movie not in [f.title for f in self.Bboard.films]:
+        found = self.Bboard.search(movie, 'film')
+        if found == []:
             text = ("[red]We can't find this movie!😓\n" +
                     "Check the available movies at the billboard.")
             return self.next_plot(direct=3, text=text)
+        # if it's not the exact title, we only take the most similar
+        # title if it's clearly better than the others
+        if found[0].score < 1 and (
+                found[0].score < 0.75 or
+                len(found) > 1 and found[1].score > found[0].score - 0.1):
+            text = ("[red]We can't find this movie!😓\n" +
+                    "[white]Did you mean: \n   " +
+                    '\n   '.join(r.name for r in found))
+            return self.next_plot(direct=3, text=text)
+        movie = found[0].name
         try:
             time = input('Enter your time disponibility\n' +
                          '(Format: hh:mm-hh:mm): ')
-            start_time = time.split('-')[0]
-            FilteredBboard = self.Bboard.filter({'time': time,
-                                                 'city': 'Barcelona',
-                                                 'film': movie})
+            plan = self.Bboard.compile_filter({'time': time,
+                                               'city': 'Barcelona',
+                                               'film': movie})
+            assert plan.time is not None
+            start_time = plan.time[0]
+            FilteredBboard = self.Bboard.filter(plan)
             coords = input('Enter your position coordinates\n' +
                            '(format: lat, long): ')
             x_, y_ = coords.split(',')
@@ -301,7 +344,7 @@ class Demo:
                   f'start {proj.start[0]:02d}:{proj.start[1]:02d} --- ' + \
                   f'duration {proj.duration} m'
         loader.start()
-        path.get_other_data()
+        path.get_other_data(self.City, self.Streets)
         loader.stop()
 
         indic = path.path_indications
@@ -334,24 +377,54 @@ class Demo:
     def find_first_movie_path(
             self,
             FilteredBboard: list[bboard.Projection],
-            time_: str,
+            time: int,
             coords: city.Coord) -> tuple[city.Path, bboard.Projection] | None:
         """
         Given the filtered list of screenings, search for the first screening
         that can be reached from the specified position
-        and the given initial time. Returns the path to reach that screening.
+        and the given initial time (in minutes).
+        Returns the path to reach that screening.
         """
         self.clear()
-        h, m = time_.split(':')
-        time = int(h) * 60 + int(m)  # time in minutes
+        if not FilteredBboard:
+            return None
+
+        if self.Transit is not None:
+            # (a round-based search over the bus lines for each cinema)
+            cinemas = {proj.cinema.coord for proj in FilteredBboard}
+            journeys = {c: transit.fastest(self.Transit, coords, c, time * 60)
+                        for c in cinemas}
+            for proj in FilteredBboard:
+                journey = journeys[proj.cinema.coord]
+                if time + journey.time <= _start_after(proj, time):
+                    return city.find_journey_path(
+                        None, self.City, coords, proj.cinema.coord,
+                        self.Transit, journey, self.Router), proj
+            return None
+
+        tables = self.Cinemas
+        names = {proj.cinema.name for proj in FilteredBboard}
+        if tables is not None and all(name in tables.rows for name in names):
+            # (the times are looked up, and only one path is followed)
+            minutes = city.cinema_times(self.Router, tables, coords, names)
+            for proj in FilteredBboard:
+                if proj.cinema.name in minutes and \
+                        time + minutes[proj.cinema.name] <= \
+                        _start_after(proj, time):
+                    return city.find_cinema_path(
+                        None, None, coords, proj.cinema.name,
+                        self.Router, tables), proj
+            return None
+
+        # (a single search from coords to all the cinemas)
+        cinemas = list({proj.cinema.coord for proj in FilteredBboard})
+        paths = dict(zip(cinemas, city.find_paths_to_many(
+            None, None, coords, cinemas, self.Router, self.Routes)))
 
         proj: bboard.Projection
         for proj in FilteredBboard:
-            movie_coords: city.Coord = proj.cinema.coord
-            h, m = proj.start
-            movie_start = int(h) * 60 + int(m)  # time in minutes
-            path: city.Path = city.find_path(self.Streets, self.City,
-                                             coords, movie_coords)
+            movie_start = _start_after(proj, time)  # time in minutes
+            path: city.Path = paths[proj.cinema.coord]
 
             if time + path.time <= movie_start:
                 return path, proj
@@ -456,36 +529,115 @@ class Demo:
         if num == 16:
             return self.plot_main_menu()
 
-    def get_data(self) -> tuple[bboard.Billboard, city.BusesGraph,
-                                city.OsmnxGraph, city.CityGraph]:
-        """Downloads the necessary data to run the program."""
-        self.Bboard = bboard.read()
-        self.Bboard.genres = film_genres  # (generes amb emojis)
-        self.Bus = city.get_buses_graph()
-        try:
-            self.Streets = city.load_osmnx_graph('osmnx_Bcn.pickle')
-        except Exception:
+    @property
+    def Bus(self) -> city.BusesGraph:
+        """The buses graph, loaded the first time it is needed."""
+        if self._bus is None:
             try:
-                self.Streets = city.get_osmnx_graph()
+                self._bus = city.load_buses_graph(BUSES_FILE)
             except Exception:
-                loader.stop()
-                console.print('[red]Could not get data from OpenStreepMap.')
-                exit(1)
+                self._bus = city.get_buses_graph()
+                try:
+                    city.save_buses_graph(self._bus, BUSES_FILE)
+                except Exception:
+                    self.clear()
+                    console.print('[red]Could not save buses graph.')
+        return self._bus
+
+    @property
+    def Streets(self) -> city.OsmnxGraph:
+        """The streets graph, loaded the first time it is needed."""
+        if self._streets is None:
             try:
-                city.save_osmnx_graph(self.Streets, 'osmnx_Bcn.pickle')
+                self._streets = city.load_osmnx_graph(STREETS_FILE)
             except Exception:
-                self.clear()
-                console.print('[red]Could not save Osmnx graph.')
+                try:
+                    self._streets = city.get_osmnx_graph()
+                except Exception:
+                    loader.stop()
+                    console.print(
+                        '[red]Could not get data from OpenStreepMap.')
+                    exit(1)
+                try:
+                    city.save_osmnx_graph(self._streets, STREETS_FILE)
+                except Exception:
+                    self.clear()
+                    console.print('[red]Could not save Osmnx graph.')
+        return self._streets
+
+    @property
+    def City(self) -> city.CityGraph:
+        """The city graph, built from the CSR of the router the first time
+        it is needed (to plot the paths and the city)."""
+        if self._city is None:
+            self._city = self.Router.csr.to_city_graph()
+        return self._city
+
+    def get_data(self) -> None:
+        """Downloads the necessary data to run the program. The CSR of the
+        city graph saved by a previous run is used while it is newer than
+        the buses and streets graphs, without loading them, and while the
+        buses graph was built less than city.CACHE_MAX_AGE seconds ago: an
+        older one is built again from the AMB data (which is downloaded
+        again if its copy is as old)."""
+        self.Bboard = bboard.read(snapshot='billboard.snapshot')
+        self.Bboard.genres = film_genres  # (generes amb emojis)
+        self._bus = self._streets = self._city = None
         try:
-            self.City: city.CityGraph = city.build_city_graph(self.Streets,
-                                                              self.Bus)
-            return self.Bboard, self.Bus, self.Streets, self.City
+            csr = routing.load_csr(CITY_DIR)
+            if not all(os.path.getmtime(f) <= csr.created
+                       for f in (BUSES_FILE, STREETS_FILE)) or \
+                    city.buses_graph_age(BUSES_FILE) > city.CACHE_MAX_AGE:
+                raise FileNotFoundError  # the saved one is outdated
+            self.Router = routing.Router(csr)
+            self.start_cinema_tables()
+            return
+        except Exception:
+            pass
+        try:
+            self._city = city.build_city_graph(self.Streets, self.Bus)
         except Exception:
             console.print('[red]Sorry, something went wrong!😭💀🤨')
             exit(1)
+        csr = routing.to_csr(self._city)
+        self.Router = routing.Router(csr)
+        try:
+            routing.save_csr(csr, CITY_DIR)
+        except Exception:
+            self.clear()
+            console.print('[red]Could not save city graph.')
+        self.start_cinema_tables()
+
+    def start_cinema_tables(self) -> None:
+        """Gets the times to the cinemas in the background: building them
+        takes a search over the whole city graph for each cinema that has
+        changed, and until they are ready the paths are searched each
+        time."""
+        self.Cinemas = None
+        Thread(target=self.get_cinema_tables, daemon=True).start()
+
+    def get_cinema_tables(self) -> None:
+        """Loads the times to the cinemas, searching again only the
+        cinemas that have changed (all of them if the city graph has)."""
+        try:
+            old = routing.load_cinema_tables(CITY_DIR)
+        except Exception:
+            old = None
+        try:
+            tables = routing.build_cinema_tables(self.Router,
+                                                 cinemas_coords, old)
+        except Exception:
+            return  # (the paths are searched each time)
+        self.Cinemas = tables
+        if tables is not old:
+            try:
+                routing.save_cinema_tables(tables, CITY_DIR)
+            except Exception:
+                pass  # (they are built again the next time)
 
     def init_demo(self) -> None:
         self.clear()
+        self.Routes = city.RouteCache()
         loader.start()
         self.get_data()
         loader.stop()
@@ -493,5 +645,14 @@ class Demo:
         self.plot_main_menu()
 
 
+def _start_after(proj: bboard.Projection, time: int) -> int:
+    """Start of the projection in minutes since the midnight before time:
+    the projections of a time window that ends after midnight which start
+    before time start the next day."""
+    if proj.start_min < time:
+        return proj.start_min + bboard.DAY
+    return proj.start_min
+
+
 if __name__ == "__main__":
-    Demo()
+    Demo(use_transit='--transit' in sys.argv[1:])
@@ -0,0 +1,973 @@
+"""
+Compact (CSR) format of the city graph, to load it without building it.
+
+The nodes are numbered from 0 to n - 1 (ids[i] is the node i of the
+CityGraph) and the neighbours of the node i are
+targets[offsets[i]:offsets[i + 1]], with the time and the kind of each edge
+at the same positions of times and edge_kinds. Each edge of the CityGraph
+is saved in both directions.
+
+The arrays are saved as .npy files in a directory and loaded memory-mapped,
+so loading doesn't read them and several processes share their pages. The
+ids, and the names and lines of the stops and of the bus edges, are saved
+at meta.json. The contraction hierarchy of the graph, if it is built, is
+saved in the same directory (ch_*.npy and ch.json), as the tables of the
+times to the cinemas (cinemas_*.npy and cinemas.json).
+"""
+from typing import Any
+from dataclasses import dataclass
+from functools import cached_property
+from heapq import heapify, heappop, heappush
+from math import asin, cos, radians, sin, sqrt
+import hashlib
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+import numpy as np
+import networkx as nx
+
+
+CSR_VERSION = 2  # format of the directories saved by save_csr
+KINDS = ('Cruilla', 'Parada')  # kinds of the nodes
+EDGE_KINDS = ('carrer', 'Bus', 'enllaç')  # kinds of the edges
+COLORS = {'carrer': 'red', 'Bus': 'blue', 'enllaç': 'green'}
+WALK_SPEED = 1.5  # m/s, of the 'carrer' edges of the city graph
+ARRAYS = ('offsets', 'targets', 'times', 'edge_kinds', 'coords', 'kinds')
+GRID_ARRAYS = ('points', 'order', 'cells')  # saved as grid_<name>.npy
+METHODS = ('dijkstra', 'astar', 'bidirectional_astar', 'ch')  # of Router
+CH_ARRAYS = ('level', 'offsets', 'targets', 'times', 'middles')  # ch_*.npy
+WITNESS_SETTLED = 100  # max nodes settled by each witness search
+CINEMA_ARRAYS = ('times', 'nexts')  # saved as cinemas_<name>.npy
+GRID_CELL = 100  # meters of side of the cells of the spatial index
+EARTH_RADIUS = 6371008.8  # meters
+
+
+@dataclass
+class SpatialIndex:
+    """
+    Grid over a set of points to find the nearest one to a coordinate. The
+    points are projected to meters (equirectangular projection around lat0,
+    exact enough at the scale of a city) and each cell of the grid keeps the
+    points inside it: order[cells[k]:cells[k + 1]] are the points of the
+    cell k = column * rows + row.
+    """
+    ids: list[Any]  # id of each point
+    points: np.ndarray  # int32, number of each point (node of the CSR)
+    xy: np.ndarray  # float64 (m, 2), meters
+    order: np.ndarray  # int32, points sorted by cell
+    cells: np.ndarray  # int64, start of each cell in order
+    lat0: float  # degrees
+    origin: tuple[float, float]  # meters of the corner of the grid
+    shape: tuple[int, int]  # columns and rows
+    cell: float  # meters
+
+    @staticmethod
+    def build(ids: list[Any], points: np.ndarray, coords: np.ndarray,
+              cell: float = GRID_CELL) -> 'SpatialIndex':
+        """Returns the index of the points with the given ids, numbers and
+        coordinates (longitude, latitude)."""
+        lat0 = float(np.mean(coords[:, 1])) if len(coords) else 0.0
+        xy = _project(coords, lat0)
+        origin = xy.min(axis=0) if len(xy) else np.zeros(2)
+        shape = ((xy.max(axis=0) - origin) // cell).astype(np.int64) + 1 \
+            if len(xy) else np.ones(2, dtype=np.int64)
+        col_row = ((xy - origin) // cell).astype(np.int64)
+        keys = col_row[:, 0] * shape[1] + col_row[:, 1]
+        order = np.argsort(keys, kind='stable').astype(np.int32)
+        cells = np.searchsorted(keys[order],
+                                np.arange(shape[0] * shape[1] + 1))
+        return SpatialIndex(ids, np.asarray(points, dtype=np.int32), xy,
+                            order, cells.astype(np.int64), lat0,
+                            (float(origin[0]), float(origin[1])),
+                            (int(shape[0]), int(shape[1])), cell)
+
+    @cached_property
+    def _lists(self) -> tuple[list[float], list[float], list[int],
+                              list[int]]:
+        """x, y, order and cells as python lists (much faster to index
+        one by one than arrays)."""
+        return (self.xy[:, 0].tolist(), self.xy[:, 1].tolist(),
+                self.order.tolist(), self.cells.tolist())
+
+    def snap(self, coord: tuple[float, float]) -> tuple[Any, float]:
+        """Returns the id of the nearest point to coord (latitude,
+        longitude) and its distance in meters."""
+        xs, ys, order, cells = self._lists
+        x = radians(coord[1]) * cos(radians(self.lat0)) * EARTH_RADIUS
+        y = radians(coord[0]) * EARTH_RADIUS
+        col = int((x - self.origin[0]) // self.cell)
+        row = int((y - self.origin[1]) // self.cell)
+        dx = x - self.origin[0] - col * self.cell  # inside the cell
+        dy = y - self.origin[1] - row * self.cell
+        cols, rows = self.shape
+        best, best_d2 = -1, float('inf')
+
+        # the rings nearer than the grid are empty
+        r = max(-col, col - cols + 1, -row, row - rows + 1, 0)
+        while True:
+            # points of the cells at distance r (in cells) of (col, row)
+            for first, last in self._ring(col, row, r):
+                for p in order[cells[first]:cells[last + 1]]:
+                    d2 = (xs[p] - x) ** 2 + (ys[p] - y) ** 2
+                    if d2 < best_d2:
+                        best, best_d2 = p, d2
+            # the points of the next rings are out of the square of the
+            # rings seen, so they are farther than its nearest side
+            side = r * self.cell + min(dx, dy, self.cell - dx, self.cell - dy)
+            if best >= 0 and best_d2 <= side ** 2:
+                break
+            if col - r <= 0 and row - r <= 0 and \
+                    col + r >= cols - 1 and row + r >= rows - 1:
+                break  # all the grid has been seen
+            r += 1
+
+        if best == -1:
+            raise ValueError('the spatial index has no points')
+        return self.ids[best], best_d2 ** 0.5
+
+    def snap_many(self, coords: np.ndarray) -> tuple[list[Any], np.ndarray]:
+        """Returns the ids of the nearest points to each coordinate
+        (latitude, longitude) and their distances in meters."""
+        found = [self.snap((lat, lon))
+                 for lat, lon in np.asarray(coords).tolist()]
+        return [u for u, _ in found], np.array([d for _, d in found])
+
+    def _ring(self, col: int, row: int, r: int) -> list[tuple[int, int]]:
+        """Ranges (first and last cell) of the cells in the border of the
+        square of side 2r + 1 centered at (col, row)."""
+        cols, rows = self.shape
+        ranges = []
+        for c in range(max(col - r, 0), min(col + r, cols - 1) + 1):
+            if c in (col - r, col + r):  # a whole column of the square
+                column = [(row - r, row + r)]
+            else:  # its first and last cells
+                column = [(row - r, row - r), (row + r, row + r)]
+            for first, last in column:
+                first, last = max(first, 0), min(last, rows - 1)
+                if first <= last:
+                    ranges.append((c * rows + first, c * rows + last))
+        return ranges
+
+
+def _project(coords: np.ndarray, lat0: float) -> np.ndarray:
+    """Equirectangular projection (meters) of (longitude, latitude)."""
+    rad = np.radians(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    return np.column_stack((rad[:, 0] * np.cos(np.radians(lat0)),
+                            rad[:, 1])) * EARTH_RADIUS
+
+
+@dataclass
+class CSRGraph:
+    ids: list[Any]  # id of each node in the CityGraph
+    offsets: np.ndarray  # int64, the edges of node i start at offsets[i]
+    targets: np.ndarray  # int32, the node each edge goes to
+    times: np.ndarray  # float32, seconds of each edge
+    edge_kinds: np.ndarray  # int8, index of the kind in EDGE_KINDS
+    coords: np.ndarray  # float64, pos of each node: (longitude, latitude)
+    kinds: np.ndarray  # int8, index of the kind in KINDS
+    stops: dict[int, dict[str, Any]]  # 'nom' and 'linies' of the stops
+    linies: dict[tuple[int, int], list[str]]  # of the bus edges, u < v
+    grid: SpatialIndex  # of the nodes of the streets
+    created: float = 0.0  # time when it was built
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @cached_property
+    def index(self) -> dict[Any, int]:
+        """Number of each node id."""
+        return {u: i for i, u in enumerate(self.ids)}
+
+    @cached_property
+    def version(self) -> str:
+        """Hash of the nodes, the edges and their times, computed only the
+        first time (the arrays are read-only, see to_csr and load_csr)."""
+        sha = hashlib.sha1(repr(self.ids).encode())
+        for array in (self.offsets, self.targets, self.times):
+            sha.update(np.ascontiguousarray(array).tobytes())
+        return sha.hexdigest()
+
+    def to_city_graph(self) -> nx.Graph:
+        """Returns the CityGraph saved in this CSR (with the attributes
+        used by the program, and the length of the streets from their walking
+        time), read-only as the one of build_city_graph (see read_only). It
+        is built again in each call, so it is better built only when a
+        networkx graph is needed (the searches only need the CSR)."""
+        g = nx.Graph()
+        coords = self.coords.tolist()
+        for i, (u, kind) in enumerate(zip(self.ids, self.kinds.tolist())):
+            lon, lat = coords[i]
+            if KINDS[kind] == 'Cruilla':
+                g.add_node(u, x=lon, y=lat, pos=(lon, lat),
+                           tipus='Cruilla', color='black')
+            else:
+                g.add_node(u, tipus='Parada', pos=(lon, lat),
+                           color='black', **self.stops[i])
+
+        sources = np.repeat(np.arange(len(self), dtype=np.int32),
+                            np.diff(self.offsets))
+        edges = np.flatnonzero(sources < self.targets)
+        for u, v, t, kind in zip(sources[edges].tolist(),
+                                 self.targets[edges].tolist(),
+                                 self.times[edges].tolist(),
+                                 self.edge_kinds[edges].tolist()):
+            tipus = EDGE_KINDS[kind]
+            attr = {'tipus': tipus, 'color': COLORS[tipus], 'time': t}
+            if tipus == 'Bus':
+                attr['linies'] = self.linies[u, v]
+            elif tipus == 'carrer':
+                attr['length'] = t * WALK_SPEED
+            g.add_edge(self.ids[u], self.ids[v], **attr)
+        return read_only(g)
+
+
+class _SearchState(threading.local):
+    """Arrays of the searches of a Router, one copy per thread, so several
+    threads can search with the same Router at the same time."""
+
+    def __init__(self, n: int) -> None:
+        # [0]: search from the source, [1]: search from the destination
+        self.dist = ([0.0] * n, [0.0] * n)
+        self.parent = ([-1] * n, [-1] * n)
+        self.query = ([0] * n, [0] * n)
+        self.potential = [0.0] * n
+        self.potential_query = [0] * n
+        self.queries = 0
+        self.settled = 0  # nodes settled by the last query
+
+
+class Router:
+    """
+    Shortest paths over a CSRGraph, with one of the METHODS:
+    - 'dijkstra': bidirectional Dijkstra (the same algorithm that
+      nx.shortest_path uses between two nodes): a search from the source
+      and another one from the destination (the graph is undirected) until
+      they meet.
+    - 'astar': A* guided by the straight line time to the destination at
+      the fastest speed of any edge of the graph, which is never more than
+      the real time.
+    - 'bidirectional_astar': bidirectional Dijkstra where each search is
+      guided by the average of the straight line times to the destination
+      and from the source (so that both searches can stop when they meet).
+    - 'ch': bidirectional Dijkstra that only goes up the contraction
+      hierarchy given (see build_hierarchy), with its shortcuts unpacked
+      in the path returned.
+    The distances, parents, potentials and the number of the query that set
+    them are kept in arrays of one element per node and search (one copy
+    per thread), which are not cleared between queries: an element is only
+    valid if it was set by the current query.
+    """
+
+    def __init__(self, csr: CSRGraph,
+                 hierarchy: 'Hierarchy | None' = None) -> None:
+        self.csr = csr
+        self.hierarchy = hierarchy
+        # The searches go through a copy of the edges as python lists, in the
+        # memory of each process (not shared as the memory-mapped arrays):
+        # about 13 times the memory of the arrays, but taking the elements
+        # of the arrays one by one makes the searches 4 to 5 times slower
+        # (bench.py router measures both).
+        offsets = csr.offsets.tolist()
+        edges = list(zip(csr.targets.tolist(), csr.times.tolist()))
+        self.edges: list[list[tuple[int, float]]] = [
+            edges[offsets[u]:offsets[u + 1]] for u in range(len(csr))]
+        self.state = _SearchState(len(csr))
+
+        rad = np.radians(np.asarray(csr.coords))
+        self.lat: list[float] = rad[:, 1].tolist()
+        self.lon: list[float] = rad[:, 0].tolist()
+        self.cos_lat = [cos(lat) for lat in self.lat]
+        self.speed = _max_speed(csr)
+
+        if hierarchy is not None:
+            offsets = hierarchy.offsets.tolist()
+            edges = list(zip(hierarchy.targets.tolist(),
+                             hierarchy.times.tolist()))
+            self.up: list[list[tuple[int, float]]] = [
+                edges[offsets[u]:offsets[u + 1]] for u in range(len(csr))]
+            sources = np.repeat(np.arange(len(csr)), np.diff(offsets))
+            shortcuts = np.flatnonzero(np.asarray(hierarchy.middles) >= 0)
+            self.middles: dict[tuple[int, int], int] = {
+                (min(u, v), max(u, v)): m for u, v, m in zip(
+                    sources[shortcuts].tolist(),
+                    np.asarray(hierarchy.targets)[shortcuts].tolist(),
+                    np.asarray(hierarchy.middles)[shortcuts].tolist())}
+
+    @property
+    def settled(self) -> int:
+        """Nodes settled by the last query (of this thread)."""
+        return self.state.settled
+
+    def shortest_path(self, src: int, dst: int,
+                      method: str = 'dijkstra') -> tuple[list[int], float]:
+        """Returns the nodes (numbers) of the fastest path from src to dst
+        and its time, in seconds, found with one of the METHODS."""
+        state = self.state
+        state.queries += 1
+        for side, node in ((0, src), (1, dst)):
+            state.dist[side][node] = 0.0
+            state.parent[side][node] = -1
+            state.query[side][node] = state.queries
+
+        if method == 'astar':
+            meet, time = self._astar(src, dst)
+        elif method == 'ch':
+            if self.hierarchy is None:
+                raise ValueError("the method 'ch' needs a hierarchy")
+            meet, time = self._upward(src, dst)
+            if meet != -1:
+                return self._unpack(self._path(meet)), time
+        elif method in ('dijkstra', 'bidirectional_astar'):
+            meet, time = self._bidirectional(
+                src, dst, method == 'bidirectional_astar')
+        else:
+            raise ValueError(f'unknown method {method}, use one of {METHODS}')
+
+        if meet == -1:
+            raise nx.NetworkXNoPath(f'Node {self.csr.ids[dst]} not '
+                                    f'reachable from {self.csr.ids[src]}')
+        return self._path(meet), time
+
+    def shortest_paths(self, src: int,
+                       dsts: list[int]) -> list[tuple[list[int], float]]:
+        """Returns the nodes and the time of the fastest paths from src to
+        each of dsts, found with a single Dijkstra from src that stops when
+        all of them are settled. It doesn't use the contraction hierarchy:
+        with it, each of dsts would need its own query (and its shortcuts
+        unpacked), while this search settles each node once for all of
+        them."""
+        state = self.state
+        state.queries += 1
+        q = state.queries
+        edges, dist, parent, query = self.edges, state.dist[0], \
+            state.parent[0], state.query[0]
+        dist[src], parent[src], query[src] = 0.0, -1, q
+        pending = set(dsts)
+        heap = [(0.0, src)]
+        settled = 0
+
+        while heap and pending:
+            d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            settled += 1
+            pending.discard(u)
+            for v, w in edges[u]:
+                w += d
+                if query[v] != q or w < dist[v]:
+                    dist[v], parent[v], query[v] = w, u, q
+                    heappush(heap, (w, v))
+
+        state.settled = settled
+        if pending:
+            raise nx.NetworkXNoPath(f'Node {self.csr.ids[pending.pop()]} '
+                                    f'not reachable from {self.csr.ids[src]}')
+        paths = []
+        for dst in dsts:
+            nodes = [dst]
+            while parent[nodes[-1]] != -1:
+                nodes.append(parent[nodes[-1]])
+            nodes.reverse()
+            paths.append((nodes, dist[dst]))
+        return paths
+
+    def tree(self, dst: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the time of the fastest path from each node to dst and the
+        next node of each path (-1 at dst and at the nodes that cannot
+        reach it), found with a Dijkstra over the whole graph from dst (the
+        edges are saved in both directions, with the same time).
+        """
+        edges = self.edges
+        dist = [float('inf')] * len(edges)
+        nexts = [-1] * len(edges)
+        dist[dst] = 0.0
+        heap = [(0.0, dst)]
+        while heap:
+            d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, w in edges[u]:
+                w += d
+                if w < dist[v]:
+                    dist[v], nexts[v] = w, u
+                    heappush(heap, (w, v))
+        return (np.array(dist, dtype=np.float32),
+                np.array(nexts, dtype=np.int32))
+
+    def _straight_time(self, u: int, v: int) -> float:
+        """Seconds from u to v in straight line at the fastest speed."""
+        lat, lon, cos_lat = self.lat, self.lon, self.cos_lat
+        h = sin((lat[v] - lat[u]) / 2) ** 2 + \
+            cos_lat[u] * cos_lat[v] * sin((lon[v] - lon[u]) / 2) ** 2
+        return 2 * EARTH_RADIUS * asin(sqrt(min(h, 1.0))) / self.speed
+
+    def _astar(self, src: int, dst: int) -> tuple[int, float]:
+        """A* from src to dst. Returns dst and its time if reached."""
+        state = self.state
+        q = state.queries
+        edges, dist, parent, query = self.edges, state.dist[0], \
+            state.parent[0], state.query[0]
+        potential, potential_query = state.potential, state.potential_query
+        straight = self._straight_time
+
+        heap = [(straight(src, dst), 0.0, src)]
+        settled = 0
+        while heap:
+            _, d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            settled += 1
+            if u == dst:
+                state.settled = settled
+                return dst, d
+            for v, w in edges[u]:
+                w += d
+                if query[v] != q or w < dist[v]:
+                    dist[v], parent[v], query[v] = w, u, q
+                    if potential_query[v] != q:
+                        potential[v] = straight(v, dst)
+                        potential_query[v] = q
+                    heappush(heap, (w + potential[v], w, v))
+
+        state.settled = settled
+        return -1, float('inf')
+
+    def _bidirectional(self, src: int, dst: int,
+                       guided: bool) -> tuple[int, float]:
+        """
+        Bidirectional search from src and dst. The nodes are taken from the
+        heaps by their distance plus (forward) or minus (backward) their
+        potential, which is 0 if not guided. Returns the node where the
+        searches meet and the time of the path, if they meet.
+        """
+        state = self.state
+        q = state.queries
+        edges = self.edges
+        potential, potential_query = state.potential, state.potential_query
+        straight = self._straight_time
+
+        def pot(v: int) -> float:
+            if potential_query[v] != q:
+                potential[v] = (straight(v, dst) - straight(src, v)) / 2 \
+                    if guided else 0.0
+                potential_query[v] = q
+            return potential[v]
+
+        forward = [(pot(src), 0.0, src)]
+        backward = [(-pot(dst), 0.0, dst)]
+        searches = [(heap, sign, state.dist[side], state.parent[side],
+                     state.query[side], state.dist[1 - side],
+                     state.query[1 - side])
+                    for side, heap, sign in ((0, forward, 1),
+                                             (1, backward, -1))]
+        best, meet = (0.0, src) if src == dst else (float('inf'), -1)
+        settled = 0
+
+        while forward and backward:
+            # no path through the nodes left is shorter than best
+            if forward[0][0] + backward[0][0] >= best:
+                break
+            # the search with the nearest node goes on
+            heap, sign, dist, parent, query, other_dist, other_query = \
+                searches[forward[0][0] > backward[0][0]]
+
+            _, d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            settled += 1
+            for v, w in edges[u]:
+                w += d
+                if query[v] != q or w < dist[v]:
+                    dist[v], parent[v], query[v] = w, u, q
+                    heappush(heap, (w + sign * pot(v) if guided else w,
+                                    w, v))
+                if other_query[v] == q and w + other_dist[v] < best:
+                    best, meet = w + other_dist[v], v
+
+        state.settled = settled
+        return meet, best
+
+    def _upward(self, src: int, dst: int) -> tuple[int, float]:
+        """
+        Bidirectional Dijkstra from src and dst that only follows the edges
+        that go up the hierarchy. As the searches can meet at a node before
+        the one of the shortest path, each one goes on until its nearest
+        node is farther than the best path found.
+        """
+        state = self.state
+        q = state.queries
+        up = self.up
+        forward = [(0.0, src)]
+        backward = [(0.0, dst)]
+        searches = [(heap, state.dist[side], state.parent[side],
+                     state.query[side], state.dist[1 - side],
+                     state.query[1 - side])
+                    for side, heap in ((0, forward), (1, backward))]
+        best, meet = (0.0, src) if src == dst else (float('inf'), -1)
+        settled = 0
+
+        while True:
+            going = [heap[0][0] if heap and heap[0][0] < best else None
+                     for heap in (forward, backward)]
+            if going == [None, None]:
+                break
+            side = 1 if going[0] is None or \
+                (going[1] is not None and going[1] < going[0]) else 0
+            heap, dist, parent, query, other_dist, other_query = \
+                searches[side]
+
+            d, u = heappop(heap)
+            if d > dist[u]:
+                continue
+            settled += 1
+            if other_query[u] == q and d + other_dist[u] < best:
+                best, meet = d + other_dist[u], u
+            # stall: a node above reaches u faster, so the search from u
+            # cannot be the one of the fastest path
+            if any(query[v] == q and dist[v] + w < d for v, w in up[u]):
+                continue
+            for v, w in up[u]:
+                w += d
+                if query[v] != q or w < dist[v]:
+                    dist[v], parent[v], query[v] = w, u, q
+                    heappush(heap, (w, v))
+
+        state.settled = settled
+        return meet, best
+
+    def _unpack(self, path: list[int]) -> list[int]:
+        """Replaces the shortcuts of the path by the nodes they skip."""
+        nodes = [path[0]]
+        for u, v in zip(path, path[1:]):
+            stack = [(u, v)]
+            while stack:
+                a, b = stack.pop()
+                m = self.middles.get((min(a, b), max(a, b)), -1)
+                if m == -1:
+                    nodes.append(b)
+                else:  # (a, m) first, then (m, b)
+                    stack.append((m, b))
+                    stack.append((a, m))
+        return nodes
+
+    def _path(self, meet: int) -> list[int]:
+        """Nodes of the path of the last query through meet."""
+        state = self.state
+        path = [meet]
+        while state.parent[0][path[-1]] != -1:
+            path.append(state.parent[0][path[-1]])
+        path.reverse()
+        while state.parent[1][path[-1]] != -1:
+            path.append(state.parent[1][path[-1]])
+        return path
+
+
+@dataclass
+class Hierarchy:
+    """
+    Contraction hierarchy of a CSRGraph: the nodes are contracted (removed)
+    one by one, adding a shortcut between each two neighbours of the node
+    whose shortest path went through it. Each node keeps its edges (and
+    shortcuts) to the nodes contracted after it, in CSR format.
+    """
+    level: np.ndarray  # int32, order in which each node was contracted
+    offsets: np.ndarray  # int64, the up edges of node i start at offsets[i]
+    targets: np.ndarray  # int32, the node each up edge goes to
+    times: np.ndarray  # float64, seconds of each up edge
+    middles: np.ndarray  # int32, node skipped by each shortcut (or -1)
+    created: float  # of the CSRGraph it was built from
+
+
+def build_hierarchy(csr: CSRGraph) -> Hierarchy:
+    """
+    Builds the contraction hierarchy of csr. The next node to contract is
+    the one that adds the fewest shortcuts minus the edges it removes
+    (weighted 4 times), plus the number of its neighbours already contracted
+    (to contract all the areas of the city evenly). Its priority is computed
+    again when it is taken, and the ones of its neighbours when it is
+    contracted. A shortcut is not needed if a short search (the witness
+    search) finds another path as fast.
+    """
+    n = len(csr)
+    offsets = csr.offsets.tolist()
+    targets = csr.targets.tolist()
+    times = csr.times.tolist()
+    adj: list[dict[int, float]] = [{} for _ in range(n)]
+    for u in range(n):
+        for e in range(offsets[u], offsets[u + 1]):
+            v, w = targets[e], times[e]
+            if v != u and w < adj[u].get(v, float('inf')):
+                adj[u][v] = adj[v][u] = w
+    middle: dict[tuple[int, int], int] = {}
+    contracted_neighbours = [0] * n
+
+    def shortcuts(v: int) -> list[tuple[int, int, float]]:
+        """Shortcuts needed to contract v."""
+        found = []
+        neighbours = list(adj[v].items())
+        for i, (u, wu) in enumerate(neighbours[:-1]):
+            rest = neighbours[i + 1:]
+            dist = _witness(adj, u, v, wu + max(w for _, w in rest),
+                            {x for x, _ in rest})
+            for x, wx in rest:
+                if dist.get(x, float('inf')) > wu + wx:
+                    found.append((u, x, wu + wx))
+        return found
+
+    def priority(v: int) -> tuple[int, list[tuple[int, int, float]]]:
+        found = shortcuts(v)
+        return (4 * (len(found) - len(adj[v])) + contracted_neighbours[v],
+                found)
+
+    current = [priority(v)[0] for v in range(n)]
+    heap = [(p, v) for v, p in enumerate(current)]
+    heapify(heap)
+    level = [-1] * n
+    up: list[list[tuple[int, float, int]]] = [[] for _ in range(n)]
+    rank = 0
+    while heap:
+        p, v = heappop(heap)
+        if level[v] != -1 or p != current[v]:  # an old entry
+            continue
+        p, found = priority(v)
+        if heap and p > heap[0][0]:  # another node is better now
+            current[v] = p
+            heappush(heap, (p, v))
+            continue
+
+        level[v] = rank
+        rank += 1
+        for u, x, w in found:
+            if w < adj[u].get(x, float('inf')):
+                adj[u][x] = adj[x][u] = w
+                middle[min(u, x), max(u, x)] = v
+        for u, w in adj[v].items():
+            del adj[u][v]
+            contracted_neighbours[u] += 1
+            up[v].append((u, w, middle.get((min(u, v), max(u, v)), -1)))
+        for u in adj[v]:  # their priorities have changed the most
+            current[u] = priority(u)[0]
+            heappush(heap, (current[u], u))
+        adj[v] = {}
+
+    up_offsets = np.zeros(n + 1, dtype=np.int64)
+    up_offsets[1:] = np.cumsum([len(edges) for edges in up])
+    edges = [e for edges in up for e in edges]
+    return Hierarchy(np.array(level, dtype=np.int32), up_offsets,
+                     np.array([v for v, _, _ in edges], dtype=np.int32),
+                     np.array([w for _, w, _ in edges], dtype=np.float64),
+                     np.array([m for _, _, m in edges], dtype=np.int32),
+                     csr.created)
+
+
+def _witness(adj: list[dict[int, float]], src: int, avoid: int,
+             limit: float, targets: set[int]) -> dict[int, float]:
+    """Distances from src without going through avoid, found by a Dijkstra
+    that stops after WITNESS_SETTLED nodes, past limit or when all the
+    targets are settled."""
+    dist = {src: 0.0}
+    heap = [(0.0, src)]
+    pending = len(targets)
+    settled = 0
+    while heap and pending and settled < WITNESS_SETTLED:
+        d, u = heappop(heap)
+        if d > dist[u]:
+            continue
+        if d > limit:
+            break
+        settled += 1
+        pending -= u in targets
+        for v, w in adj[u].items():
+            if v != avoid and d + w < dist.get(v, float('inf')):
+                dist[v] = d + w
+                heappush(heap, (d + w, v))
+    return dist
+
+
+def save_hierarchy(hierarchy: Hierarchy, dirname: str) -> None:
+    """Saves the hierarchy at the directory of its CSRGraph."""
+    for name in CH_ARRAYS:
+        np.save(os.path.join(dirname, f'ch_{name}.npy'),
+                getattr(hierarchy, name))
+    file = open(os.path.join(dirname, 'ch.json.tmp'), 'w')
+    json.dump({'version': CSR_VERSION, 'created': hierarchy.created}, file)
+    file.close()
+    os.replace(os.path.join(dirname, 'ch.json.tmp'),
+               os.path.join(dirname, 'ch.json'))
+
+
+def load_hierarchy(dirname: str) -> Hierarchy:
+    """Returns the hierarchy saved at dirname, with its arrays
+    memory-mapped. Raises ValueError if it was not built from the
+    CSRGraph saved there."""
+    file = open(os.path.join(dirname, 'ch.json'))
+    meta = json.load(file)
+    file.close()
+    file = open(os.path.join(dirname, 'meta.json'))
+    created = json.load(file)['time']
+    file.close()
+    if meta['version'] != CSR_VERSION or meta['created'] != created:
+        raise ValueError(f'the hierarchy at {dirname} is from another graph')
+
+    arrays = {name: np.load(os.path.join(dirname, f'ch_{name}.npy'),
+                            mmap_mode='r')
+              for name in CH_ARRAYS}
+    return Hierarchy(arrays['level'], arrays['offsets'], arrays['targets'],
+                     arrays['times'], arrays['middles'], created)
+
+
+@dataclass
+class CinemaTables:
+    """
+    Time from every node of a CSRGraph to each cinema, and the next node of
+    the fastest path (the tree of paths to the cinema), so finding how long
+    it takes to go to a cinema from a node is looking it up, and its path
+    is only followed when it is needed.
+    """
+    names: list[str]  # of the cinemas
+    coords: list[tuple[float, float]]  # (latitude, longitude) of each one
+    nodes: list[int]  # nearest node to each cinema
+    times: np.ndarray  # float32, seconds from node j to the cinema i: [i, j]
+    nexts: np.ndarray  # int32, next node from node j to the cinema i
+    created: float  # of the CSRGraph they were built from
+
+    @cached_property
+    def rows(self) -> dict[str, int]:
+        """Row of the arrays of each cinema."""
+        return {name: i for i, name in enumerate(self.names)}
+
+    def time(self, name: str, node: int) -> float:
+        """Seconds from the node to the cinema."""
+        return float(self.times[self.rows[name], node])
+
+    def path(self, name: str, node: int) -> list[int]:
+        """Nodes of the fastest path from the node to the cinema."""
+        row = self.rows[name]
+        if self.times[row, node] == np.inf:
+            raise nx.NetworkXNoPath(f'The cinema {name} is not reachable '
+                                    f'from the node {node}')
+        nexts = self.nexts[row]
+        path = [node]
+        while nexts[path[-1]] != -1:
+            path.append(int(nexts[path[-1]]))
+        return path
+
+
+def build_cinema_tables(router: Router,
+                        cinemas: dict[str, tuple[float, float]],
+                        old: CinemaTables | None = None) -> CinemaTables:
+    """
+    Builds the tables of the cinemas (name: (latitude, longitude)) over the
+    graph of the router. Only the cinemas that are not in the old tables
+    (or that have moved) are searched again, if the old tables were built
+    from the same graph; old is returned if nothing has changed.
+    """
+    csr = router.csr
+    names = list(cinemas)
+    coords = [tuple(cinemas[name]) for name in names]
+    nodes = [csr.index[csr.grid.snap(coord)[0]] for coord in coords]
+
+    reused: dict[str, int] = {}
+    if old is not None and old.created == csr.created:
+        reused = {name: old.rows[name] for name, coord in zip(names, coords)
+                  if name in old.rows and
+                  tuple(old.coords[old.rows[name]]) == coord}
+        if len(reused) == len(names) == len(old.names):
+            return old
+
+    times = np.empty((len(names), len(csr)), dtype=np.float32)
+    nexts = np.empty((len(names), len(csr)), dtype=np.int32)
+    for i, (name, node) in enumerate(zip(names, nodes)):
+        if name in reused:
+            times[i], nexts[i] = old.times[reused[name]], \
+                old.nexts[reused[name]]
+        else:
+            times[i], nexts[i] = router.tree(node)
+    return CinemaTables(names, coords, nodes, times, nexts, csr.created)
+
+
+def save_cinema_tables(tables: CinemaTables, dirname: str) -> None:
+    """Saves the tables at the directory of their CSRGraph. The files are
+    replaced, not overwritten, as the old ones may be memory-mapped."""
+    if os.path.exists(os.path.join(dirname, 'cinemas.json')):
+        os.remove(os.path.join(dirname, 'cinemas.json'))
+    for name in CINEMA_ARRAYS:
+        path = os.path.join(dirname, f'cinemas_{name}.npy')
+        np.save(path + '.tmp.npy', getattr(tables, name))
+        os.replace(path + '.tmp.npy', path)
+
+    meta = {'version': CSR_VERSION, 'created': tables.created,
+            'names': tables.names, 'coords': tables.coords,
+            'nodes': tables.nodes}
+    file = open(os.path.join(dirname, 'cinemas.json.tmp'), 'w')
+    json.dump(meta, file)
+    file.close()
+    os.replace(os.path.join(dirname, 'cinemas.json.tmp'),
+               os.path.join(dirname, 'cinemas.json'))
+
+
+def load_cinema_tables(dirname: str) -> CinemaTables:
+    """Returns the tables saved at dirname, with their arrays
+    memory-mapped. They may be from an older graph (see
+    build_cinema_tables)."""
+    file = open(os.path.join(dirname, 'cinemas.json'))
+    meta = json.load(file)
+    file.close()
+    if meta['version'] != CSR_VERSION:
+        raise ValueError(f"{dirname} has version {meta['version']}, "
+                         f"expected {CSR_VERSION}")
+
+    arrays = {name: np.load(os.path.join(dirname, f'cinemas_{name}.npy'),
+                            mmap_mode='r')
+              for name in CINEMA_ARRAYS}
+    return CinemaTables(meta['names'], [tuple(c) for c in meta['coords']],
+                        meta['nodes'], arrays['times'], arrays['nexts'],
+                        meta['created'])
+
+
+def _max_speed(csr: CSRGraph) -> float:
+    """Fastest speed (m/s) in straight line of any edge of csr, so that the
+    straight line time between two nodes at this speed is never more than
+    the time of the fastest path between them."""
+    sources = np.repeat(np.arange(len(csr)), np.diff(csr.offsets))
+    rad = np.radians(np.asarray(csr.coords))
+    a, b = rad[sources], rad[csr.targets]
+    h = np.sin((b[:, 1] - a[:, 1]) / 2) ** 2 + np.cos(a[:, 1]) * \
+        np.cos(b[:, 1]) * np.sin((b[:, 0] - a[:, 0]) / 2) ** 2
+    meters = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1)))
+    times = np.asarray(csr.times, dtype=np.float64)
+    if np.any((times <= 0) & (meters > 0)):
+        return float('inf')  # no guide: the potentials are all 0
+    moving = times > 0
+    speed = float(np.max(meters[moving] / times[moving])) if moving.any() \
+        else 1.0
+    return speed * (1 + 1e-9)  # against rounding errors
+
+
+def read_only(g: nx.Graph) -> nx.Graph:
+    """
+    Freezes g (nx.freeze: its nodes and edges can't be added or removed) and
+    replaces the attributes of the graph, of its nodes and of its edges by
+    read-only views (MappingProxyType), so that g[u][v]['time'] = t raises
+    TypeError. The values themselves are not copied: a list kept as an
+    attribute can still be changed. Returns g.
+    """
+    nodes, adj = g._node, g._adj
+    for u in nodes:
+        nodes[u] = MappingProxyType(nodes[u])
+    for u, v in list(g.edges):
+        # (the same dict is kept at adj[u][v] and adj[v][u])
+        adj[u][v] = adj[v][u] = MappingProxyType(adj[u][v])
+    g.graph = MappingProxyType(g.graph)
+    return nx.freeze(g)
+
+
+def is_read_only(g: nx.Graph) -> bool:
+    """Tells whether g was made read-only by read_only."""
+    return nx.is_frozen(g) and isinstance(g.graph, MappingProxyType)
+
+
+def to_csr(g: nx.Graph) -> CSRGraph:
+    """Returns the CityGraph g in CSR format (with read-only arrays)."""
+    ids = list(g.nodes)
+    index = {u: i for i, u in enumerate(ids)}
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    targets: list[int] = []
+    times: list[float] = []
+    edge_kinds: list[int] = []
+    stops: dict[int, dict[str, Any]] = {}
+    linies: dict[tuple[int, int], list[str]] = {}
+
+    for i, u in enumerate(ids):
+        if g.nodes[u]['tipus'] == 'Parada':
+            stops[i] = {'nom': g.nodes[u]['nom'],
+                        'linies': g.nodes[u]['linies']}
+        for v, attr in g.adj[u].items():
+            j = index[v]
+            targets.append(j)
+            times.append(attr['time'])
+            edge_kinds.append(EDGE_KINDS.index(attr['tipus']))
+            if attr['tipus'] == 'Bus' and i < j:
+                linies[i, j] = attr['linies']
+        offsets[i + 1] = len(targets)
+
+    coords = np.array([g.nodes[u]['pos'] for u in ids],
+                      dtype=np.float64).reshape(-1, 2)
+    kinds = np.array([KINDS.index(g.nodes[u]['tipus']) for u in ids],
+                     dtype=np.int8)
+    streets = np.flatnonzero(kinds == KINDS.index('Cruilla'))
+    grid = SpatialIndex.build([ids[i] for i in streets], streets,
+                              coords[streets])
+
+    csr = CSRGraph(ids, offsets, np.array(targets, dtype=np.int32),
+                   np.array(times, dtype=np.float32),
+                   np.array(edge_kinds, dtype=np.int8), coords, kinds,
+                   stops, linies, grid, time.time())
+    for name in ARRAYS:  # as the memory-mapped ones of load_csr
+        getattr(csr, name).flags.writeable = False
+    return csr
+
+
+def save_csr(csr: CSRGraph, dirname: str) -> None:
+    """Saves csr at the directory dirname (the arrays as .npy files and the
+    rest at meta.json)."""
+    os.makedirs(dirname, exist_ok=True)
+    # meta.json is written the last: without it the directory is not valid
+    if os.path.exists(os.path.join(dirname, 'meta.json')):
+        os.remove(os.path.join(dirname, 'meta.json'))
+    for name in ARRAYS:
+        np.save(os.path.join(dirname, name + '.npy'), getattr(csr, name))
+    for name in GRID_ARRAYS:
+        np.save(os.path.join(dirname, f'grid_{name}.npy'),
+                getattr(csr.grid, name))
+
+    meta = {
+        'version': CSR_VERSION,
+        'time': csr.created,
+        'ids': csr.ids,
+        'stops': {str(i): data for i, data in csr.stops.items()},
+        'linies': {f'{u} {v}': li for (u, v), li in csr.linies.items()},
+        'grid': {'lat0': csr.grid.lat0, 'origin': csr.grid.origin,
+                 'shape': csr.grid.shape, 'cell': csr.grid.cell},
+    }
+    file = open(os.path.join(dirname, 'meta.json.tmp'), 'w')
+    json.dump(meta, file)
+    file.close()
+    os.replace(os.path.join(dirname, 'meta.json.tmp'),
+               os.path.join(dirname, 'meta.json'))
+
+
+def load_csr(dirname: str) -> CSRGraph:
+    """Returns the CSRGraph saved at dirname, with its arrays
+    memory-mapped (read only). Raises ValueError if it was saved with
+    another version of the format."""
+    file = open(os.path.join(dirname, 'meta.json'))
+    meta = json.load(file)
+    file.close()
+    if meta['version'] != CSR_VERSION:
+        raise ValueError(f"{dirname} has version {meta['version']}, "
+                         f"expected {CSR_VERSION}")
+
+    arrays = {name: np.load(os.path.join(dirname, name + '.npy'),
+                            mmap_mode='r')
+              for name in ARRAYS}
+    stops = {int(i): data for i, data in meta['stops'].items()}
+    linies = {tuple(map(int, uv.split())): li
+              for uv, li in meta['linies'].items()}
+    grid_arrays = {name: np.load(os.path.join(dirname, f'grid_{name}.npy'),
+                                 mmap_mode='r')
+                   for name in GRID_ARRAYS}
+    points = grid_arrays['points']
+    grid = SpatialIndex(
+        [meta['ids'][i] for i in points.tolist()], points,
+        _project(arrays['coords'][points], meta['grid']['lat0']),
+        grid_arrays['order'], grid_arrays['cells'], meta['grid']['lat0'],
+        tuple(meta['grid']['origin']), tuple(meta['grid']['shape']),
+        meta['grid']['cell'])
+
+    return CSRGraph(meta['ids'], arrays['offsets'], arrays['targets'],
+                    arrays['times'], arrays['edge_kinds'], arrays['coords'],
+                    arrays['kinds'], stops, linies, grid, meta['time'])
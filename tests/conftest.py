@@ -0,0 +1,114 @@
+"""
+Shared fixtures of the tests. Run them from the root of the project with
+python -m pytest tests
+"""
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class LocalServer:
+    """HTTP server on localhost that serves the given pages ({path:
+    content}) and answers 503 to the first failures requests of each
+    path, to check the downloads without the real servers."""
+
+    def __init__(self) -> None:
+        self.pages: dict[str, bytes] = {}
+        self.failures = 0
+        self.requests: dict[str, int] = {}  # requests received by path
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                n = server.requests.get(self.path, 0)
+                server.requests[self.path] = n + 1
+                if n < server.failures:
+                    self.send_response(503)
+                    self.end_headers()
+                elif self.path in server.pages:
+                    self.send_response(200)
+                    self.end_headers()
+                    self.wfile.write(server.pages[self.path])
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+
+            def log_message(self, *args: object) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server() -> Iterator[LocalServer]:
+    s = LocalServer()
+    yield s
+    s.close()
+
+
+@pytest.fixture(scope='session')
+def small_city() -> tuple:
+    """A grid of streets of 20 x 20 crossings (about 80 m apart) with 8 bus
+    lines of 10 stops, as (streets graph, buses graph, lines), the lines as
+    the ones of buses.get_linies()."""
+    import random
+    import networkx as nx
+    rand = random.Random(1)
+    n = 20
+    streets = nx.MultiDiGraph(crs='epsg:4326')
+    for a in range(n):
+        for b in range(n):
+            x = 2.15 + b * 0.001 + rand.uniform(-2e-4, 2e-4)
+            y = 41.39 + a * 0.0008 + rand.uniform(-2e-4, 2e-4)
+            streets.add_node(a * n + b, x=x, y=y, pos=(x, y), street_count=4)
+    for a in range(n):
+        for b in range(n):
+            for u, v in ((a * n + b, a * n + b + 1),
+                         (a * n + b, (a + 1) * n + b)):
+                if v < n * n and (v != a * n + b + 1 or b + 1 < n):
+                    length = rand.uniform(70, 110)
+                    streets.add_edge(u, v, length=length, name='carrer')
+                    streets.add_edge(v, u, length=length, name='carrer')
+
+    stops = {}
+    for code in range(100, 140):
+        u = rand.randrange(n * n)
+        stops[code] = (streets.nodes[u]['y'] + 1e-4,
+                       streets.nodes[u]['x'] + 1e-4)
+    lines = {f'L{i}': sorted(rand.sample(list(stops), 10),
+                             key=lambda s: stops[s][i % 2])
+             for i in range(8)}
+    stop_lines = {s: [li for li, seq in lines.items() if s in seq]
+                  for s in stops}
+
+    buses = nx.Graph()
+    linies = []
+    for line, seq in lines.items():
+        parades = []
+        for s in seq:
+            buses.add_node(s, tipus='Parada', nom=f'Parada {s}',
+                           pos=(stops[s][1], stops[s][0]),
+                           linies=stop_lines[s])
+            parades.append({'CodAMB': s, 'Nom': f'Parada {s}',
+                            'UTM_X': stops[s][0], 'UTM_Y': stops[s][1],
+                            'Linies': ' - '.join(stop_lines[s]),
+                            'Municipi': 'Barcelona'})
+        for s, t in zip(seq, seq[1:]):
+            buses.add_edge(s, t, tipus='Bus', color='blue', linies=[
+                li for li in stop_lines[s] if li in stop_lines[t]])
+        linies.append({'Nom': line, 'Parades': {'Parada': parades}})
+    return streets, buses, linies
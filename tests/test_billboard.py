@@ -0,0 +1,452 @@
+import os
+import random
+import pytest
+from typing import Callable, Iterator
+import billboard
+
+
+def test_fetch_pages_retries(server):
+    server.pages = {'/1': b'one', '/2': b'two'}
+    server.failures = 1  # the first request of each page fails
+    urls = [server.url + '/1', server.url + '/2']
+
+    for concurrent in (True, False):
+        server.requests.clear()
+        pages = billboard._fetch_pages(urls, concurrent, 5, 1)
+        assert list(pages) == [b'one', b'two']
+        assert server.requests == {'/1': 2, '/2': 2}
+
+
+def test_read_reports_failed_pages(server, capsys):
+    server.pages = {'/1': b'<html><body></body></html>'}
+    missing = server.url + '/2'
+
+    bboard = billboard.read([server.url + '/1', missing], retries=0)
+    assert bboard.projections == []
+    assert missing in capsys.readouterr().out
+
+
+def _small_billboard() -> billboard.Billboard:
+    film = billboard.Film('Film', ['Drama'], 'Director', ['Actor'])
+    cinema = billboard.Cinema('Cinema', 'Carrer 1, Barcelona', (41.4, 2.17))
+    projection = billboard._projection_at(film, cinema, 1200, 1320, 'V.O.')
+    bboard = billboard.Billboard([film], [cinema], [projection], {'Drama'})
+    bboard.build_indexes()
+    return bboard
+
+
+def test_snapshot_max_age(server, tmp_path, monkeypatch):
+    server.pages = {'/1': b'<html><body></body></html>'}
+    urls = [server.url + '/1']
+    snapshot = str(tmp_path / 'billboard.snapshot')
+    now = billboard.time.time()
+
+    monkeypatch.setattr(billboard.time, 'time', lambda: now - 3600)
+    billboard.save_snapshot(_small_billboard(), snapshot)
+    monkeypatch.setattr(billboard.time, 'time', lambda: now)
+
+    # fresh enough: read from the snapshot, without downloading
+    bboard = billboard.read(urls, snapshot=snapshot, ttl=7200)
+    assert len(bboard.projections) == 1 and server.requests == {}
+
+    # too old: downloaded now (the page has no projections) and saved
+    bboard = billboard.read(urls, snapshot=snapshot, ttl=60, max_age=600)
+    assert bboard.projections == [] and server.requests == {'/1': 1}
+    assert billboard.load_snapshot(snapshot)[0].projections == []
+
+
+def test_snapshot_too_old_and_download_fails(server, tmp_path, capsys):
+    snapshot = str(tmp_path / 'billboard.snapshot')
+    billboard.save_snapshot(_small_billboard(), snapshot)
+
+    bboard = billboard.read([server.url + '/missing'], retries=0,
+                            snapshot=snapshot, ttl=-1, max_age=-1)
+    assert len(bboard.projections) == 1
+    assert 'old billboard snapshot' in capsys.readouterr().out
+
+
+def test_failed_refresh_keeps_the_snapshot(tmp_path, monkeypatch, capsys):
+    snapshot = str(tmp_path / 'billboard.snapshot')
+    billboard.save_snapshot(_small_billboard(), snapshot)
+    created = billboard.load_snapshot(snapshot)[1]
+
+    def broken_scrape(*args):
+        raise RuntimeError('broken page')
+    monkeypatch.setattr(billboard, '_scrape', broken_scrape)
+    # no exception escapes the background thread
+    billboard._refresh_snapshot(snapshot, [], False, 1, 0, 'bs4', 1)
+    assert 'broken page' in capsys.readouterr().out
+    loaded, loaded_created = billboard.load_snapshot(snapshot)
+    assert len(loaded.projections) == 1
+    assert loaded_created == created
+
+
+def test_concurrent_snapshot_saves(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    snapshot = str(tmp_path / 'billboard.snapshot')
+    bboard = _small_billboard()
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda _: billboard.save_snapshot(bboard, snapshot),
+                      range(20)))
+    assert len(billboard.load_snapshot(snapshot)[0].projections) == 1
+    assert [p.name for p in tmp_path.iterdir()] == ['billboard.snapshot']
+
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures',
+                       'billboard_page.html')
+
+
+def _batches(parser: str, days: int) -> list[tuple]:
+    file = open(FIXTURE, 'rb')
+    content = file.read()
+    file.close()
+    return [(b.cinema, b.day,
+             [(f, [(p.start_min, p.end_min, p.language, p.day)
+                   for p in projections]) for f, projections in b.films])
+            for b in billboard.PARSERS[parser](content, days)]
+
+
+def test_parsers_give_the_same_projections():
+    for days in (1, 2):
+        batches = _batches('bs4', days)
+        assert batches == _batches('lxml', days)
+        assert len(batches) == 3 * days
+
+    glories = _batches('lxml', 2)[0]
+    assert glories[0].name == 'Glòries Multicines'
+    assert glories[0].address == 'Av. Diagonal, 208, 08018 Barcelona'
+    film, sessions = glories[2][0]
+    assert film.title == 'La sociedad de la nieve'
+    assert film.actors == ['Enzo Vogrincic', 'Agustín Pardella']
+    # the second session ends after midnight
+    assert sessions == [(960, 1119, 'V.O.', 0), (1360, 1519, 'V.O.', 0)]
+    # a cinema without sessions some day still has a (empty) batch
+    zumzeig = _batches('lxml', 2)[4:]
+    assert [(day, films) for _, day, films in zumzeig][0] == (0, [])
+
+
+def test_read_with_both_parsers(server):
+    file = open(FIXTURE, 'rb')
+    server.pages = {'/1': file.read()}
+    file.close()
+
+    read = [billboard.read([server.url + '/1'], parser=parser, days=2)
+            for parser in billboard.PARSERS]
+    for bboard in read:
+        assert [c.name for c in bboard.cinemas] == [
+            'Cines Verdi Barcelona', 'Glòries Multicines', 'Zumzeig Cinema']
+        assert len(bboard.films) == 3 and len(bboard.projections) == 8
+    assert [(p.film.title, p.cinema.name, p.start_min, p.day)
+            for p in read[0].projections] == \
+        [(p.film.title, p.cinema.name, p.start_min, p.day)
+         for p in read[1].projections]
+
+
+def test_interval_index_against_a_linear_scan():
+    random.seed(9)
+    DAY = billboard.DAY
+    intervals = []
+    for _ in range(300):
+        start = random.randrange(DAY)
+        intervals.append((start, start + random.randrange(60, 240)))
+    intervals += [(1400, 1500), (1300, 1450)]  # 23:20-01:00, 21:40-00:10
+    index = billboard.IntervalIndex(intervals)
+
+    for _ in range(300):
+        start, end = random.randrange(DAY), random.randrange(DAY)
+        window_end = end + DAY if end < start else end
+        within = [i for i, (s, e) in enumerate(intervals)
+                  if start <= s and e <= window_end or
+                  window_end > DAY and e <= window_end - DAY]
+        overlapping = [i for i, (s, e) in enumerate(intervals)
+                       if any(s + d <= window_end and e + d >= start
+                              for d in (-DAY, 0, DAY))]
+        assert index.within(start, end) == within
+        assert index.overlapping(start, end) == overlapping
+
+    # a session from before midnight still going on after it
+    assert len(intervals) - 2 in index.overlapping(30, 120)
+
+
+def test_filters_do_not_mix_days():
+    file = open(FIXTURE, 'rb')
+    content = file.read()
+    file.close()
+    bboard = billboard.Billboard([], [], [], set())
+    for batch in billboard.PARSERS['lxml'](content, 2):
+        bboard.add(batch)
+    bboard.build_indexes()
+    table = billboard.ProjectionTable(bboard)
+    assert {p.day for p in bboard.projections} == {0, 1}
+
+    key = lambda p: (p.film.title, p.cinema.name, p.start_min, p.day)
+    for filters in ({}, {'time': '16:00-02:00'}, {'language': 'V.O.'},
+                    {'day': '1'}, {'day': '1', 'time': '16:00-02:00'},
+                    {'day': '2'}):
+        plan = bboard.compile_filter(filters)
+        expected = [key(p) for p in bboard.projections
+                    if p.day == int(filters.get('day', 0)) and
+                    bboard.matches(p, plan)]
+        assert [key(p) for p in bboard.filter(plan)] == expected
+        assert [key(p) for p in table.filter(plan)] == expected
+        assert all(p.day == plan.day for p in bboard.filter(plan))
+    assert bboard.filter({'day': '1'}) != [] and \
+        bboard.filter({'day': '2'}) == []
+
+
+GENRES = ['Drama', 'Comèdia', 'Thriller', 'Animació']
+
+
+def _random_billboard(seed: int) -> billboard.Billboard:
+    '''A billboard of two days with 12 films of one to three genres, 4
+    directors and 6 cinemas in two cities.'''
+    rand = random.Random(seed)
+    films = [billboard.Film(f'Film {i}',
+                            rand.sample(GENRES, rand.randint(1, 3)),
+                            f'Director {i % 4}', []) for i in range(12)]
+    cinemas = [billboard.Cinema(f'Cinema {i}', f'Carrer {i}, {city}',
+                                (41.4, 2.17))
+               for i, city in enumerate(['Barcelona'] * 4 +
+                                        ["L'Hospitalet de Llobregat"] * 2)]
+    projections = []
+    for _ in range(400):
+        start = rand.randrange(billboard.DAY)
+        end = (start + rand.randrange(80, 200)) % billboard.DAY
+        projections.append(billboard._projection_at(
+            rand.choice(films), rand.choice(cinemas), start, end,
+            rand.choice(billboard.LANGUAGES), rand.randrange(2)))
+    bboard = billboard.Billboard(films, cinemas, projections, set(GENRES))
+    bboard.build_indexes()
+    return bboard
+
+
+def _scan(bboard: billboard.Billboard,
+          filters: dict[str, str]) -> list[billboard.Projection]:
+    '''The projections that pass the filters (but time), one by one.'''
+    day = int(filters.get('day', 0))
+    genres = set(filters['genre'].split('-')) if 'genre' in filters \
+        else set()
+    return [p for p in bboard.projections
+            if p.day == day and genres <= set(p.film.genres) and
+            p.film.title == filters.get('film', p.film.title) and
+            p.film.director == filters.get('director', p.film.director) and
+            p.cinema.name == filters.get('cinema', p.cinema.name) and
+            filters.get('city', '') in p.cinema.address and
+            p.duration <= int(filters.get('duration', p.duration)) and
+            p.language == filters.get('language', p.language)]
+
+
+SCAN_FILTERS = [
+    {}, {'genre': 'Drama'}, {'genre': 'Drama-Comèdia'},
+    {'genre': 'Thriller-Animació'}, {'genre': 'Western'},
+    {'director': 'Director 1'}, {'director': 'Nobody'},
+    {'film': 'Film 3'}, {'film': 'Film 3', 'day': '1'},
+    {'cinema': 'Cinema 2'}, {'cinema': 'Cinema 5', 'language': 'V.O.'},
+    {'city': 'Hospitalet'}, {'city': 'Barcelona'}, {'city': 'Girona'},
+    {'duration': '120'}, {'duration': '79'},
+    {'genre': 'Drama', 'city': 'Barcelona', 'duration': '150'},
+    {'director': 'Director 2', 'cinema': 'Cinema 0', 'day': '1'},
+]
+
+
+def test_filters_against_a_scan():
+    bboard = _random_billboard(3)
+    for filters in SCAN_FILTERS:
+        expected = _scan(bboard, filters)
+        assert bboard.filter(filters) == expected, filters
+    # (the films of several genres are found, not only the empty results)
+    assert _scan(bboard, {'genre': 'Drama-Comèdia'}) != []
+
+
+def _search_billboard() -> billboard.Billboard:
+    films = [billboard.Film(title, ['Drama'], director, [])
+             for title, director in (
+                 ('La sociedad de la nieve', 'J.A. Bayona'),
+                 ('Oppenheimer', 'Christopher Nolan'),
+                 ('Perfect Days', 'Wim Wenders'),
+                 ('Pobres criaturas', 'Yorgos Lanthimos'),
+                 ('Anatomía de una caída', 'Justine Triet'))]
+    cinemas = [billboard.Cinema(name, 'Barcelona', (41.4, 2.17))
+               for name in ('Cines Verdi Barcelona', 'Glòries Multicines',
+                            'Zumzeig Cinema', 'Cinesa Diagonal')]
+    bboard = billboard.Billboard(films, cinemas, [], {'Drama'})
+    bboard.build_indexes()
+    return bboard
+
+
+def test_search_ranking():
+    bboard = _search_billboard()
+    results = bboard.search('cinesa diagonal')
+    assert results[0].name == 'Cinesa Diagonal' and results[0].score == 1
+    assert [r.score for r in results] == \
+        sorted((r.score for r in results), reverse=True)
+
+    # the names that contain the query before the ones that look like it
+    assert [r.name for r in bboard.search('cines')] == [
+        'Cinesa Diagonal', 'Cines Verdi Barcelona', 'Glòries Multicines']
+    assert [(r.kind, r.name) for r in bboard.search('cines', limit=1)] == \
+        [('cinema', 'Cinesa Diagonal')]
+    assert [r.name for r in bboard.search('la', kind='director')] == \
+        ['Yorgos Lanthimos']
+
+
+def test_search_ignores_case_accents_and_punctuation():
+    bboard = _search_billboard()
+    for query, name in (('GLORIES multicines', 'Glòries Multicines'),
+                        ('anatomia de una caida', 'Anatomía de una caída'),
+                        ('j. a. BAYONA', 'J.A. Bayona'),
+                        ('  perfect   days!', 'Perfect Days')):
+        result = bboard.search(query)[0]
+        assert (result.name, result.score) == (name, 1.0), query
+
+
+def test_search_with_typos():
+    bboard = _search_billboard()
+    for query, name in (('Openheimer', 'Oppenheimer'),
+                        ('Wim Wendres', 'Wim Wenders'),
+                        ('zumzeg cinemas', 'Zumzeig Cinema'),
+                        ('sociedad de la nieves', 'La sociedad de la nieve')):
+        result = bboard.search(query)[0]
+        assert result.name == name and result.score < 1, query
+
+
+def test_search_without_results():
+    bboard = _search_billboard()
+    for query in ('', '   ', '!!!', 'xyzzy', 'Kurosawa'):
+        assert bboard.search(query) == [], query
+    assert bboard.search('Oppenheimer', kind='cinema') == []
+
+
+def test_compile_filter_rejects_bad_filters():
+    bboard = _random_billboard(4)
+    for filters in ({'actor': 'Someone'}, {'genre': 'Drama', 'colour': 'x'},
+                    {'time': '16:00'}, {'time': '16-18'},
+                    {'time': '25:00-26:00'}, {'time': '16:60-18:00'},
+                    {'time': 'a:b-c:d'}, {'time': '16:00-18:00-20:00'},
+                    {'duration': 'two hours'}, {'duration': '1.5'},
+                    {'duration': ''}, {'language': 'Klingon'},
+                    {'day': '-1'}, {'day': 'tomorrow'}):
+        with pytest.raises(ValueError):
+            bboard.compile_filter(filters)
+        with pytest.raises(ValueError):
+            bboard.filter(filters)
+
+
+def test_compiled_filter_reused():
+    bboard = _random_billboard(4)
+    filters = {'genre': 'Drama', 'time': '20:00-01:30', 'duration': '150'}
+    plan = bboard.compile_filter(filters)
+    assert plan.time == (1200, 1530) and plan.duration == 150
+    assert plan.genres == frozenset({'Drama'})
+
+    first = bboard.filter(plan)
+    assert first == bboard.filter(plan) == bboard.filter(filters) != []
+    assert bboard.compile_filter(filters) == plan  # not changed by filter
+
+    # the same plan with another billboard
+    other = _random_billboard(5)
+    assert other.filter(plan) == other.filter(filters) != first
+    table = billboard.ProjectionTable(other)
+    assert table.filter(plan) == other.filter(plan)
+
+
+def test_slotted_types():
+    bboard = _random_billboard(6)
+    for x in (bboard.films[0], bboard.cinemas[0], bboard.projections[0]):
+        assert not hasattr(x, '__dict__')
+        with pytest.raises(AttributeError):
+            x.notes = 'not a field'
+    p = bboard.projections[0]
+    assert type(p).__slots__ == ('film', 'cinema', 'start_min', 'end_min',
+                                 'language', 'day')
+    assert p.start == divmod(p.start_min, 60)
+    assert p.duration == p.end_min - p.start_min
+
+
+def test_projection_old_form():
+    film = billboard.Film('Film', ['Drama'], 'Director', [])
+    cinema = billboard.Cinema('Cinema', 'Carrer 1, Barcelona', (41.4, 2.17))
+    old = billboard.Projection(film, cinema, (23, 30), (1, 10), 100, 'V.O.')
+    assert old == billboard._projection_at(film, cinema, 1410, 70, 'V.O.')
+    assert (old.start, old.end, old.duration) == ((23, 30), (1, 10), 100)
+    with pytest.raises(TypeError):
+        billboard.Projection(film, cinema, (23, 30), (1, 10), 'V.O.')
+
+
+def test_snapshot_round_trip(tmp_path):
+    bboard = _random_billboard(6)
+    snapshot = str(tmp_path / 'billboard.snapshot')
+    billboard.save_snapshot(bboard, snapshot)
+    loaded, created = billboard.load_snapshot(snapshot)
+    assert abs(created - billboard.time.time()) < 60
+    assert loaded.films == bboard.films and loaded.cinemas == bboard.cinemas
+    assert loaded.projections == bboard.projections
+    assert loaded.genres == bboard.genres
+    # the projections share the films and cinemas of the billboard
+    films = {id(f) for f in loaded.films}
+    cinemas = {id(c) for c in loaded.cinemas}
+    assert all(id(p.film) in films and id(p.cinema) in cinemas
+               for p in loaded.projections)
+    assert loaded.filter({'genre': 'Drama', 'day': '1'}) == \
+        bboard.filter({'genre': 'Drama', 'day': '1'})
+
+
+def test_parsed_strings_are_shared():
+    file = open(FIXTURE, 'rb')
+    content = file.read()
+    file.close()
+    for parser in billboard.PARSERS:
+        bboard = billboard.Billboard([], [], [], set())
+        for batch in billboard.PARSERS[parser](content, 2):
+            bboard.add(batch)
+
+        strings: dict[str, set[int]] = {}
+        for p in bboard.projections:
+            for s in (p.film.title, p.film.director, *p.film.genres,
+                      *p.film.actors, p.cinema.name, p.cinema.address,
+                      p.language):
+                strings.setdefault(s, set()).add(id(s))
+        assert all(len(ids) == 1 for ids in strings.values()), parser
+        assert {p.language for p in bboard.projections} <= \
+            set(billboard.LANGUAGES)
+        assert all(any(p.language is lang for lang in billboard.LANGUAGES)
+                   for p in bboard.projections)
+        # (a genre of several films, so there was something to share)
+        assert any(sum(g in f.genres for f in bboard.films) > 1
+                   for g in bboard.genres)
+
+
+def test_projection_table_against_the_objects():
+    bboard = _random_billboard(7)
+    table = billboard.ProjectionTable(bboard)
+    for filters in SCAN_FILTERS + [
+            {'time': '16:00-20:00'}, {'time': '22:00-02:00'},
+            {'time': '20:00-01:00', 'genre': 'Thriller', 'day': '1'},
+            {'language': 'Spanish', 'duration': '140', 'city': 'Barcelona'},
+            {'film': 'Film 5', 'director': 'Director 1'},
+            {'film': 'Film 5', 'director': 'Director 2'}]:
+        plan = bboard.compile_filter(filters)
+        expected = bboard.filter(plan)
+        assert table.filter(plan) == expected, filters
+    assert table.filter(bboard.compile_filter({'day': '1'})) != []
+
+
+def test_parse_errors_keep_their_cause(server, monkeypatch):
+    server.pages = {'/1': b'<html></html>'}
+    urls = [server.url + '/1']
+
+    def failing(error: Exception) -> Callable:
+        def parse(content: bytes, days: int) -> Iterator:
+            raise error
+            yield
+        return parse
+
+    for error, lxml in ((ImportError("No module named 'lxml'"), True),
+                        (billboard.FeatureNotFound('lxml'), True),
+                        (KeyError('data-movie'), False),
+                        (IndexError('list index out of range'), False)):
+        monkeypatch.setitem(billboard.PARSERS, 'bs4', failing(error))
+        with pytest.raises(ValueError) as info:
+            list(billboard.read_stream(urls=urls, retries=0))
+        assert info.value.__cause__ is error
+        assert ("'lxml' is installed" in str(info.value)) == lxml
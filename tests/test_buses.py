@@ -0,0 +1,106 @@
+import pytest
+import buses
+
+
+def test_old_copy_used_when_the_download_fails(server, tmp_path,
+                                               monkeypatch, capsys):
+    monkeypatch.setattr(buses, 'URL', server.url + '/amb.json')
+    filename = str(tmp_path / 'amb.json')
+    server.pages = {'/amb.json': b'{"a": 1}'}
+    assert buses.get_json_file(filename) == filename
+
+    # too old, and the server is down: the complete old copy is kept
+    server.pages = {}
+    assert buses.get_json_file(filename, max_age=-1) == filename
+    file = open(filename, 'rb')
+    assert file.read() == b'{"a": 1}'
+    file.close()
+    assert 'Using the old copy' in capsys.readouterr().out
+
+    # an incomplete copy is not used
+    file = open(filename, 'ab')
+    file.write(b' ')
+    file.close()
+    with pytest.raises(SystemExit):
+        buses.get_json_file(filename, max_age=-1)
+
+
+def _per_stop_graph(linies: list) -> buses.BusesGraph:
+    '''The buses graph built as get_buses_graph did, one stop and one edge
+    at a time.'''
+    g = buses.BusesGraph()
+    for linia in linies:
+        anterior = None
+        for parada in linia['Parades']['Parada']:
+            if parada['Municipi'] != 'Barcelona':
+                anterior = None
+                continue
+            node = parada['CodAMB']
+            g.add_node(node, tipus='Parada', nom=parada['Nom'],
+                       pos=(parada['UTM_Y'], parada['UTM_X']),
+                       linies=parada['Linies'].split(sep=' - '))
+            if anterior is not None and anterior != node:
+                comunes = [li for li in g.nodes[anterior]['linies']
+                           if li in g.nodes[node]['linies']]
+                g.add_edge(anterior, node, tipus='Bus', linies=comunes,
+                           color='blue')
+            anterior = node
+    return g
+
+
+def _edges(g: buses.BusesGraph) -> dict:
+    return {frozenset((u, v)): data for u, v, data in g.edges(data=True)}
+
+
+def test_bulk_graph_as_the_per_stop_one(small_city, monkeypatch):
+    linies = [dict(linia) for linia in small_city[2]]
+    # a stop out of Barcelona in the middle of a line, and a repeated one
+    parades = list(linies[0]['Parades']['Parada'])
+    parades.insert(4, dict(parades[4], CodAMB=999, Municipi='Badalona'))
+    parades.insert(2, parades[1])
+    linies[0] = dict(linies[0], Parades={'Parada': parades})
+    monkeypatch.setattr(buses, 'get_linies', lambda: linies)
+
+    g = buses.get_buses_graph()
+    expected = _per_stop_graph(linies)
+    assert dict(g.nodes(data=True)) == dict(expected.nodes(data=True))
+    assert _edges(g) == _edges(expected)
+    assert 999 not in g
+
+
+def test_save_and_load_buses_graph(small_city, tmp_path, monkeypatch):
+    g = small_city[1]
+    filename = str(tmp_path / 'buses.pickle')
+    buses.save_buses_graph(g, filename)
+    loaded = buses.load_buses_graph(filename)
+    assert dict(loaded.nodes(data=True)) == dict(g.nodes(data=True))
+    assert _edges(loaded) == _edges(g)
+    assert 0 <= buses.buses_graph_age(filename) < 60
+
+    # too old
+    now = buses.time.time()
+    monkeypatch.setattr(buses.time, 'time', lambda: now + 3600)
+    assert buses.buses_graph_age(filename) >= 3600
+    with pytest.raises(ValueError):
+        buses.load_buses_graph(filename, max_age=600)
+    assert buses.load_buses_graph(filename, max_age=7200) is not None
+
+    # a file cut in the middle of the graph, or that is not a graph
+    file = open(filename, 'rb')
+    content = file.read()
+    file.close()
+    for corrupt in (content[:len(content) // 2], b'not a pickle', b''):
+        file = open(filename, 'wb')
+        file.write(corrupt)
+        file.close()
+        with pytest.raises(ValueError):
+            buses.load_buses_graph(filename)
+    with pytest.raises(ValueError):
+        buses.buses_graph_age(filename)
+
+    # saved with another version of the format
+    file = open(filename, 'wb')
+    buses.pickle.dump({'version': 1, 'time': now, 'graph': g}, file)
+    file.close()
+    with pytest.raises(ValueError):
+        buses.load_buses_graph(filename)
@@ -0,0 +1,171 @@
+import random
+import networkx as nx
+import pytest
+import city
+import routing
+
+
+def test_street_index_built_once_per_graph(small_city):
+    streets = nx.MultiDiGraph(small_city[0])
+    index = city.street_index(streets)
+    assert city.street_index(streets) is index
+    assert city.street_index(nx.MultiDiGraph(streets)) is not index
+
+    streets.add_node(-1, x=2.2, y=41.4)  # a changed graph is indexed again
+    assert city.street_index(streets).snap((41.4, 2.2)) == (-1, 0.0)
+
+
+def test_cinema_times_and_paths(small_city):
+    streets, buses, _ = small_city
+    streets = nx.MultiDiGraph(streets)
+    # two crossings apart from the rest of the streets
+    streets.add_node(-1, x=2.3, y=41.45, pos=(2.3, 41.45))
+    streets.add_node(-2, x=2.301, y=41.45, pos=(2.301, 41.45))
+    streets.add_edge(-1, -2, length=80.0)
+    streets.add_edge(-2, -1, length=80.0)
+    g = city.build_city_graph(streets, buses)
+    router = routing.Router(routing.to_csr(g))
+    cinemas = {'A': (41.392, 2.152), 'B': (41.401, 2.165),
+               'Lluny': (41.45, 2.3)}
+    tables = routing.build_cinema_tables(router, cinemas)
+
+    src = (41.395, 2.158)
+    minutes = city.cinema_times(router, tables, src)
+    assert set(minutes) == {'A', 'B'}  # Lluny can't be reached
+    assert city.cinema_times(router, tables, src, ['B', 'C']).keys() == {'B'}
+
+    src_node = router.csr.grid.snap(src)[0]
+    for name in ('A', 'B'):
+        path = city.find_cinema_path(None, None, src, name, router, tables)
+        dst_node = router.csr.grid.snap(cinemas[name])[0]
+        time = nx.shortest_path_length(g, src_node, dst_node, weight='time')
+        assert path.time == minutes[name] == int(time) // 60
+        nodes = [path.source] + path.path + [path.dest]
+        assert nodes[-1] == dst_node
+        assert all(g.has_edge(u, v) for u, v in zip(nodes, nodes[1:]))
+    with pytest.raises(nx.NetworkXNoPath):
+        city.find_cinema_path(None, None, src, 'Lluny', router, tables)
+
+
+def test_route_cache_shared_by_threads():
+    import threading
+    cache = city.RouteCache(max_entries=50)
+
+    def use(seed: int) -> None:
+        for i in range(2000):
+            cache.put(seed, i % 80, 'v', list(range(i % 30)), float(i))
+            cache.get(seed, (i * 7) % 80, 'v')
+            if i % 97 == 0:
+                cache.clear()
+
+    threads = [threading.Thread(target=use, args=(k,)) for k in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(cache) <= 50
+    assert cache.bytes == sum(city._path_bytes(path)
+                              for path, _ in cache.paths.values())
+
+
+def test_street_lengths_against_networkx(small_city):
+    streets = small_city[0]
+    rand = random.Random(8)
+    nodes = list(streets.nodes)
+    pairs = [(rand.choice(nodes), rand.choice(nodes)) for _ in range(60)]
+    pairs += [(pairs[0][0], v) for v in rand.sample(nodes, 10)]
+    for processes in (0, 2):
+        lengths = city.street_lengths(streets, pairs, processes)
+        for i, j in pairs:
+            assert lengths[i, j] == pytest.approx(nx.shortest_path_length(
+                streets, i, j, weight='length'))
+
+
+def test_city_graphs_are_read_only(small_city):
+    streets, buses, _ = small_city
+    g = city.build_city_graph(streets, buses)
+    for graph in (g, routing.to_csr(g).to_city_graph()):
+        assert routing.is_read_only(graph)
+        u, v = next(iter(graph.edges))
+        with pytest.raises(TypeError):
+            graph[u][v]['time'] = 0.0
+        with pytest.raises(TypeError):
+            graph.nodes[u]['color'] = 'red'
+        with pytest.raises(nx.NetworkXError):
+            graph.add_edge(u, -1, time=0.0)
+
+        # a copy can be changed, and leaves the graph as it was
+        copy = nx.Graph(graph)
+        time = graph[u][v]['time']
+        copy[u][v]['time'] = time + 1
+        assert graph[u][v]['time'] == time and not routing.is_read_only(copy)
+
+
+def test_route_cache_eviction():
+    cache = city.RouteCache(max_entries=3)
+    for i in range(3):
+        cache.put(0, i, 'v', [0, i], float(i))
+    assert cache.get(0, 0, 'v') == ([0, 0], 0.0)  # now the most recent
+    cache.put(0, 3, 'v', [0, 3], 3.0)
+    assert len(cache) == 3 and cache.get(0, 1, 'v') is None
+    assert cache.get(0, 0, 'v') is not None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # by the memory of the paths: the biggest one fits alone
+    path = list(range(1000, 2000))
+    cache = city.RouteCache(max_bytes=city._path_bytes(path))
+    cache.put(0, 1, 'v', [0, 1], 1.0)
+    cache.put(0, 2, 'v', path, 2.0)
+    assert list(cache.paths) == [(0, 2)]
+    assert cache.bytes == city._path_bytes(path)
+    cache.put(0, 2, 'v', [0, 2], 2.0)  # replaced
+    assert cache.bytes == city._path_bytes([0, 2])
+
+
+def test_route_cache_versions(small_city):
+    streets, buses, _ = small_city
+    g = city.build_city_graph(streets, buses)
+    router = routing.Router(routing.to_csr(g))
+    version = city.graph_version(g, router)
+    assert version == city.graph_version(g, router) == \
+        routing.to_csr(g).version
+    assert city.graph_version(g) == city.graph_version(g)
+    assert city._versions[g] == city.graph_version(g)  # read-only: kept
+
+    # a graph that can be changed is hashed again after each change
+    other = nx.Graph(g)
+    assert city.graph_version(other) == city.graph_version(g)
+    u, v = next(iter(other.edges))
+    other[u][v]['time'] += 1
+    assert city.graph_version(other) != city.graph_version(g)
+    assert routing.to_csr(other).version != version
+    other[u][v]['time'] -= 1
+    assert city.graph_version(other) == city.graph_version(g)
+    other.remove_edge(u, v)  # the same times, without an edge
+    other.add_edge(u, v, **g[u][v])
+    other.add_edge(u, -1, time=g[u][v]['time'])
+    assert city.graph_version(other) != city.graph_version(g)
+    assert other not in city._versions
+
+
+def test_cached_routes_follow_the_times(small_city):
+    streets, buses, _ = small_city
+    g = city.build_city_graph(streets, buses)
+    cache = city.RouteCache()
+    src, dst = (41.392, 2.152), (41.401, 2.165)
+    router = routing.Router(routing.to_csr(g))
+    first = city.find_path(None, None, src, dst, router, cache=cache)
+    again = city.find_path(None, None, src, dst, router, cache=cache)
+    assert again.path == first.path and (cache.hits, cache.misses) == (1, 1)
+
+    # the same graph with an edge of the path much slower
+    slower = nx.Graph(g)
+    nodes = [first.source, *first.path, first.dest]
+    u, v = nodes[len(nodes) // 2 - 1:len(nodes) // 2 + 1]
+    slower[u][v]['time'] += 3600
+    other = routing.Router(routing.to_csr(slower))
+    second = city.find_path(None, None, src, dst, other, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 2) and len(cache) == 1
+    assert cache.version == other.csr.version
+    assert second.path != first.path
+    assert second.path == city.find_path(None, None, src, dst, other).path
@@ -0,0 +1,86 @@
+import random
+import networkx as nx
+import numpy as np
+import pytest
+import city
+import routing
+
+
+@pytest.fixture(scope='module')
+def city_graph(small_city) -> nx.Graph:
+    streets, buses, _ = small_city
+    return city.build_city_graph(streets, buses)
+
+
+@pytest.fixture(scope='module')
+def router(city_graph, tmp_path_factory) -> routing.Router:
+    # (saved and loaded, as the demo uses them)
+    dirname = str(tmp_path_factory.mktemp('csr'))
+    routing.save_csr(routing.to_csr(city_graph), dirname)
+    csr = routing.load_csr(dirname)
+    routing.save_hierarchy(routing.build_hierarchy(csr), dirname)
+    return routing.Router(csr, routing.load_hierarchy(dirname))
+
+
+def _check_path(g: nx.Graph, nodes: list, time: float) -> None:
+    assert all(g.has_edge(u, v) for u, v in zip(nodes, nodes[1:]))
+    assert nx.path_weight(g, nodes, 'time') == pytest.approx(time, rel=1e-5)
+
+
+def test_methods_against_networkx(city_graph, router):
+    csr = router.csr
+    rand = random.Random(5)
+    for _ in range(40):
+        u, v = rand.randrange(len(csr)), rand.randrange(len(csr))
+        expected = nx.shortest_path_length(city_graph, csr.ids[u],
+                                           csr.ids[v], weight='time')
+        for method in routing.METHODS:
+            nodes, time = router.shortest_path(u, v, method)
+            assert time == pytest.approx(expected, rel=1e-5), method
+            assert nodes[0] == u and nodes[-1] == v
+            _check_path(city_graph, [csr.ids[i] for i in nodes], time)
+
+
+def test_spatial_index_against_a_linear_scan(router):
+    grid = router.csr.grid
+    rand = random.Random(7)
+    for _ in range(300):
+        coord = (41.385 + rand.random() * 0.025,
+                 2.145 + rand.random() * 0.03)  # also outside the grid
+        node, dist = grid.snap(coord)
+        point = routing._project(np.array([coord[::-1]]), grid.lat0)
+        dists = np.hypot(*(grid.xy - point).T)
+        assert dist == pytest.approx(dists.min())
+        assert dists[grid.ids.index(node)] == pytest.approx(dists.min())
+
+
+def test_one_to_many_against_networkx(city_graph, router):
+    csr = router.csr
+    rand = random.Random(6)
+    src = rand.randrange(len(csr))
+    expected = nx.single_source_dijkstra_path_length(
+        city_graph, csr.ids[src], weight='time')
+
+    dsts = rand.sample(range(len(csr)), 25)
+    for v, (nodes, time) in zip(dsts, router.shortest_paths(src, dsts)):
+        assert time == pytest.approx(expected[csr.ids[v]], rel=1e-5)
+        assert nodes[0] == src and nodes[-1] == v
+        _check_path(city_graph, [csr.ids[i] for i in nodes], time)
+
+
+def test_trees_against_networkx(city_graph, router):
+    csr = router.csr
+    rand = random.Random(6)
+    src = rand.randrange(len(csr))
+    expected = nx.single_source_dijkstra_path_length(
+        city_graph, csr.ids[src], weight='time')
+
+    # the tree to src: the times from every node, and their next nodes
+    times, nexts = router.tree(src)
+    assert np.allclose(times, [expected[u] for u in csr.ids], rtol=1e-5)
+    for v in rand.sample(range(len(csr)), 25):
+        nodes = [v]
+        while nexts[nodes[-1]] != -1:
+            nodes.append(int(nexts[nodes[-1]]))
+        assert nodes[-1] == src
+        _check_path(city_graph, [csr.ids[i] for i in nodes], times[v])
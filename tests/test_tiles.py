@@ -0,0 +1,65 @@
+from io import BytesIO
+from math import floor
+from PIL import Image
+from staticmap import Line, StaticMap
+import tiles
+
+ZOOM = 15
+
+
+def _serve_tiles(server) -> None:
+    """Serves a tile of a different color for each tile around
+    Barcelona."""
+    south, west, north, east = tiles.BARCELONA
+    for x in range(floor(tiles._lon_to_x(west, ZOOM)) - 8,
+                   floor(tiles._lon_to_x(east, ZOOM)) + 8):
+        for y in range(floor(tiles._lat_to_y(north, ZOOM)) - 8,
+                       floor(tiles._lat_to_y(south, ZOOM)) + 8):
+            content = BytesIO()
+            Image.new('RGB', (256, 256), (x % 256, y % 256, 99)).save(
+                content, 'PNG')
+            server.pages[f'/{ZOOM}/{x}/{y}.png'] = content.getvalue()
+
+
+def _render(m: StaticMap, line: list[tuple[float, float]]) -> bytes:
+    m.add_line(Line(line, 'blue', 3))
+    return m.render(zoom=ZOOM).tobytes()
+
+
+def test_base_blocks_are_reused(server, tmp_path):
+    _serve_tiles(server)
+    source = tiles.TileSource(server.url + '/{z}/{x}/{y}.png',
+                              str(tmp_path / 'tiles'))
+    first = [(2.15, 41.38), (2.16, 41.39)]
+    second = [(2.152, 41.381), (2.159, 41.388)]  # another center, inside
+
+    image = _render(tiles.CachedStaticMap(600, 500, source), first)
+    # (the tiles of whole blocks, each one downloaded once)
+    downloads = sum(server.requests.values())
+    assert downloads % tiles.BASE_BLOCK ** 2 == 0
+    assert downloads == len(list((tmp_path / 'tiles').glob('127*/*/*/*')))
+    assert image == _render(StaticMap(
+        600, 500, url_template=source.url_template), first)
+
+    # the blocks of the second map were already drawn by the first one
+    server.requests.clear()
+    image = _render(tiles.CachedStaticMap(400, 300, source), second)
+    assert server.requests == {}
+    assert image == _render(StaticMap(
+        400, 300, url_template=source.url_template), second)
+
+
+def test_offline_blocks_are_not_saved(server, tmp_path):
+    _serve_tiles(server)
+    source = tiles.TileSource(server.url + '/{z}/{x}/{y}.png',
+                              str(tmp_path / 'tiles'), offline=True)
+    m = tiles.CachedStaticMap(300, 300, source)
+    _render(m, [(2.15, 41.38), (2.151, 41.381)])
+    assert not m.complete and server.requests == {}
+    assert list((tmp_path / 'tiles').glob('bases/*/*/*.png')) == []
+
+    source.offline = False
+    m = tiles.CachedStaticMap(300, 300, source)
+    _render(m, [(2.15, 41.38), (2.151, 41.381)])
+    assert m.complete and \
+        list((tmp_path / 'tiles').glob('bases/*/*/*.png')) != []
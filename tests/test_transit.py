@@ -0,0 +1,54 @@
+import random
+import city
+import routing
+import transit
+
+
+def test_journey_paths_follow_the_city_graph(small_city):
+    streets, buses, linies = small_city
+    g = city.build_city_graph(streets, buses)
+    net = transit.build_network(linies)
+    router = routing.Router(routing.to_csr(g))
+    rand = random.Random(3)
+
+    taken = 0
+    for _ in range(50):
+        src, dst = [(41.39 + rand.random() * 0.015,
+                     2.15 + rand.random() * 0.019) for _ in range(2)]
+        journey = transit.fastest(net, src, dst, departure=600)
+        assert journey.arrival <= transit.journeys(net, src, dst, 600)[0] \
+            .arrival
+        path = city.find_journey_path(streets, g, src, dst, net, journey,
+                                      router)
+        path.get_other_data()
+
+        nodes = [path.source] + path.path + [path.dest]
+        assert all(g.has_edge(u, v) for u, v in zip(nodes, nodes[1:]))
+        assert path.time == journey.time
+        buses_taken = [leg for leg in journey.legs if leg.kind == 'bus']
+        assert journey.transfers == max(len(buses_taken) - 1, 0)
+        for leg in buses_taken:
+            assert leg.stops[0] == leg.src and leg.stops[-1] == leg.dst
+            assert path.colors[leg.src] == 'orange'
+            assert f'take bus {leg.line}' in path.path_indications or \
+                f'transfer to line {leg.line}' in path.path_indications
+            taken += 1
+    assert taken > 0
+
+
+def test_routes_named_by_their_lines(small_city):
+    linies = list(small_city[2])
+    # a line along part of L0, whose stops are served by more lines of L0
+    # (and so by L0 more than by itself)
+    parades = [dict(p, Linies=p['Linies'] + ' - L0 - X9 - L0')
+               for p in linies[0]['Parades']['Parada'][2:6]]
+    linies.append({'Nom': 'X9', 'Parades': {'Parada': parades}})
+    net = transit.build_network(linies)
+
+    names = {}
+    for route in net.routes:
+        names.setdefault(route.line, set()).add(
+            tuple(net.stops[s] for s in route.stops))
+    assert set(names) == {linia['Nom'] for linia in linies}
+    run = tuple(p['CodAMB'] for p in parades)
+    assert names['X9'] == {run, run[::-1]}
@@ -0,0 +1,221 @@
+"""
+Map tiles for the staticmap images, kept in a local cache.
+
+The tiles are saved at the cache directory the first time they are
+downloaded, so the next maps are drawn without waiting for the tiles server.
+In offline mode, the tiles that are not in the cache are left blank instead
+of downloaded. The base layer of the maps is also saved by blocks of
+BASE_BLOCK x BASE_BLOCK tiles on a fixed grid of each zoom, so a map of an
+area already drawn (at the same zoom, whatever its size and center) only has
+to paste a few blocks and paint its lines and markers over them.
+"""
+from copy import copy
+from dataclasses import dataclass
+from functools import lru_cache
+from io import BytesIO
+from math import ceil, cos, floor, log, pi, tan
+from typing import Any
+from urllib.parse import urlsplit
+import hashlib
+import os
+import tempfile
+import requests
+from PIL import Image
+from staticmap import StaticMap
+
+
+TILES_URL = 'https://a.tile.openstreetmap.org/{z}/{x}/{y}.png'
+TILES_DIR = 'tiles'  # cache directory
+TILE_SIZE = 256  # pixels
+TIMEOUT = 10  # seconds
+BASE_BLOCK = 4  # tiles by side of the blocks of the saved base layers
+# (south, west, north, east) of the tiles to download with prefetch()
+BARCELONA = (41.32, 2.05, 41.47, 2.23)
+
+
+@dataclass
+class TileSource:
+    url_template: str = TILES_URL
+    cache_dir: str | None = TILES_DIR  # None: don't cache anything
+    offline: bool = False
+    timeout: float = TIMEOUT
+    tile_size: int = TILE_SIZE
+
+    def path(self, url: str) -> str | None:
+        """Path of the tile at url in the cache."""
+        if self.cache_dir is None:
+            return None
+        parts = urlsplit(url)
+        name = parts.path.strip('/')
+        if parts.query:
+            name += '_' + hashlib.sha1(parts.query.encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, parts.netloc.replace(':', '_'),
+                            *name.split('/'))
+
+    def cached(self, url: str) -> bool:
+        """Returns whether the tile at url is in the cache."""
+        path = self.path(url)
+        return path is not None and os.path.exists(path)
+
+    def get(self, url: str, **kwargs: Any) -> tuple[int, bytes]:
+        """
+        Returns the status code and the content of the tile at url, from
+        the cache if it is there. Otherwise it is downloaded (and cached),
+        or, in offline mode, a blank tile is returned.
+        """
+        path = self.path(url)
+        if path is not None and os.path.exists(path):
+            file = open(path, 'rb')
+            content = file.read()
+            file.close()
+            return 200, content
+        if self.offline:
+            return 200, _blank_tile(self.tile_size)
+
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        response = requests.get(url, **kwargs)
+        if response.status_code == 200 and path is not None:
+            _write(path, response.content)
+        return response.status_code, response.content
+
+    def base_path(self, m: StaticMap, x: int, y: int) -> str | None:
+        """Path in the cache of the block of the base layer of m (at its
+        zoom) whose first tile is (x, y)."""
+        if self.cache_dir is None:
+            return None
+        tiles = (self.url_template, m.tile_size, m.reverse_y)
+        key = hashlib.sha1(repr(tiles).encode()).hexdigest()
+        return os.path.join(self.cache_dir, 'bases', key, str(m.zoom),
+                            f'{x}_{y}.png')
+
+
+default_source = TileSource()
+
+
+class CachedStaticMap(StaticMap):
+    """StaticMap that takes its tiles from a TileSource and reuses the
+    blocks of the base layer already drawn."""
+
+    def __init__(self, width: int, height: int,
+                 source: TileSource | None = None, **kwargs: Any) -> None:
+        self.source = source if source is not None else default_source
+        self.complete = True  # no tile was left blank
+        super().__init__(width, height,
+                         url_template=self.source.url_template,
+                         tile_size=self.source.tile_size, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> tuple[int, bytes]:
+        if self.source.offline and not self.source.cached(url):
+            self.complete = False
+        return self.source.get(url, **kwargs)
+
+    def _draw_base_layer(self, image: Image.Image) -> None:
+        if self.source.cache_dir is None:
+            super()._draw_base_layer(image)
+            return
+
+        self.complete = True
+        half_width = 0.5 * self.width / self.tile_size
+        half_height = 0.5 * self.height / self.tile_size
+        for bx in range(floor((self.x_center - half_width) / BASE_BLOCK),
+                        ceil((self.x_center + half_width) / BASE_BLOCK)):
+            for by in range(floor((self.y_center - half_height) / BASE_BLOCK),
+                            ceil((self.y_center + half_height) / BASE_BLOCK)):
+                x, y = bx * BASE_BLOCK, by * BASE_BLOCK
+                block = self._base_block(x, y)
+                image.paste(block, (self._x_to_px(x), self._y_to_px(y)),
+                            block)
+
+    def _base_block(self, x: int, y: int) -> Image.Image:
+        """Returns the block of the base layer whose first tile is (x, y),
+        from the cache if it is there."""
+        path = self.source.base_path(self, x, y)
+        assert path is not None
+        if os.path.exists(path):
+            return Image.open(path).convert('RGBA')
+
+        # the tiles of the block are drawn as the ones of a map of its size
+        size = BASE_BLOCK * self.tile_size
+        view = copy(self)
+        view.width = view.height = size
+        view.x_center = x + BASE_BLOCK / 2
+        view.y_center = y + BASE_BLOCK / 2
+        view.complete = True
+        block = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+        StaticMap._draw_base_layer(view, block)
+
+        # a block with blank tiles would hide them once online
+        if view.complete:
+            content = BytesIO()
+            block.save(content, 'PNG')
+            _write(path, content.getvalue())
+        else:
+            self.complete = False
+        return block
+
+
+def static_map(width: int, height: int, **kwargs: Any) -> CachedStaticMap:
+    """Returns a StaticMap of the given size using the default source."""
+    return CachedStaticMap(width, height, default_source, **kwargs)
+
+
+def set_default_source(source: TileSource) -> None:
+    """Makes the maps of static_map() use source (for example, another
+    tiles server, another cache directory or the offline mode)."""
+    global default_source
+    default_source = source
+
+
+def prefetch(bbox: tuple[float, float, float, float] = BARCELONA,
+             zooms: range = range(12, 17),
+             source: TileSource | None = None) -> int:
+    """
+    Downloads to the cache all the tiles of the (south, west, north, east)
+    bounding box at the given zooms, so later maps of that area can be
+    drawn offline. Returns the number of tiles downloaded.
+    """
+    if source is None:
+        source = default_source
+    south, west, north, east = bbox
+    downloaded = 0
+    for z in zooms:
+        for x in range(floor(_lon_to_x(west, z)),
+                       floor(_lon_to_x(east, z)) + 1):
+            for y in range(floor(_lat_to_y(north, z)),
+                           floor(_lat_to_y(south, z)) + 1):
+                url = source.url_template.format(z=z, x=x, y=y)
+                if not source.cached(url):
+                    status, _ = source.get(url)
+                    downloaded += status == 200
+    return downloaded
+
+
+def _lon_to_x(lon: float, zoom: int) -> float:
+    """Tile number (with decimals) of the longitude."""
+    return (lon + 180) / 360 * 2 ** zoom
+
+
+def _lat_to_y(lat: float, zoom: int) -> float:
+    """Tile number (with decimals) of the latitude."""
+    lat = lat * pi / 180
+    return (1 - log(tan(lat) + 1 / cos(lat)) / pi) / 2 * 2 ** zoom
+
+
+@lru_cache
+def _blank_tile(size: int) -> bytes:
+    """A transparent tile, so the background color of the map is shown."""
+    content = BytesIO()
+    Image.new('RGBA', (size, size), (0, 0, 0, 0)).save(content, 'PNG')
+    return content.getvalue()
+
+
+def _write(path: str, content: bytes) -> None:
+    """Writes content at path atomically (the maps download tiles in
+    several threads)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    file = os.fdopen(fd, 'wb')
+    file.write(content)
+    file.close()
+    os.replace(tmp, path)
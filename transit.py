@@ -0,0 +1,297 @@
+"""
+Round-based (RAPTOR) router over the bus lines of Barcelona.
+
+Instead of running Dijkstra over the whole city graph, each round of the
+search scans the stop sequences of the lines once: round k finds the
+earliest arrival at every stop using at most k buses. Walking is only used
+to go from the source to the first stop, between near stops (footpaths,
+computed once when the network is built) and from the last stop to the
+destination.
+
+There are no timetables, so the waiting time at each boarding is the same
+flat BOARDING penalty used by the 'enllaç' edges of the city graph.
+"""
+from typing import TypeAlias, Any
+from dataclasses import dataclass, field
+import numpy as np
+from buses import get_linies
+
+
+Coord: TypeAlias = tuple[float, float]   # (latitude, longitude)
+Stop: TypeAlias = Any  # CodAMB of a bus stop
+
+WALK_SPEED = 1.5  # m/s, as the 'carrer' edges of the city graph
+BUS_SPEED = 5.5  # m/s, as the 'Bus' edges of the city graph
+DETOUR = 1.3  # street distance / straight line distance
+BOARDING = 150  # seconds, as the 'enllaç' edges of the city graph
+FOOTPATH_RADIUS = 300  # max meters (straight line) walked between two stops
+ACCESS_RADIUS = 1500  # max meters (straight line) walked to or from a stop
+MAX_TRANSFERS = 3
+EARTH_RADIUS = 6371008.8  # meters
+
+
+@dataclass(slots=True)
+class Route:
+    line: str
+    stops: list[int]  # indexes of the stops, in order
+    times: list[float]  # seconds from the first stop to each stop
+
+
+@dataclass(slots=True)
+class Leg:
+    kind: str  # 'walk' or 'bus'
+    line: str | None  # only for 'bus' legs
+    src: Stop | None  # None: the source of the journey
+    dst: Stop | None  # None: the destination of the journey
+    departure: float  # seconds
+    arrival: float  # seconds
+    stops: list[Stop] = field(default_factory=list)  # of a 'bus' leg, in order
+
+
+@dataclass
+class Journey:
+    legs: list[Leg]
+    departure: float  # seconds
+    arrival: float  # seconds
+    transfers: int  # changes of bus
+
+    @property
+    def time(self) -> int:
+        """Duration of the journey in minutes."""
+        return int(self.arrival - self.departure) // 60
+
+
+@dataclass
+class TransitNetwork:
+    stops: list[Stop]
+    names: list[str]
+    coords: np.ndarray  # (latitude, longitude) of each stop, in radians
+    routes: list[Route]
+    stop_routes: list[list[tuple[int, int]]]  # (route, position) of a stop
+    footpaths: list[list[tuple[int, float]]]  # (stop, seconds) from a stop
+
+
+def build_network(linies: list[Any] | None = None) -> TransitNetwork:
+    """
+    Builds the transit network from the lines of buses.get_linies().
+    Each run of consecutive stops of Barcelona in a line is a route of the
+    line (its 'Nom'), which can be taken in both directions, as the edges
+    of the buses graph.
+    """
+    if linies is None:
+        linies = get_linies()
+
+    index: dict[Stop, int] = {}
+    stops: list[Stop] = []
+    names: list[str] = []
+    coords: list[Coord] = []
+    runs: dict[tuple[int, ...], str] = {}
+
+    for linia in linies:
+        line = linia["Nom"]
+        run: list[int] = []
+        for parada in linia["Parades"]["Parada"] + [None]:
+            if parada is None or parada["Municipi"] != "Barcelona":
+                if len(run) > 1:  # the run ends
+                    runs.setdefault(tuple(run), line)
+                    runs.setdefault(tuple(reversed(run)), line)
+                run = []
+                continue
+
+            code = parada["CodAMB"]
+            if code not in index:
+                index[code] = len(stops)
+                stops.append(code)
+                names.append(parada["Nom"])
+                coords.append((parada["UTM_X"], parada["UTM_Y"]))
+            if not run or run[-1] != index[code]:
+                run.append(index[code])
+
+    rad = np.radians(np.array(coords, dtype=np.float64).reshape(-1, 2))
+    routes: list[Route] = []
+    stop_routes: list[list[tuple[int, int]]] = [[] for _ in stops]
+    for run_stops, line in runs.items():
+        hops = _distance(rad[list(run_stops[:-1])], rad[list(run_stops[1:])])
+        times = [0.0] + list(np.cumsum(hops * DETOUR / BUS_SPEED))
+        for pos, s in enumerate(run_stops):
+            stop_routes[s].append((len(routes), pos))
+        routes.append(Route(line, list(run_stops), times))
+
+    return TransitNetwork(stops, names, rad, routes, stop_routes,
+                          _footpaths(rad))
+
+
+def _distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Haversine distance in meters between coordinates in radians."""
+    dlat = b[..., 0] - a[..., 0]
+    dlon = b[..., 1] - a[..., 1]
+    h = np.sin(dlat / 2) ** 2 + \
+        np.cos(a[..., 0]) * np.cos(b[..., 0]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+
+def _footpaths(rad: np.ndarray,
+               block: int = 512) -> list[list[tuple[int, float]]]:
+    """Walking times between each pair of stops closer than
+    FOOTPATH_RADIUS, computed by blocks of stops to bound memory."""
+    footpaths: list[list[tuple[int, float]]] = [[] for _ in range(len(rad))]
+    for first in range(0, len(rad), block):
+        dist = _distance(rad[first:first + block, None], rad[None, :])
+        for i, j in zip(*np.nonzero(dist <= FOOTPATH_RADIUS)):
+            if first + i != j:
+                footpaths[first + i].append(
+                    (int(j), float(dist[i, j]) * DETOUR / WALK_SPEED))
+    return footpaths
+
+
+def _walks(net: TransitNetwork, coord: Coord) -> dict[int, float]:
+    """Walking times (seconds) between coord and the stops closer than
+    ACCESS_RADIUS."""
+    dist = _distance(np.radians(np.array(coord)), net.coords)
+    near = np.flatnonzero(dist <= ACCESS_RADIUS)
+    return {int(s): float(dist[s]) * DETOUR / WALK_SPEED for s in near}
+
+
+def journeys(net: TransitNetwork, src: Coord, dst: Coord,
+             departure: float = 0,
+             max_transfers: int = MAX_TRANSFERS) -> list[Journey]:
+    """
+    Returns the earliest arrival journeys from src to dst leaving at
+    departure (seconds): the first one only walks, and each of the other
+    ones arrives earlier than the previous one with one more bus.
+    """
+    n = len(net.stops)
+    inf = float('inf')
+    access = _walks(net, src)
+    egress = _walks(net, dst)
+
+    walk = float(_distance(np.radians(np.array(src)),
+                           np.radians(np.array(dst)))) * DETOUR / WALK_SPEED
+    best_dst = departure + walk
+    found = [Journey([Leg('walk', None, None, None, departure, best_dst)],
+                     departure, best_dst, 0)]
+
+    # arrivals[k][s]: earliest arrival at stop s with at most k buses
+    # parents[k][s]: how s was reached in round k (if it improved)
+    arrivals: list[list[float]] = [[inf] * n]
+    parents: list[dict[int, tuple[Any, ...]]] = [{}]
+    best = [inf] * n
+    for s, t in access.items():
+        arrivals[0][s] = best[s] = departure + t
+        parents[0][s] = ('walk', None)
+    marked = set(access)
+
+    for k in range(1, max_transfers + 2):
+        prev = arrivals[k - 1]
+        arr = prev.copy()
+        parent: dict[int, tuple[Any, ...]] = {}
+        arrivals.append(arr)
+        parents.append(parent)
+
+        # first position of a marked stop in each route
+        queue: dict[int, int] = {}
+        for s in marked:
+            for r, pos in net.stop_routes[s]:
+                if pos < queue.get(r, pos + 1):
+                    queue[r] = pos
+
+        improved: set[int] = set()
+        for r, first in queue.items():
+            route = net.routes[r]
+            board = -1  # position where the bus was taken
+            board_time = inf
+            for pos in range(first, len(route.stops)):
+                s = route.stops[pos]
+                t = board_time + route.times[pos] - route.times[board]
+                if board >= 0 and t < min(best[s], best_dst):
+                    arr[s] = best[s] = t
+                    parent[s] = ('bus', r, board, pos)
+                    improved.add(s)
+                if prev[s] + BOARDING < (t if board >= 0 else inf):
+                    board, board_time = pos, prev[s] + BOARDING
+
+        # footpaths from the stops reached by bus in this round
+        for s in list(improved):
+            for u, w in net.footpaths[s]:
+                if arr[s] + w < min(best[u], best_dst):
+                    arr[u] = best[u] = arr[s] + w
+                    parent[u] = ('walk', s)
+                    improved.add(u)
+
+        arrival, last = min(((arr[s] + t, s) for s, t in egress.items()),
+                            default=(inf, -1))
+        if arrival < best_dst:
+            best_dst = arrival
+            found.append(_journey(net, arrivals, parents, k, last,
+                                  departure, arrival))
+        marked = improved
+        if not marked:
+            break
+
+    return found
+
+
+def fastest(net: TransitNetwork, src: Coord, dst: Coord,
+            departure: float = 0,
+            max_transfers: int = MAX_TRANSFERS) -> Journey:
+    """Returns the journey from src to dst that arrives earliest."""
+    return journeys(net, src, dst, departure, max_transfers)[-1]
+
+
+def _journey(net: TransitNetwork, arrivals: list[list[float]],
+             parents: list[dict[int, tuple[Any, ...]]], k: int, s: int,
+             departure: float, arrival: float) -> Journey:
+    """Rebuilds the journey of round k that gets off at the stop s."""
+    legs = [Leg('walk', None, net.stops[s], None, arrivals[k][s], arrival)]
+    buses = 0
+    while True:
+        while s not in parents[k]:  # not improved in this round
+            k -= 1
+        how = parents[k][s]
+        if k == 0:
+            legs.append(Leg('walk', None, None, net.stops[s],
+                            departure, arrivals[0][s]))
+            break
+        if how[0] == 'walk':
+            legs.append(Leg('walk', None, net.stops[how[1]], net.stops[s],
+                            arrivals[k][how[1]], arrivals[k][s]))
+            s = how[1]
+        else:
+            route = net.routes[how[1]]
+            board = route.stops[how[2]]
+            legs.append(Leg('bus', route.line, net.stops[board],
+                            net.stops[s], arrivals[k - 1][board] + BOARDING,
+                            arrivals[k][s], [net.stops[t] for t in
+                                             route.stops[how[2]:how[3] + 1]]))
+            buses += 1
+            s, k = board, k - 1
+
+    legs.reverse()
+    return Journey(legs, departure, arrival, max(buses - 1, 0))
+
+
+def indications(net: TransitNetwork, journey: Journey) -> str:
+    """Returns the indications to follow the journey."""
+    if len(journey.legs) == 1:
+        return "Walk to the cinema. You don't need to take a bus!"
+
+    names = dict(zip(net.stops, net.names))
+    indic: str = ''
+    on_bus = False
+    for leg in journey.legs:
+        if leg.kind == 'bus':
+            if on_bus:
+                indic += f"Get off at the stop {names[leg.src]}, " + \
+                         f"and transfer to line {leg.line}.\n"
+            else:
+                indic += f"Walk to the bus stop {names[leg.src]}, " + \
+                         f"and take bus {leg.line}.\n"
+            on_bus = True
+        elif leg.src is not None and leg.dst is not None:  # between stops
+            indic += f"Get off at the stop {names[leg.src]}, " + \
+                     f"and walk to the stop {names[leg.dst]}.\n"
+            on_bus = False
+
+    if journey.legs[-2].kind == 'bus':
+        indic += f"Travel by bus to the stop {names[journey.legs[-2].dst]}.\n"
+    return indic + "Walk to the Cinema."